@@ -47,6 +47,15 @@ cache="/usr/local/share/openfido"
 #
 apiurl="https://api.github.com"
 
+#
+# CATALOG
+#
+# Specifies the github API used to list products, i.e., "rest" to list the repos
+# and get each product manifest separately, or "graphql" to get the repos and their
+# manifests 100 at a time (requires an access token)
+#
+catalog="rest"
+
 #
 # RAWURL
 #
@@ -65,3 +74,74 @@ giturl="https://github.com"
 #
 # Specifies the filename to use when output error tracebacks
 traceback_file="/dev/null"
+
+#
+# HTTP_TTL
+#
+# Specifies the number of seconds during which cached github responses are used
+# without revalidation
+http_ttl=3600
+
+#
+# OFFLINE
+#
+# Uses cached github responses without contacting github
+offline=False
+
+#
+# HTTP_TIMEOUT
+#
+# Specifies the number of seconds to wait for a github response
+http_timeout=30
+
+#
+# HTTP_RETRIES
+#
+# Specifies the number of retries with exponential backoff for failed github requests
+http_retries=3
+
+#
+# HTTP_WORKERS
+#
+# Specifies the maximum number of concurrent github requests
+http_workers=10
+
+#
+# DAEMON_SOCKET
+#
+# Specifies the unix socket on which the openfido daemon serves run requests
+#daemon_socket="/tmp/openfido-1000.sock"
+
+#
+# DAEMON_WORKERS
+#
+# Specifies the number of daemon worker processes (0 uses the number of CPUs)
+daemon_workers=0
+
+#
+# PIPELINE_POOL
+#
+# Specifies the maximum number of warm containers kept for each local pipeline
+# image (0 runs each pipeline in a new container)
+pipeline_pool=0
+
+#
+# PIPELINE_IDLE
+#
+# Specifies the number of seconds after which an idle warm pipeline container exits
+pipeline_idle=600
+
+#
+# PIPELINE_TTL
+#
+# Specifies the number of seconds during which the commit and image of a local
+# pipeline are reused without checking github
+pipeline_ttl=60
+
+#
+# RUN_CACHE
+#
+# Specifies the folder in which the outputs of product and pipeline runs are
+# cached, so that runs with unchanged inputs, options and code are restored
+# instead of run again ("" disables the run cache)
+run_cache=""
@@ -2,6 +2,14 @@ curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${O
 curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${OPENFIDO_BRANCH:-main}/src/openfido-server > /usr/local/bin/openfido-server ; chmod +x /usr/local/bin/openfido-server
 curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${OPENFIDO_BRANCH:-main}/src/openfido.py > /usr/local/bin/openfido.py ; chmod +x /usr/local/bin/openfido.py
 curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${OPENFIDO_BRANCH:-main}/src/openfido_util.py > /usr/local/bin/openfido_util.py ; chmod +x /usr/local/bin/openfido_util.py
+curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${OPENFIDO_BRANCH:-main}/src/openfido_http.py > /usr/local/bin/openfido_http.py ; chmod +x /usr/local/bin/openfido_http.py
+curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${OPENFIDO_BRANCH:-main}/src/openfido_daemon.py > /usr/local/bin/openfido_daemon.py ; chmod +x /usr/local/bin/openfido_daemon.py
+curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${OPENFIDO_BRANCH:-main}/src/openfido_bench.py > /usr/local/bin/openfido_bench.py ; chmod +x /usr/local/bin/openfido_bench.py
+curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${OPENFIDO_BRANCH:-main}/src/openfido_pipeline.py > /usr/local/bin/openfido_pipeline.py ; chmod +x /usr/local/bin/openfido_pipeline.py
+curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${OPENFIDO_BRANCH:-main}/src/openfido_workflow.py > /usr/local/bin/openfido_workflow.py ; chmod +x /usr/local/bin/openfido_workflow.py
+curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${OPENFIDO_BRANCH:-main}/src/openfido_runcache.py > /usr/local/bin/openfido_runcache.py ; chmod +x /usr/local/bin/openfido_runcache.py
+curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${OPENFIDO_BRANCH:-main}/src/openfido_profile.py > /usr/local/bin/openfido_profile.py ; chmod +x /usr/local/bin/openfido_profile.py
+curl -sL https://raw.githubusercontent.com/${OPENFIDO_PROJECT:-openfido/cli}/${OPENFIDO_BRANCH:-main}/src/openfido_server.py > /usr/local/bin/openfido_server.py ; chmod +x /usr/local/bin/openfido_server.py
 test -x /usr/local/bin/python3 || ln -sf `which python3` /usr/local/bin/python3
 curl -sL https://raw.githubusercontent.com/openfido/cli/main/src/requirements.txt > /tmp/requirements.txt 
 apt-get install python3-pip -y
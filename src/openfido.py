@@ -22,8 +22,7 @@ Authentication methods:
 
 __version__ = "0.0.2"
 
-import os, sys, glob, pydoc, warnings, subprocess, signal
-import requests, shutil, importlib, pandas, docker
+import os, sys, json, warnings, importlib
 
 sys.path.append(".")
 sys.path.append(os.getenv("HOME")+"/.openfido")
@@ -35,9 +34,21 @@ orgname = "openfido" # default repo for workflows and pipelines
 branch = "main" # default branch to use when downloading workflows and pipelines
 cache = "/usr/local/share/openfido" # additional path for downloaded modules
 apiurl = "https://api.github.com"
+catalog = "rest" # github API used to list products ("rest" or "graphql")
 rawurl = "https://raw.githubusercontent.com"
 giturl = "https://github.com"
 traceback_file = "/dev/stderr"
+http_ttl = 3600 # seconds during which cached github responses are used without revalidation
+offline = False # use cached github responses without contacting github
+http_timeout = 30 # seconds to wait for a github response
+http_retries = 3 # number of retries with exponential backoff for failed github requests
+http_workers = 10 # maximum number of concurrent github requests
+daemon_socket = f"/tmp/openfido-{os.getuid()}.sock" # unix socket of the openfido daemon
+daemon_workers = 0 # number of daemon worker processes (0 uses the number of CPUs)
+pipeline_pool = 0 # maximum number of warm containers per local pipeline image (0 disables the pool)
+pipeline_idle = 600 # seconds after which an idle warm pipeline container exits
+pipeline_ttl = 60 # seconds during which the commit and image of a local pipeline are reused without checking
+run_cache = "" # folder of the cached outputs of product and pipeline runs ("" disables the run cache)
 try:
 	from openfido_config import *
 except:
@@ -74,10 +85,39 @@ command_streams = {"output":print, "warning":warnings.warn, "error":error, "verb
 #
 # FUNCTION VALIDATE
 #
-callable_functions = ["config","help","index","info","install","show","update","run","server","pipeline","workflow","validate","version"]
+# Each command maps to the module that implements it. Modules are only imported when the
+# command is first resolved, and commands import their own dependencies (requests, pandas,
+# docker) when called, so lightweight commands start without loading them.
+callable_functions = {
+	"config" : __name__,
+	"help" : __name__,
+	"index" : __name__,
+	"info" : __name__,
+	"install" : __name__,
+	"show" : __name__,
+	"update" : __name__,
+	"remove" : __name__,
+	"run" : __name__,
+	"batch" : __name__,
+	"validate" : __name__,
+	"version" : __name__,
+	"daemon" : "openfido_daemon",
+	"pipeline" : "openfido_pipeline",
+	"workflow" : "openfido_workflow",
+	"runcache" : "openfido_runcache",
+	"bench" : "openfido_bench",
+	"server" : "openfido_server",
+}
 def is_valid(function):
 	return function in callable_functions
 
+def get_function(function):
+	"""Resolve a command name to its callable, importing its module on first use"""
+	if not is_valid(function):
+		raise Exception(f"'{function}' is not a valid command")
+	module = importlib.import_module(callable_functions[function])
+	return getattr(module,function)
+
 #
 # CONFIG FUNCTION
 #
@@ -100,9 +140,21 @@ def config(options=[], stream=default_streams):
 			"branch" : branch,
 			"cache" : cache,
 			"apiurl" : apiurl,
+			"catalog" : catalog,
 			"rawurl" : rawurl,
 			"giturl" : giturl,
-			"traceback_file" : "openfido.err"		
+			"traceback_file" : "openfido.err",
+			"http_ttl" : http_ttl,
+			"offline" : offline,
+			"http_timeout" : http_timeout,
+			"http_retries" : http_retries,
+			"http_workers" : http_workers,
+			"daemon_socket" : daemon_socket,
+			"daemon_workers" : daemon_workers,
+			"pipeline_pool" : pipeline_pool,
+			"pipeline_idle" : pipeline_idle,
+			"pipeline_ttl" : pipeline_ttl,
+			"run_cache" : run_cache,
 		}
 		for key,value in result.items():
 			if type(value) is str:
@@ -120,9 +172,21 @@ def config(options=[], stream=default_streams):
 			"branch" : branch,
 			"cache" : cache,
 			"apiurl" : apiurl,
+			"catalog" : catalog,
 			"rawurl" : rawurl,
 			"giturl" : giturl,		
-			"traceback_file" : traceback_file
+			"traceback_file" : traceback_file,
+			"http_ttl" : http_ttl,
+			"offline" : offline,
+			"http_timeout" : http_timeout,
+			"http_retries" : http_retries,
+			"http_workers" : http_workers,
+			"daemon_socket" : daemon_socket,
+			"daemon_workers" : daemon_workers,
+			"pipeline_pool" : pipeline_pool,
+			"pipeline_idle" : pipeline_idle,
+			"pipeline_ttl" : pipeline_ttl,
+			"run_cache" : run_cache,
 		}
 		if options[1] in ["-l","--local"]:
 			cfgfile = "./openfido_config.py"
@@ -154,16 +218,17 @@ def config(options=[], stream=default_streams):
 # HELP FUNCTION
 #
 def help(options=[], stream=default_streams):
-	"""Syntax: openfido help [COMMAND]
+	"""Syntax: openfido help [COMMAND|PRODUCT]
 
 	The `help` function displays help information using the python help facility.
 	"""
+	import pydoc
 	mod = sys.modules[__name__]
 	if not options:
 		stream["output"](mod.__doc__)
 		stream["output"]("Functions:")
 		for entry in callable_functions:
-			call = getattr(mod,entry)
+			call = get_function(entry)
 			text = pydoc.render_doc(call,renderer=pydoc.plaintext).split("\n")[3].strip()
 			stream["output"](f"\t{text.replace('Syntax: ','')}")
 		stream["output"]("")
@@ -172,62 +237,192 @@ def help(options=[], stream=default_streams):
 	elif len(options) > 1:
 		raise Exception("help is only available on one command at a time")
 	elif is_valid(options[0]):
-		call = getattr(mod,options[0])
+		call = get_function(options[0])
 		text = pydoc.render_doc(call,renderer=pydoc.plaintext).split("\n")[3:]
 		for line in text:
 			stream["output"](line.strip())
 		return text
 	else:
-		raise Exception(f"help on '{options[0]}' not available or command not found")
+		registry = read_registry()
+		if not options[0] in registry.keys() or "error" in registry[options[0]].keys():
+			raise Exception(f"help on '{options[0]}' not available or command not found")
+		text = get_product_text(registry[options[0]])
+		for line in text:
+			stream["output"](line)
+		return text
 
 #
-# LIST FUNCTION
+# GITHUB ACCESS
 #
-def index(options=[], stream=default_streams):
-	"""Syntax: openfido index [PATTERN]
+def get_http_options(stream=default_streams):
+	"""Get the openfido HTTP cache and connection options"""
+	return {
+		"cachedir" : f"{cache}/.http",
+		"ttl" : http_ttl,
+		"offline" : offline,
+		"timeout" : http_timeout,
+		"retries" : http_retries,
+		"stream" : stream,
+		}
 
-	The `index` function lists the contents of the public openfido product library.
-	"""
-	headers = {}
+def get_urls(urls,headers={},stream=default_streams):
+	"""Get several github URLs concurrently through the openfido HTTP cache"""
+	import openfido_http
+	return openfido_http.get_many(urls,headers=headers,workers=http_workers,**get_http_options(stream))
+
+def get_headers(stream=default_streams):
+	"""Get the github API request headers"""
 	if authentication_token.token:
-		headers = {"Authorization": f"token {authentication_token.token.strip()}"}
-	else:
-		stream["verbose"]("using unauthenticated access")
+		return {"Authorization": f"token {authentication_token.token.strip()}"}
+	stream["verbose"]("using unauthenticated access")
+	return {}
+
+def get_repos(stream=default_streams):
+	"""Get the repos of the openfido organization, following all result pages"""
+	import openfido_http
+	headers = get_headers(stream)
 	url = f"{apiurl}/orgs/{orgname}/repos"
-	data = requests.get(url,headers=headers,params={}).json()
+	data = openfido_http.get_pages(url,headers=headers,params={"per_page":100},**get_http_options(stream))
 	if not data:
 		raise Exception(f"unable to reach repo list for org '{orgname}' at {apiurl}")
-	elif not type(data) is list:
-		raise Exception(f"API error for org '{orgname}' at {url}: response ({type(data)}) = {data}")
 	if authentication_token.token:
 		stream["verbose"]("access token ok")
-	repos = dict(zip(list(map(lambda r:r['name'],data)),data))
-	if len(options) > 0:
-		result = []
-		for option in options:
-			for repo in list(repos.keys()):
-				if repo in result:
-					continue
-				pos = repo.find(option[option[0]=='^':])
-				if pos < 0:
-					continue
-				url = f"{rawurl}/{orgname}/{repo}/{branch}/openfido.json"
+	return dict(zip(list(map(lambda r:r['name'],data)),data))
+
+def get_manifests(names,stream=default_streams):
+	"""Get the openfido.json manifests of several products concurrently
+
+	Returns:
+		dict of product names and their manifest response (or exception if the request failed)
+	"""
+	urls = [f"{rawurl}/{orgname}/{name}/{branch}/openfido.json" for name in names]
+	return dict(zip(names,get_urls(urls,stream=stream)))
+
+def read_manifest(response):
+	"""Read a manifest from a response, or None if it is not valid"""
+	try:
+		return response.json()
+	except:
+		return None
+
+graphql_query = """query($org: String!, $ref: String!, $manifest: String!, $cursor: String) {
+  organization(login: $org) {
+    repositories(first: 100, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        name
+        defaultBranchRef { name }
+        ref(qualifiedName: $ref) { target { oid } }
+        manifest: object(expression: $manifest) { ... on Blob { text } }
+      }
+    }
+  }
+}"""
+
+def get_rest_catalog(select=None, stream=default_streams):
+	"""Get the product catalog using the github REST API and one manifest request per repo"""
+	repos = get_repos(stream)
+	names = [name for name in repos.keys() if not select or select(name)]
+	result = {}
+	for name, data in get_manifests(names,stream).items():
+		url = f"{rawurl}/{orgname}/{name}/{branch}/openfido.json"
+		manifest = read_manifest(data)
+		if isinstance(data,Exception):
+			error = f"manifest read failed: url={url}, error={data}"
+		elif not manifest:
+			error = f"manifest read failed: url={url}, status_code={data.status_code}, headers={data.headers}, body=[{data.text}]"
+		else:
+			error = None
+		result[name] = {
+			"name" : name,
+			"branch" : repos[name].get("default_branch",None),
+			"commit" : None,
+			"manifest" : manifest,
+			"error" : error,
+			}
+	return result
+
+def get_graphql_catalog(select=None, stream=default_streams):
+	"""Get the product catalog using paginated github GraphQL queries of 100 repos each"""
+	import openfido_http
+	headers = get_headers(stream)
+	if not headers:
+		raise Exception("the graphql catalog requires a github access token")
+	url = f"{apiurl}/graphql"
+	variables = {"org":orgname, "ref":f"refs/heads/{branch}", "manifest":f"{branch}:openfido.json", "cursor":None}
+	result = {}
+	while True:
+		reply = openfido_http.post(url,{"query":graphql_query,"variables":variables},headers=headers,**get_http_options(stream))
+		data = reply.json()
+		if "errors" in data or not data.get("data",None) or not data["data"]["organization"]:
+			raise Exception(f"API error for org '{orgname}' at {url}: response ({type(data)}) = {data}")
+		repos = data["data"]["organization"]["repositories"]
+		for repo in repos["nodes"]:
+			name = repo["name"]
+			if select and not select(name):
+				continue
+			manifest = None
+			error = None
+			if not repo["manifest"]:
+				error = f"manifest read failed: '{branch}:openfido.json' not found in '{orgname}/{name}'"
+			else:
 				try:
-					manifest = requests.get(url).json()
-					if manifest["application"] == "openfido" and ( option[0] != '^' or pos == 0 ):
-						result.append(repo)
-				except:
-					pass
-	else:
-		result = []
-		for repo in list(repos.keys()):
-			url = f"{rawurl}/{orgname}/{repo}/{branch}/openfido.json"
-			try:
-				manifest = requests.get(url).json()
-				if manifest["application"] == "openfido":
-					result.append(repo)
-			except:
-				pass
+					manifest = json.loads(repo["manifest"]["text"])
+				except Exception as err:
+					error = f"manifest read failed: '{orgname}/{name}/{branch}/openfido.json' is not valid ({err})"
+			result[name] = {
+				"name" : name,
+				"branch" : repo["defaultBranchRef"]["name"] if repo["defaultBranchRef"] else None,
+				"commit" : repo["ref"]["target"]["oid"] if repo["ref"] else None,
+				"manifest" : manifest,
+				"error" : error,
+				}
+		if not repos["pageInfo"]["hasNextPage"]:
+			break
+		variables["cursor"] = repos["pageInfo"]["endCursor"]
+	stream["verbose"]("access token ok")
+	return result
+
+catalog_backends = {
+	"rest" : get_rest_catalog,
+	"graphql" : get_graphql_catalog,
+}
+
+def get_catalog(select=None, stream=default_streams):
+	"""Get the product catalog of the openfido organization
+
+	Parameters:
+		select (callable)   Filter on repo names (default None selects all repos)
+
+	Returns:
+		dict of repo names and their catalog entry, i.e., `name`, default `branch`,
+		`commit` of the configured branch (if known), `manifest` (or None), and
+		`error` message (or None)
+	"""
+	if not catalog in catalog_backends.keys():
+		raise Exception(f"catalog '{catalog}' is not valid (expected one of {list(catalog_backends.keys())})")
+	return catalog_backends[catalog](select,stream)
+
+def is_product(entry):
+	"""Check whether a catalog entry is an openfido product"""
+	return type(entry["manifest"]) is dict and entry["manifest"].get("application",None) == "openfido"
+
+#
+# LIST FUNCTION
+#
+def index(options=[], stream=default_streams):
+	"""Syntax: openfido index [PATTERN]
+
+	The `index` function lists the contents of the public openfido product library.
+	"""
+	def matches(repo):
+		for option in options:
+			pos = repo.find(option[option[0]=='^':])
+			if pos == 0 or ( pos > 0 and option[0] != '^' ):
+				return True
+		return False
+	products = get_catalog(matches if options else None,stream)
+	result = [name for name, entry in products.items() if is_product(entry)]
 
 	for name in sorted(result):
 		stream["output"](name)
@@ -246,16 +441,24 @@ def info(options=[], stream=default_streams):
 	elif len(options) > 1:
 		raise Exception("only one product name is allowed")
 	name = options[0]
-	path = f"{cache}/{name}/__init__.py"
-	if os.path.exists(path):
-		stream["verbose"](f"examining {path}")
-		spec = importlib.util.spec_from_file_location(name,path)
-		module = importlib.util.module_from_spec(spec)
-		spec.loader.exec_module(module)
-		text = pydoc.render_doc(module,renderer=pydoc.plaintext).split("\n")
-		for line in text:
-			stream["output"](line)
-		return text
+	registry = read_registry()
+	if name in registry.keys() and not "error" in registry[name].keys():
+		stream["verbose"](f"examining {cache}/{name}")
+		text = get_product_text(registry[name])
+	else:
+		stream["verbose"](f"'{name}' is not installed, examining {rawurl}/{orgname}/{name}")
+		products = get_catalog(lambda repo: repo == name,stream)
+		if not name in products.keys() or not is_product(products[name]):
+			raise Exception(f"'{name}' is not an openfido product")
+		text = [f"{key}: {value}" for key, value in products[name]["manifest"].items()]
+		if products[name]["commit"]:
+			text.append(f"commit: {products[name]['commit']}")
+		readme = get_urls([f"{rawurl}/{orgname}/{name}/{branch}/README.md"],stream=stream)[0]
+		if not isinstance(readme,Exception) and readme.status_code == 200:
+			text.extend([""] + readme.text.split("\n"))
+	for line in text:
+		stream["output"](line)
+	return text
 
 
 #
@@ -266,20 +469,6 @@ def install(options=[], stream=default_streams):
 
 	The `install` command installs one or more public openfido products on the local system.
 	"""
-	headers = {}
-	if authentication_token.token:
-		headers = {"Authorization": f"token {authentication_token.token.strip()}"}
-	else:
-		stream["verbose"]("using unauthenticated access")
-	url = f"{apiurl}/orgs/{orgname}/repos"
-	data = requests.get(url,headers=headers,params={}).json()
-	if not data:
-		raise Exception(f"unable to reach repo list for org '{orgname}' at {apiurl}")
-	elif not type(data) is list:
-		raise Exception(f"API error for org '{orgname}' at {url}: response ({type(data)}) = {data}")
-	if authentication_token.token:
-		stream["verbose"]("access token ok")
-	repos = dict(zip(list(map(lambda r:r['name'],data)),data))
 	dryrun = os.system
 	failed = []
 	done = []
@@ -290,22 +479,18 @@ def install(options=[], stream=default_streams):
 			else:
 				raise Exception(f"option '{option}' is invalid")
 
-	for name in options:
-		if name[0] == '-':
-			continue
-		elif not name in repos.keys():
+	names = [name for name in options if name[0] != '-']
+	products = get_catalog(lambda repo: repo in names,stream)
+	targets = {}
+	for name in names:
+		if not name in products.keys():
 			stream["error"](f"'{name}' not found in openfido repository")
 			failed.append(name)
 		else:
-			repo = repos[name]
-			url = f"{rawurl}/{orgname}/{name}/{branch}/openfido.json"
-			data = requests.get(url)
-			try:
-				manifest = data.json()
-			except:
-				manifest = None
-			if not manifest:
-				stream["error"](f"manifest read failed: url={url}, status_code={data.status_code}, headers={data.headers}, body=[{data.text}]") 
+			manifest = products[name]["manifest"]
+			if products[name]["error"]:
+				stream["error"](products[name]["error"])
+				failed.append(name)
 			elif not "application" in manifest.keys() or manifest["application"] != "openfido":
 				stream["error"](f"tool '{name}' is not an openfido application")
 				failed.append(name)
@@ -317,31 +502,242 @@ def install(options=[], stream=default_streams):
 					stream["warning"](f"tool '{name}' has no version")
 				if not "tooltype" in manifest.keys() or manifest["tooltype"] not in ("pipeline","workflow"):
 					stream["warning"](f"tool '{name}' type is missing or invalid")
-				stream["verbose"](f"{name}: {manifest['tooltype']} version {manifest['version']} is valid")
-				source = f"{giturl}/{orgname}/{name}"
-				target = f"{cache}/{name}"
-				if os.path.exists(target):
-					stream["warning"](f"'{name}' is already installed")
-					done.append(name)
-				elif os.system(f"git clone -q {source} {target} -b {branch} --depth 1") != 0:
-					stream["error"](f"unable to clone '{name}' into openfido cache '{cache}'")
-					failed.append(name)
-				else:
-					stream["verbose"](f"'{name}' cloned ok")
-					done.append(name)
+				stream["verbose"](f"{name}: {manifest.get('tooltype',None)} version {manifest.get('version',None)} is valid")
+				targets[name] = f"{cache}/{name}"
+
+	# clone the products concurrently
+	clones = []
+	for name, target in targets.items():
+		if os.path.exists(target):
+			stream["warning"](f"'{name}' is already installed")
+		else:
+			clones.append(name)
+	if clones:
+		from concurrent.futures import ThreadPoolExecutor
+		def clone(name):
+			return dryrun(f"git clone -q {giturl}/{orgname}/{name} {targets[name]} -b {branch} --depth 1")
+		with ThreadPoolExecutor(max_workers=min(http_workers,len(clones))) as pool:
+			codes = list(pool.map(clone,clones))
+		for name, code in zip(clones,codes):
+			if code:
+				stream["error"](f"unable to clone '{name}' into openfido cache '{cache}'")
+				failed.append(name)
+				del targets[name]
+			else:
+				stream["verbose"](f"'{name}' cloned ok")
+	for name, target in list(targets.items()):
+		if not os.path.exists(f"{target}/__init__.py") \
+				and os.path.exists(f"{target}/openfido.py") \
+				and os.system(f"ln -sf {target}/openfido.py {target}/__init__.py"):
+			stream["error"](f"unable to link '{target}/__init__.py' to '{target}/openfido.py'")
+			failed.append(name)
+			del targets[name]
+
+	# install the requirements of all the products with a single resolution
+	requirements, conflicts = merge_requirements(targets)
+	for name, messages in conflicts.items():
+		for message in messages:
+			stream["error"](f"'{name}' requirement {message}")
+		failed.append(name)
+		del targets[name]
+	if requirements and dryrun is not os.system:
+		stream["verbose"](f"installing {len(requirements)} requirements for {list(targets.keys())}")
+		dryrun("\n".join(["python3 -m pip install -r /dev/stdin <<'EOF'"]+requirements+["EOF"]))
+	elif requirements:
+		import tempfile
+		with tempfile.NamedTemporaryFile("w",prefix="openfido-",suffix=".txt",delete=False) as fh:
+			fh.write("\n".join(requirements)+"\n")
+		try:
+			stream["verbose"](f"installing {len(requirements)} requirements for {list(targets.keys())}")
+			code = dryrun(f"python3 -m pip install -r {fh.name}")
+		finally:
+			os.remove(fh.name)
+		if code:
+			# find out which products cannot be installed
+			for name, target in list(targets.items()):
 				if os.path.exists(f"{target}/requirements.txt") \
-						and os.system(f"python3 -m pip install -r {target}/requirements.txt") != 0:
+						and dryrun(f"python3 -m pip install -r {target}/requirements.txt") != 0:
 					stream["error"](f"unable to install '{target}/requirements.txt'")
 					failed.append(name)
-				if not os.path.exists(f"{target}/__init__.py") \
-						and os.path.exists(f"{target}/openfido.py") \
-						and os.system(f"ln -sf {target}/openfido.py {target}/__init__.py"):
-					stream["error"](f"unable to link '{target}/__init__.py' to '{target}/openfido.py'")
-					failed.append(name)
-				# TODO: implement installation
-				done.append(name)
+					del targets[name]
+	done.extend(targets.keys())
+	read_registry(rescan=done)
 	return {"ok":len(done), "errors":len(failed), "done":done, "failed": failed}
 
+def merge_requirements(targets):
+	"""Merge the requirements of several products into one requirement set
+
+	Only `==` pins of the same package to different versions are reported as
+	conflicts. Other incompatible specifiers, e.g., `>=2` and `<2`, are passed
+	on to pip, which fails to resolve the merged set, after which `install`
+	finds the products that cannot be installed one at a time.
+
+	Parameters:
+		targets (dict)   Product names and their install folders
+
+	Returns:
+		list of requirements, and dict of product names and their conflicting requirements
+	"""
+	import re
+	requirements = []
+	conflicts = {}
+	pins = {} # pinned version and product of each package
+	for name, target in targets.items():
+		if not os.path.exists(f"{target}/requirements.txt"):
+			continue
+		lines = []
+		with open(f"{target}/requirements.txt","r") as fh:
+			for line in fh:
+				line = line.split(" #")[0].strip()
+				if not line or line[0] == '#':
+					continue
+				specs = line.split()
+				if specs[0] in ["-r","--requirement","-c","--constraint","-e","--editable"] \
+						and len(specs) == 2 and not "://" in specs[1]:
+					line = f"{specs[0]} {os.path.join(target,specs[1])}"
+				lines.append(line)
+		product_pins = {}
+		for line in lines:
+			match = re.match(r"([A-Za-z0-9][A-Za-z0-9._-]*)\s*==\s*([^\s;,]+)",line)
+			if match:
+				package = re.sub(r"[-_.]+","-",match.group(1)).lower()
+				version = match.group(2)
+				if package in pins and pins[package][0] != version:
+					conflicts.setdefault(name,[]).append(f"{package}=={version} conflicts with {package}=={pins[package][0]} required by '{pins[package][1]}'")
+				product_pins[package] = version
+		if name in conflicts:
+			continue
+		for package, version in product_pins.items():
+			pins.setdefault(package,(version,name))
+		requirements.extend([line for line in lines if not line in requirements])
+	return requirements, conflicts
+
+#
+# PRODUCT REGISTRY
+#
+registry_filename = ".registry.json"
+def get_commit(path):
+	"""Get the commit checked out in a product folder without running git"""
+	try:
+		with open(f"{path}/.git/HEAD","r") as fh:
+			head = fh.read().strip()
+		if not head.startswith("ref: "):
+			return head
+		ref = head[5:]
+		if os.path.exists(f"{path}/.git/{ref}"):
+			with open(f"{path}/.git/{ref}","r") as fh:
+				return fh.read().strip()
+		with open(f"{path}/.git/packed-refs","r") as fh:
+			for line in fh:
+				specs = line.split()
+				if len(specs) == 2 and specs[1] == ref:
+					return specs[0]
+	except:
+		pass
+	return None
+
+def get_mtime(path):
+	"""Get the last modification time of a product's module and manifest"""
+	mtime = 0
+	for file in ["__init__.py","openfido.json"]:
+		if os.path.exists(f"{path}/{file}"):
+			mtime = max(mtime,os.stat(f"{path}/{file}").st_mtime)
+	return mtime
+
+def scan_product(name):
+	"""Get the registry entry of an installed product without importing it
+
+	The manifest is read from `openfido.json`, and the docstring and entry points
+	are obtained by parsing `__init__.py`.
+	"""
+	import ast
+	path = f"{cache}/{name}"
+	entry = {"name":name, "mtime":get_mtime(path), "commit":get_commit(path)}
+	try:
+		if not os.path.exists(f"{path}/openfido.json"):
+			raise Exception(f"'{cache}/{name}' not found")
+		if not os.path.exists(f"{path}/__init__.py"):
+			raise Exception(f"'{path}/__init__.py' not found")
+		with open(f"{path}/openfido.json","r") as fh:
+			manifest = json.load(fh)
+		with open(f"{path}/__init__.py","r") as fh:
+			tree = ast.parse(fh.read(),f"{path}/__init__.py")
+	except Exception as err:
+		entry["error"] = str(err)
+		return entry
+	entry["version"] = manifest.get("version",None)
+	entry["tooltype"] = manifest.get("tooltype",None)
+	entry["inputs"] = manifest.get("inputs",None)
+	entry["outputs"] = manifest.get("outputs",None)
+	entry["doc"] = ast.get_docstring(tree)
+	entry["entry_points"] = {}
+	for node in tree.body:
+		if isinstance(node,(ast.FunctionDef,ast.AsyncFunctionDef)) and node.name[0] != '_':
+			entry["entry_points"][node.name] = {
+				"signature" : f"{node.name}({ast.unparse(node.args)})",
+				"doc" : ast.get_docstring(node),
+				}
+		elif isinstance(node,ast.ImportFrom):
+			for alias in node.names:
+				call = alias.asname or alias.name
+				if call in ["main","openfido"]:
+					entry["entry_points"][call] = {"signature":f"{call}(...)", "doc":None}
+	return entry
+
+def read_registry(rescan=[]):
+	"""Get the registry of installed products
+
+	Products whose module, manifest or commit changed since they were registered,
+	and products listed in `rescan` are scanned again, and the registry file is
+	updated when anything changed.
+
+	Returns:
+		dict of product names and their registry entries
+	"""
+	file = f"{cache}/{registry_filename}"
+	try:
+		with open(file,"r") as fh:
+			registry = json.load(fh)
+	except:
+		registry = {}
+	installed = []
+	if os.path.isdir(cache):
+		installed = [item.name for item in os.scandir(cache) if item.is_dir() and item.name[0] != '.']
+	changed = False
+	for name in list(registry.keys()):
+		if not name in installed:
+			del registry[name]
+			changed = True
+	for name in installed:
+		path = f"{cache}/{name}"
+		entry = registry.get(name,None)
+		if name in rescan or not entry or entry["mtime"] != get_mtime(path) or entry["commit"] != get_commit(path):
+			registry[name] = scan_product(name)
+			changed = True
+	if changed:
+		try:
+			with open(f"{file}.{os.getpid()}","w") as fh:
+				json.dump(registry,fh,indent=1)
+			os.replace(f"{file}.{os.getpid()}",file)
+		except OSError:
+			pass # the registry is rebuilt next time when the cache is not writable
+	return registry
+
+def get_product_text(entry):
+	"""Get the help text of a registered product"""
+	text = (entry["doc"] or "").split("\n")
+	text.append("")
+	for key in ["version","tooltype","inputs","outputs","commit"]:
+		text.append(f"{key}: {entry[key]}")
+	if entry["entry_points"]:
+		text.extend(["","FUNCTIONS"])
+		for name, spec in entry["entry_points"].items():
+			text.append(f"    {spec['signature']}")
+			for line in (spec["doc"] or "").split("\n"):
+				if line:
+					text.append(f"        {line}")
+	return text
+
 #
 # SHOW FUNCTION
 #
@@ -350,20 +746,16 @@ def show(options=[], stream=default_streams):
 	
 	The `show` function prints out the products with names that match PATTERN.
 	"""
+	import fnmatch
 	if not options:
 		options = ["*"]
+	registry = read_registry()
 	for pattern in options:
-		for path in glob.iglob(f"{cache}/{pattern}"):
-			name = path.split("/")[-1]
-			if not os.path.exists(f"{path}/openfido.json"):
-				raise Exception(f"'{cache}/{name}' not found")
-			sys.path.append(f"{cache}/{name}")
-			if not os.path.exists(f"{path}/__init__.py"):
-				raise Exception(f"'{path}/__init__.py' not found")
-			spec = importlib.util.spec_from_file_location(name,f"{path}/__init__.py")
-			module = importlib.util.module_from_spec(spec)
-			spec.loader.exec_module(module)
-			if not hasattr(module,"main") or not callable(module.main):
+		for name in fnmatch.filter(sorted(registry.keys()),pattern):
+			entry = registry[name]
+			if "error" in entry.keys():
+				raise Exception(entry["error"])
+			if not "main" in entry["entry_points"].keys():
 				raise Exception(f"'{name}/__init__.py' missing callable main")
 			stream["output"](name)
 
@@ -394,6 +786,7 @@ def update(options=[], stream=default_streams):
 			else:
 				stream["warning"](f"'{name}' not found")
 				failed.append(name)
+	read_registry(rescan=done)
 	return {"ok":len(done), "errors":len(failed), "done":done, "failed": failed}
 
 #
@@ -425,36 +818,87 @@ def remove(options=[], stream=default_streams):
 			else:
 				stream["warning"](f"'{name}' not found or not an openfido product")
 				failed.append(name)
+	read_registry()
 	return {"ok":len(done), "errors":len(failed), "done":done, "failed": failed}
 
 #
 # RUN FUNCTION
 #
 def run(options=[], stream=command_streams):
-	"""Syntax: openfido [OPTIONS] run PRODUCT [-FLAG ...] [NAME=VALUE ...] [INPUT,...] [OUTPUT,...] 
+	"""Syntax: openfido [OPTIONS] run [--force|--no-cache|--profile[=FILE]] PRODUCT [-FLAG ...] [NAME=VALUE ...] [INPUT,...] [OUTPUT,...] 
+
+	The `run` function runs an openfido product on the local system. When the
+	openfido daemon is running, the product is run by one of its workers.
 
-	The `run` function runs an openfido product on the local system.
+	When `run_cache` is set, the outputs of a product are restored from the run
+	cache if it was already run with the same inputs, flags and product version.
+	Use `--force` to run the product again, or `--no-cache` to run it without
+	using the run cache.
+
+	With `--profile` the product is run in this process without the run cache,
+	and the time of each phase, the cProfile hotspots, the traced memory and
+	the size of the inputs and outputs are written to a JSON report (see
+	`openfido_profile`).
 	"""
+	use_cache = True
+	force = False
+	profile = None
+	while options and options[0][0] == '-':
+		if options[0] == "--force":
+			force = True
+		elif options[0] == "--no-cache":
+			use_cache = False
+		elif options[0] == "--profile" or options[0].startswith("--profile="):
+			profile = options[0].split("=",1)[1] if "=" in options[0] else ""
+		else:
+			raise Exception(f"run option '{options[0]}' is not valid")
+		options = options[1:]
 	if not options:
 		raise Exception("missing package name")
-	name = options[0]
+	if profile is not None:
+		import openfido_profile
+		return openfido_profile.run_profiled(options,profile,stream)
+	if use_cache and run_cache:
+		import openfido_runcache
+		return openfido_runcache.run_product(options,force,stream)
+	return run_product_local(options,stream)
+
+def run_product_local(options,stream=command_streams):
+	"""Run a product in the daemon if it is running, otherwise in this process"""
+	if daemon_socket and os.path.exists(daemon_socket):
+		import openfido_daemon
+		try:
+			return openfido_daemon.request(daemon_socket,options)
+		except (ConnectionError,TimeoutError) as err:
+			stream["verbose"](f"daemon not responding on '{daemon_socket}' ({err}), running locally")
+	module = load_product(options[0],stream)
+	return run_product(module,options,stream)
+
+def set_default_environ():
+	"""Set the default product I/O folders"""
+	if not "OPENFIDO_INPUT" in os.environ:
+		os.environ["OPENFIDO_INPUT"] = "."
+	if not "OPENFIDO_OUTPUT" in os.environ:
+		os.environ["OPENFIDO_OUTPUT"] = "."
+
+def load_product(name,stream=command_streams):
+	"""Load the module of an installed product, installing it first if needed"""
+	import importlib.util
 	path = f"{cache}/{name}"
 	if not os.path.exists(f"{path}/openfido.json") and not install([name],stream):
 		raise Exception(f"'{cache}/{name}' not found")
-	sys.path.append(f"{cache}/{name}")
+	if not path in sys.path:
+		sys.path.append(path)
 	if not os.path.exists(f"{path}/__init__.py"):
 		raise Exception(f"'{path}/__init__.py' not found")
 	spec = importlib.util.spec_from_file_location(name,f"{path}/__init__.py")
-	if not "OPENFIDO_INPUT" in os.environ:
-		os.environ["OPENFIDO_INPUT"] = "."
-	if not "OPENFIDO_OUTPUT" in os.environ:
-		os.environ["OPENFIDO_OUTPUT"] = "."
+	set_default_environ()
 	module = importlib.util.module_from_spec(spec)
 	spec.loader.exec_module(module)
-	if hasattr(module,"openfido") and callable(module.openfido):
-		return module.openfido(options,stream)
-	if not hasattr(module,"main") or not callable(module.main):
-		raise Exception(f"'{name}/__init__.py' missing callable main")
+	return module
+
+def get_run_options(options):
+	"""Split the `run` command options into the input files, output files and flags"""
 	inputs = []
 	outputs = []
 	flags = []
@@ -467,6 +911,16 @@ def run(options=[], stream=command_streams):
 			outputs = options[n].split(',')
 		else:
 			raise Exception(f"option {options[n]} unexpected")
+	return inputs, outputs, flags
+
+def run_product(module,options,stream=command_streams):
+	"""Run a loaded product module using the `run` command options"""
+	set_default_environ()
+	if hasattr(module,"openfido") and callable(module.openfido):
+		return module.openfido(options,stream)
+	if not hasattr(module,"main") or not callable(module.main):
+		raise Exception(f"'{options[0]}/__init__.py' missing callable main")
+	inputs, outputs, flags = get_run_options(options)
 	if not inputs:
 		inputs = ["/dev/stdin"]
 	if not outputs:
@@ -474,166 +928,155 @@ def run(options=[], stream=command_streams):
 	return module.main(inputs=inputs,outputs=outputs,options=flags)
 
 #
-# SERVER FUNCTION
-#
-def server(options=[], stream=command_streams):
-	"""Syntax: openfido [OPTIONS] server [start|stop|restart|status|update|open|backup|restore] [restore]
-
-	The `server` function controls the local openfido server running on docker.
-	"""
-	if len(options) == 0:
-		raise Exception("missing server command")
-	elif len(options) == 1:
-		subprocess.run(["/usr/local/bin/openfido-server",options[0]])
-	elif len(options) == 2:
-		subprocess.run(["/usr/local/bin/openfido-server",options[0],options[1]])
-	elif len(options) == 3:
-		subprocess.run(["/usr/local/bin/openfido-server",options[0],options[1],options[2]])
-	elif len(options) == 4:
-		subprocess.run(["/usr/local/bin/openfido-server",options[0],options[1],options[2],options[3]])
-	else:
-		raise Exception("too many server commands")
-
-		
-
-#
-# PIPELINE FUNCTION
+# BATCH FUNCTION
 #
-pipeline_filename = ".pipelines.csv"
-def readlocal_pipelines(pipeline_csv=pipeline_filename):
-	try:
-		data = pandas.read_csv(pipeline_csv,dtype=str)
-	except:
-		data = pandas.DataFrame()
-	return data
+batch_module = None # product module loaded in each batch worker process
 
-def addlocal_pipeline(data,row):
-	item = pandas.DataFrame(row)
-	if len(data) == 0:
-		return item
-	else:
-		return pandas.concat([data.set_index(['name']),item.set_index(['name'])],verify_integrity=True).reset_index()
+def batch_init(name):
+	"""Load the batch product once in a worker process"""
+	global batch_module
+	batch_module = load_product(name,default_streams)
 
-def writelocal_pipelines(data,pipeline_csv=pipeline_filename):
-	data.to_csv(pipeline_csv,index=False,columns=data.columns)
+def batch_job(options):
+	"""Run one batch job in a worker process
 
-def runlocal_pipepline(name,image_name,github,branch,entry,inputfolder,outputfolder):
-	client = docker.from_env()
+	Returns:
+		exit status, elapsed wall time in seconds, and error message (or None)
+	"""
+	import time
+	start = time.perf_counter()
 	try:
-		client.get(image_name)
-	except:
-		client.images.pull(image_name)
+		run_product(batch_module,options,default_streams)
+		return 0, time.perf_counter()-start, None
+	except SystemExit as err:
+		return err.code if type(err.code) is int else 1, time.perf_counter()-start, f"exit {err.code}"
+	except Exception as err:
+		return 1, time.perf_counter()-start, str(err)
 
-	container = client.containers.run(image_name,
-		command = f"sh -c 'git clone {github} -b {branch} --depth 1 /tmp/openfido ; cd /tmp/openfido ; export OPENFIDO_INPUT=/tmp/input ; export OPENFIDO_OUTPUT=/tmp/output ; source /tmp/openfido/{entry} 0</dev/null 1>/tmp/output/stdout 2>/tmp/output/stderr' ",
-		auto_remove = True,
-		volumes = {
-			inputfolder : {"bind" : "/tmp/input", "mode" : "ro" },
-			outputfolder : {"bind" : "/tmp/output", "mode" : "rw" },
-		})
+def read_batch_jobs(source,template=None):
+	"""Get the batch jobs from a manifest or an input file pattern
 
-def pipeline(options=[], stream=command_streams):
-	"""Syntax: openfido [OPTIONS] pipeline COMMAND [OPTIONS]
+	A CSV manifest has the columns `inputs`, `outputs` and optionally `flags`, with
+	comma-separated file lists and space-separated flags. A JSONL manifest has the
+	same keys with lists or strings. A pattern is expanded to input files and the
+	output template is formatted with `path`, `dir`, `name`, `stem`, and `ext` of
+	each input file.
 
-	The `pipeline` function is used to create and start pipeline operations.
+	Returns:
+		list of jobs, i.e., dicts of `inputs`, `outputs`, and `flags` lists
+	"""
+	def as_list(value,sep):
+		if not value:
+			return []
+		if type(value) is list:
+			return value
+		return str(value).split(sep)
+	jobs = []
+	if source.endswith(".csv") and os.path.exists(source) and not template:
+		import csv
+		with open(source,"r",newline="") as fh:
+			for row in csv.DictReader(fh):
+				jobs.append({"inputs":as_list(row.get("inputs",None),','),
+					"outputs":as_list(row.get("outputs",None),','),
+					"flags":as_list(row.get("flags",None),' ')})
+	elif source.endswith(".jsonl") and os.path.exists(source) and not template:
+		with open(source,"r") as fh:
+			for line in fh:
+				if line.strip():
+					row = json.loads(line)
+					jobs.append({"inputs":as_list(row.get("inputs",None),','),
+						"outputs":as_list(row.get("outputs",None),','),
+						"flags":as_list(row.get("flags",None),' ')})
+	else:
+		import glob
+		if not template:
+			raise Exception(f"output template is required for input pattern '{source}'")
+		for path in sorted(glob.glob(source)):
+			name = os.path.basename(path)
+			stem, ext = os.path.splitext(name)
+			jobs.append({"inputs":[path],
+				"outputs":template.format(path=path,dir=os.path.dirname(path),name=name,stem=stem,ext=ext).split(','),
+				"flags":[]})
+	return jobs
 
-	COMMAND:
+def batch(options=[], stream=command_streams):
+	"""Syntax: openfido [OPTIONS] batch [-j|--jobs=N] [--summary=CSVFILE] PRODUCT MANIFEST|PATTERN [TEMPLATE] [-FLAG ...] [NAME=VALUE ...]
 
-		create [-l|--local] NAME DOCKER GITHUB BRANCH ENTRY [DESCRIPTION]
-		start [-l|--local] NAME INPUTFOLDER OUTPUTFOLDER 
-		delete [-l|--local] NAME
-		list [-l|--local]
+	The `batch` function runs an openfido product on many input sets. The jobs are
+	read from a CSV or JSONL manifest of inputs, outputs and flags, or from a glob
+	PATTERN of input files with an output TEMPLATE, e.g., 'out/{stem}.json'. The
+	product is imported once in each worker process, and the jobs run on a process
+	pool with one worker per CPU unless --jobs is given. Each job must have its own
+	output files, because jobs writing to stdout would interleave. Failed jobs are
+	reported in the summary without stopping the batch.
 	"""
-	if len(options) < 1:
-		raise Exception("missing pipeline command")
-	command = options[0]
-	local = False
+	import time
+	from concurrent.futures import ProcessPoolExecutor, as_completed
+	workers = os.cpu_count()
+	summary = None
 	args = []
-	for option in options[1:]:
-		if option[0] == '-':
-			if option in ["-l","--local"]:
-				local = True
-			else:
-				stream["error"](f"option '{option}' is not valid")
-				return
+	flags = []
+	for option in options:
+		if option in ["-j","--jobs"]:
+			raise Exception(f"option '{option}' requires a value, e.g., '{option}=4'")
+		elif option.startswith(("-j=","--jobs=")):
+			workers = int(option.split("=",1)[1])
+		elif option.startswith("--summary="):
+			summary = option.split("=",1)[1]
+		elif option[0] == '-' or ( "=" in option and len(args) > 1 ):
+			flags.append(option)
 		else:
 			args.append(option)
-	if command == "create":
-		if len(args) < 5:
-			raise Exception(f"missing one or more pipeline create arguments (args={args})")
-		if len(args) > 6:
-			raise Exception(f"too many pipeline create arguments (args={args})")
-		pipeline = args[0]
-		docker = args[1]
-		github = args[2]
-		branch = args[3]
-		entry = args[4]
-		if len(args) > 5:
-			description = args[5]
-		else:
-			description = ""
-		if local:
-			data = readlocal_pipelines()
-			data = addlocal_pipeline(data,{
-				'name':[pipeline],
-				'docker':[docker],
-				'github':[github],
-				'branch':[branch],
-				'entry':[entry],
-				'description':[description],
-				})
-			writelocal_pipelines(data)
-		else:
-			raise Exception(f"remote pipeline create not implemented yet (args={args})")
-	elif command == "start":
-		if len(args) < 3:
-			raise Exception(f"missing one or more pipeline start arguments (args={args})")
-		if len(args) > 3:
-			raise Exception(f"too many pipeline start arguments (args={args})")
-		pipeline = args[0]
-		inputfolder = args[1]
-		outputfolder = args[2]
-		if local:
-			data = readlocal_pipelines().set_index("name")
-			spec = data.loc[pipeline]
-			runlocal_pipepline(pipeline,spec["docker"],spec["github"],spec["branch"],spec["entry"],inputfolder,outputfolder)
-		else:
-			raise Exception(f"remote pipeline start not implemented yet (args={args})")
-	elif command == "delete":
-		if len(args) < 1:
-			raise Exception(f"missing pipeline delete argument (args={args})")
-		pipeline = args[0]
-		if local:
-			data = readlocal_pipelines().set_index("name")
-			data = data.drop(pipeline)
-			writelocal_pipelines(data.reset_index())
-		else:
-			raise Exception(f"remote pipeline delete not implemented yet (args={args})")
-	elif command == "list":
-		if local:
-			data = readlocal_pipelines().set_index("name")
-			for item in data.index:
-				print(item)
-		else:
-			raise Exception(f"remote pipeline delete not implemented yet (args={args})")
-	else:
-		raise Exception(f"invalid pipeline command (command='{command}')")
-
-
-#
-# WORKFLOW FUNCTION
-#
-def workflow(options=[], stream=command_streams):
-	"""Syntax: openfido [OPTIONS] workflow COMMAND [OPTIONS]
-
-	The `pipeline` function is used to create and start pipeline operations.
-
-	COMMAND:
-	
-		create [-l|--local] SPECFILE
-		start  [-l|--local] NAME INPUTFOLDER OUTPUTFOLDER 
-	"""
-	raise Exception("workflow CLI not implemented yet")
+	if len(args) < 2:
+		raise Exception("missing product name or batch manifest")
+	if len(args) > 3:
+		raise Exception(f"too many batch arguments (args={args})")
+	name = args[0]
+	jobs = read_batch_jobs(args[1],args[2] if len(args) > 2 else None)
+	if not jobs:
+		raise Exception(f"no batch jobs found in '{args[1]}'")
+	missing = [n for n, job in enumerate(jobs) if not job["outputs"] or "/dev/stdout" in job["outputs"]]
+	if missing:
+		raise Exception(f"batch job{'s' if len(missing) > 1 else ''} {', '.join(map(str,missing))} must have output files")
+	load_product(name,stream) # install and check the product before starting workers
+	for job in jobs:
+		for output in job["outputs"]:
+			if os.path.dirname(output):
+				os.makedirs(os.path.dirname(output),exist_ok=True)
+	done = []
+	failed = []
+	results = {}
+	start = time.perf_counter()
+	with ProcessPoolExecutor(max_workers=max(1,min(workers,len(jobs))),initializer=batch_init,initargs=(name,)) as pool:
+		futures = {}
+		for n, job in enumerate(jobs):
+			job_options = [name] + job["flags"] + flags + [",".join(job["inputs"]),",".join(job["outputs"])]
+			futures[pool.submit(batch_job,job_options)] = n
+		for future in as_completed(futures):
+			n = futures[future]
+			try:
+				results[n] = future.result()
+			except Exception as err: # the worker process died
+				results[n] = (1,None,str(err))
+			code, elapsed, error = results[n]
+			if code:
+				stream["error"](f"job {n} failed: {error}")
+				failed.append(n)
+			else:
+				stream["verbose"](f"job {n} done in {elapsed:.3f} s")
+				done.append(n)
+	elapsed = time.perf_counter()-start
+	if summary:
+		import csv
+		with open(summary,"w",newline="") as fh:
+			writer = csv.writer(fh)
+			writer.writerow(["job","status","elapsed","inputs","outputs","error"])
+			for n, job in enumerate(jobs):
+				code, seconds, error = results[n]
+				writer.writerow([n,code,f"{seconds:.6f}" if seconds is not None else "",
+					",".join(job["inputs"]),",".join(job["outputs"]),error or ""])
+	stream["output"](f"{len(jobs)} jobs, {len(done)} ok, {len(failed)} failed in {elapsed:.3f} s")
+	return {"ok":len(done), "errors":len(failed), "done":sorted(done), "failed":sorted(failed)}
 
 #
 # VALIDATE FUNCTION
@@ -649,6 +1092,7 @@ def validate(options=[], stream=command_streams):
 
 		validate PRODUCT
 	"""
+	import subprocess
 	if not options:
 		raise Exception("missing package name")
 	name = options[0]
@@ -0,0 +1,309 @@
+"""OpenFIDO benchmarks
+
+Usage: openfido [OPTIONS] bench [BENCH_OPTIONS] [util|PRODUCT [PRODUCT_OPTIONS]]
+       python3 openfido_bench.py [ROWS ...]
+
+The benchmarks time the `openfido_util` helpers on synthetic time-series data
+at increasing sizes. The `hold` benchmark compares the vectorized `hold()` with
+the original row-by-row implementation, which is kept here as `hold_reference()`.
+The reference is only run up to `reference_limit` rows because its run time grows
+with the square of the number of nulls. Because the original fills the nulls
+by position with values that are not the previous ones, each `hold()` result is
+checked against `hold_expected()` instead, and the benchmark fails when they
+differ. Running this file only runs the `hold` benchmark.
+
+The `bench` command runs the `util` suite, i.e., CSV and JSON round trips
+through `write_output()` and `read_input()`, `get_read_options()` and `hold()`,
+on narrow and wide data, or runs an installed product on synthetic CSV inputs
+of increasing size and reports its scaling curve. The results may be saved as a
+baseline in `bench_folder`, and compared with a saved baseline to flag the cases
+that are slower than the baseline by more than a threshold.
+"""
+
+import os, sys, time
+
+default_rows = [10**4,10**5,10**6,10**7] # default benchmark sizes
+reference_limit = 10**5 # largest size at which the reference implementations are run
+bench_rows = [10**3,10**4,10**5,10**6] # default sizes of the `bench` command (up to 10**8 with --rows)
+bench_shapes = {"narrow":4, "wide":100} # number of columns of each synthetic data shape
+bench_repeat = 3 # default number of runs of each util case, of which the best time is kept
+bench_threshold = 10 # default slowdown in percent of the baseline that is a regression
+bench_noise = 0.005 # slowdowns of less than this many seconds are never regressions
+bench_folder = os.path.expanduser("~/.openfido/bench") # folder of the saved baselines
+
+def get_timeseries(rows,columns=4,nulls=0.01,seed=0,head=1):
+	"""Generate a synthetic 1-minute time-series with values randomly missing after the first `head` rows"""
+	import numpy as np, pandas
+	rng = np.random.default_rng(seed)
+	values = rng.random((rows,columns)).cumsum(axis=0)
+	values[head:][rng.random((max(0,rows-head),columns)) < nulls] = np.nan
+	index = pandas.date_range("2020-01-01",periods=rows,freq="min")
+	return pandas.DataFrame(values,index=index,columns=[f"x{n}" for n in range(columns)])
+
+def hold_reference(df,order=0,axis=0,inplace=True):
+	"""Original row-by-row implementation of `openfido_util.hold()` using positional null indexes"""
+	import numpy as np
+	if not inplace:
+		df = df.copy(deep=True)
+	if axis==1:
+		return hold_reference(df.transpose(),order=order,axis=0).transpose()
+	for col in df.columns[df.isnull().any()]:
+		d = df[col]
+		if np.isnan(d.iloc[0:order].any()):
+			raise Exception(f"unable to hold on series '{col}' with initial NaN value")
+		index = [n for n, null in enumerate(d.apply(np.isnan)) if null]
+		if order == 0:
+			for i in index:
+				d.iloc[index] = d.iloc[i-1]
+		elif order == 1:
+			for i in index:
+				d.iloc[index] = 2.0*d.iloc[i-1] - d.iloc[i-2]
+		else:
+			raise Exception("order={order} is not valid")
+	return df
+
+def hold_expected(df,order=0,axis=0):
+	"""Row-by-row hold that fills each null in turn from the `order`+1 values before it
+
+	Returns:
+		array of the held values in the orientation of `df`
+	"""
+	import numpy as np, math
+	values = ( df if axis == 0 else df.transpose() ).to_numpy(dtype=float,copy=True)
+	weights = [(-1)**j*math.comb(order+1,j+1) for j in range(order+1)]
+	for col in range(values.shape[1]):
+		series = values[:,col]
+		for row in np.nonzero(np.isnan(series))[0]:
+			if row <= order:
+				raise Exception(f"unable to hold on series '{col}' with initial NaN value")
+			series[row] = sum(weight*series[row-1-j] for j, weight in enumerate(weights))
+	return values if axis == 0 else values.transpose()
+
+def check_hold(df,held,order,axis):
+	"""Check the result of `hold()` against `hold_expected()`"""
+	import numpy as np
+	if not np.allclose(held.to_numpy(dtype=float),hold_expected(df,order=order,axis=axis),rtol=1e-9,equal_nan=True):
+		raise Exception(f"hold(order={order},axis={axis}) result on {df.shape[axis]} rows differs from the expected result")
+
+def timeit(call,*args,**kwargs):
+	"""Get the run time of a call in seconds"""
+	t0 = time.perf_counter()
+	call(*args,**kwargs)
+	return time.perf_counter() - t0
+
+def bench_hold(sizes=default_rows,orders=[0,1],output=print):
+	"""Benchmark `hold()` against the original implementation and check its results
+
+	Returns:
+		list of dict with the size, order, axis and run times in seconds
+	"""
+	import openfido_util as of
+	result = []
+	output(f"{'rows':>10s} {'order':>5s} {'axis':>4s} {'hold':>10s} {'reference':>10s} {'speedup':>8s}")
+	for rows in sizes:
+		data = get_timeseries(rows)
+		for order in orders:
+			for axis in [0,1]:
+				df = data if axis == 0 else data.transpose()
+				t0 = time.perf_counter()
+				held = of.hold(df,order=order,axis=axis,inplace=False)
+				t = time.perf_counter() - t0
+				check_hold(df,held,order,axis)
+				r = timeit(hold_reference,df,order=order,axis=axis,inplace=False) if rows <= reference_limit else None
+				result.append({"rows":rows, "order":order, "axis":axis, "hold":t, "reference":r})
+				output(f"{rows:10d} {order:5d} {axis:4d} {t:10.4f} "
+					+ (f"{r:10.4f} {r/t:7.0f}x" if r else f"{'-':>10s} {'-':>8s}"))
+	return result
+
+def best(call,repeat,*args,**kwargs):
+	"""Get the best run time of several calls in seconds"""
+	return min(timeit(call,*args,**kwargs) for n in range(max(1,repeat)))
+
+def bench_util(sizes=bench_rows,shapes=bench_shapes.keys(),repeat=bench_repeat,output=print):
+	"""Benchmark the `openfido_util` read, write, option and `hold` helpers
+
+	Returns:
+		list of dict with the case, shape, rows and best run time in seconds
+	"""
+	import tempfile, openfido_util as of
+	result = []
+	def add(case,shape,rows,seconds):
+		result.append({"case":case, "shape":shape, "rows":rows, "seconds":seconds})
+		output(f"{case:20s} {shape or '-':>6s} {rows or 0:10d} {seconds:10.4f}"
+			+ (f" {rows/seconds:12.0f}" if rows and seconds else f" {'-':>12s}"))
+	output(f"{'case':20s} {'shape':>6s} {'rows':>10s} {'seconds':>10s} {'rows/s':>12s}")
+	options = ["--csv-read-sep=,","--csv-read-na_values=NA","--json-write-orient=records"]
+	calls = 10000
+	add(f"get_read_options*{calls}",None,None,best(lambda: [of.get_read_options("csv",options) for n in range(calls)],repeat))
+	with tempfile.TemporaryDirectory() as folder:
+		for shape in shapes:
+			for rows in sizes:
+				data = get_timeseries(rows,bench_shapes[shape],nulls=0)
+				for ftype in ["csv","json"]:
+					file = os.path.join(folder,f"data.{ftype}")
+					add(f"write_{ftype}",shape,rows,best(of.write_output,repeat,data,file,[]))
+					add(f"read_{ftype}",shape,rows,best(of.read_input,repeat,file,[]))
+					os.remove(file)
+				data = get_timeseries(rows,bench_shapes[shape],head=2)
+				for order in [0,1]:
+					add(f"hold_order{order}",shape,rows,best(of.hold,repeat,data,order=order,inplace=False))
+				del data
+	return result
+
+def bench_product(name,sizes=bench_rows,shapes=["narrow"],options=[],repeat=1,stream=None):
+	"""Benchmark a product on synthetic CSV inputs of increasing size
+
+	The inputs have a `timestamp` column and one column per value, with a header
+	row. The product is loaded once and run `repeat` times on each input, and the
+	best time is kept. The scaling exponent of each size is the slope of the run
+	time against the number of rows from the previous size on a log-log scale.
+
+	Returns:
+		list of dict with the case, shape, rows and best run time in seconds
+	"""
+	import tempfile, math, openfido
+	if not stream:
+		stream = openfido.command_streams
+	module = openfido.load_product(name,stream)
+	result = []
+	stream["output"](f"{'case':20s} {'shape':>6s} {'rows':>10s} {'seconds':>10s} {'rows/s':>12s} {'exponent':>8s}")
+	with tempfile.TemporaryDirectory() as folder:
+		for shape in shapes:
+			last = None
+			for rows in sizes:
+				inputfile = os.path.join(folder,"input.csv")
+				outputfile = os.path.join(folder,"output.csv")
+				get_timeseries(rows,bench_shapes[shape]).to_csv(inputfile,index_label="timestamp")
+				seconds = best(openfido.run_product,repeat,module,[name]+list(options)+[inputfile,outputfile],stream)
+				result.append({"case":name, "shape":shape, "rows":rows, "seconds":seconds})
+				exponent = math.log(seconds/last[1])/math.log(rows/last[0]) if last and seconds > 0 and last[1] > 0 and rows != last[0] else None
+				stream["output"](f"{name:20s} {shape:>6s} {rows:10d} {seconds:10.4f} {rows/seconds if seconds else 0:12.0f} "
+					+ (f"{exponent:8.2f}" if exponent is not None else f"{'-':>8s}"))
+				last = (rows,seconds)
+				os.remove(inputfile)
+	return result
+
+def get_key(item):
+	"""Get the key of a benchmark result in a baseline"""
+	return f"{item['case']}:{item['shape'] or '-'}:{item['rows'] or 0}"
+
+def get_baseline_file(name):
+	"""Get the file of a baseline from its name or path"""
+	if os.path.sep in name or name.endswith(".json"):
+		return name
+	return os.path.join(bench_folder,f"{name}.json")
+
+def save_baseline(name,target,results):
+	"""Save benchmark results as a baseline"""
+	import json, platform
+	file = get_baseline_file(name)
+	if os.path.dirname(file):
+		os.makedirs(os.path.dirname(file),exist_ok=True)
+	with open(file,"w") as fh:
+		json.dump({"target":target, "created":time.time(), "python":platform.python_version(),
+			"machine":platform.machine(), "cpus":os.cpu_count(),
+			"results":{get_key(item):item["seconds"] for item in results}},fh,indent=1)
+	return file
+
+def compare_baseline(name,results,threshold=bench_threshold):
+	"""Compare benchmark results with a baseline
+
+	Returns:
+		list of dict with the key, seconds, baseline seconds, change in percent
+		and whether the case regressed, for the cases found in the baseline
+	"""
+	import json
+	file = get_baseline_file(name)
+	if not os.path.exists(file):
+		raise Exception(f"baseline '{file}' not found")
+	with open(file,"r") as fh:
+		baseline = json.load(fh)["results"]
+	result = []
+	for item in results:
+		key = get_key(item)
+		if key in baseline.keys() and baseline[key] > 0:
+			change = (item["seconds"]/baseline[key]-1)*100
+			result.append({"key":key, "seconds":item["seconds"], "baseline":baseline[key], "change":change,
+				"regression":change > threshold and item["seconds"]-baseline[key] > bench_noise})
+	return result
+
+def bench(options=[], stream=None):
+	"""Syntax: openfido [OPTIONS] bench [BENCH_OPTIONS] [util|PRODUCT [PRODUCT_OPTIONS]]
+
+	The `bench` function runs the `openfido_util` benchmarks, or runs a product
+	on synthetic time-series inputs of increasing size and reports its scaling
+	curve. The PRODUCT_OPTIONS are given to the product on each run.
+
+	BENCH_OPTIONS:
+
+		--rows=N[,N...]    input sizes, e.g., 1e3,1e5,1e7 (default 1e3,1e4,1e5,1e6)
+		--shape=SHAPE      narrow (4 columns), wide (100 columns) or all (default
+		                   all for util and narrow for products)
+		--repeat=N         runs of each case, of which the best time is kept
+		                   (default 3 for util and 1 for products)
+		--save[=NAME]      save the results as the baseline NAME (default is util
+		                   or the product name)
+		--compare[=NAME]   compare the results with the baseline NAME and fail if a
+		                   case is slower by more than the threshold
+		--threshold=PCT    slowdown in percent that is a regression (default 10)
+	"""
+	import openfido
+	if not stream:
+		stream = openfido.command_streams
+	sizes = bench_rows
+	shape = None
+	repeat = None
+	save = None
+	compare = None
+	threshold = bench_threshold
+	target = None
+	product_options = []
+	for option in options:
+		if target:
+			product_options.append(option)
+		elif option.startswith("--rows="):
+			try:
+				sizes = [int(float(rows)) for rows in option.split("=",1)[1].split(",")]
+			except ValueError:
+				raise Exception(f"'{option}' is not valid")
+		elif option.startswith("--shape="):
+			shape = option.split("=",1)[1]
+			if shape not in list(bench_shapes.keys())+["all"]:
+				raise Exception(f"'{option}' is not valid")
+		elif option.startswith("--repeat="):
+			repeat = int(option.split("=",1)[1])
+		elif option == "--save" or option.startswith("--save="):
+			save = option.split("=",1)[1] if "=" in option else ""
+		elif option == "--compare" or option.startswith("--compare="):
+			compare = option.split("=",1)[1] if "=" in option else ""
+		elif option.startswith("--threshold="):
+			threshold = float(option.split("=",1)[1])
+		elif option[0] == '-':
+			raise Exception(f"bench option '{option}' is not valid")
+		else:
+			target = option
+	if not target:
+		target = "util"
+	if target == "util":
+		shapes = list(bench_shapes.keys()) if shape in [None,"all"] else [shape]
+		results = bench_util(sizes,shapes,repeat or bench_repeat,stream["output"])
+	else:
+		shapes = ["narrow"] if not shape else list(bench_shapes.keys()) if shape == "all" else [shape]
+		results = bench_product(target,sizes,shapes,product_options,repeat or 1,stream)
+	if compare is not None:
+		changes = compare_baseline(compare or target,results,threshold)
+		stream["output"](f"{'case':40s} {'seconds':>10s} {'baseline':>10s} {'change':>8s}")
+		for item in changes:
+			stream["output"](f"{item['key']:40s} {item['seconds']:10.4f} {item['baseline']:10.4f} {item['change']:7.1f}%"
+				+ (" REGRESSION" if item["regression"] else ""))
+	if save is not None:
+		stream["verbose"](f"baseline saved to '{save_baseline(save or target,target,results)}'")
+	if compare is not None:
+		regressions = [item for item in changes if item["regression"]]
+		if regressions:
+			raise Exception(f"{len(regressions)} benchmark case(s) slower than the baseline by more than {threshold:g}%")
+	return results
+
+if __name__ == "__main__":
+	sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+	bench_hold([int(float(rows)) for rows in sys.argv[1:]] or default_rows)
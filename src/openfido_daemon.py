@@ -0,0 +1,288 @@
+"""OpenFIDO daemon
+
+The daemon keeps products imported so that `openfido run` does not pay the
+interpreter, pandas and product startup on every call. The daemon process
+imports `openfido_util` and the installed products, then forks a pool of
+worker processes that accept `run` requests on a unix socket. The client
+passes its stdin, stdout and stderr along with the request, so products read
+and write `/dev/stdin` and `/dev/stdout` exactly as they do when run locally.
+Workers reload a product when its files change, and the daemon replaces
+workers that exit.
+
+Protocol:
+
+	ready     one byte sent by the worker that accepted the connection
+	request   8-byte length, then the JSON request {"options","cwd","environ"}
+	          sent together with the client's stdin, stdout and stderr descriptors
+	reply     JSON {"status","result","error"} up to the end of the connection,
+	          with the product result pickled and base64 encoded
+
+When no worker accepts the connection within `request_timeout` seconds, e.g.,
+because the workers are hung or busy, the client gives up before sending the
+request and runs the product itself.
+"""
+
+import os, sys, json, socket, signal, struct
+
+request_timeout = 5 # seconds to wait for a worker to accept a request
+
+products = {} # loaded products and the stamp of their files
+stopping = False # the daemon is shutting down
+
+def get_stamp(path):
+	"""Get the last modification time of the files of a product"""
+	stamp = 0
+	for item in os.scandir(path):
+		if item.is_file() and ( item.name.endswith(".py") or item.name == "openfido.json" ):
+			stamp = max(stamp,item.stat().st_mtime)
+	return stamp
+
+def get_product(name,stream):
+	"""Get a loaded product, reloading it if its files changed"""
+	import openfido
+	path = f"{openfido.cache}/{name}"
+	stamp = get_stamp(path) if os.path.isdir(path) else None
+	if name in products.keys() and products[name][1] == stamp:
+		return products[name][0]
+	for module in list(sys.modules.values()):
+		if getattr(module,"__file__",None) and module.__file__.startswith(f"{path}/"):
+			del sys.modules[module.__name__]
+	module = openfido.load_product(name,stream)
+	products[name] = (module,get_stamp(path))
+	return module
+
+def receive(conn):
+	"""Receive a request and the client's standard stream descriptors
+
+	Returns:
+		the request and the descriptors, or None if the client gave up
+	"""
+	try:
+		conn.sendall(b"\x01")
+		data, fds, flags, addr = socket.recv_fds(conn,65536,3)
+	except ConnectionError:
+		return None
+	if not data and not fds:
+		return None
+	if len(data) < 8:
+		raise Exception("invalid request")
+	size = struct.unpack("!Q",data[:8])[0]
+	data = data[8:]
+	while len(data) < size:
+		chunk = conn.recv(size-len(data))
+		if not chunk:
+			raise Exception("incomplete request")
+		data += chunk
+	return json.loads(data), fds
+
+def handle(conn):
+	"""Run a request in this worker with the client's streams, folder and environment"""
+	import openfido, pickle, base64
+	received = receive(conn)
+	if not received:
+		return
+	request, fds = received
+	saved_fds = [os.dup(fd) for fd in range(3)]
+	saved_streams = (sys.stdin,sys.stdout,sys.stderr)
+	saved_environ = dict(os.environ)
+	saved_cwd = os.getcwd()
+	reply = {"status":0, "result":None, "error":None}
+	try:
+		for fd, client_fd in enumerate(fds):
+			os.dup2(client_fd,fd)
+		sys.stdin = open(0,"r",closefd=False)
+		sys.stdout = open(1,"w",closefd=False)
+		sys.stderr = open(2,"w",closefd=False)
+		os.environ.clear()
+		os.environ.update(request["environ"])
+		os.chdir(request["cwd"])
+		options = request["options"]
+		stream = openfido.command_streams
+		module = get_product(options[0],stream)
+		result = openfido.run_product(module,options,stream)
+		try:
+			reply["result"] = base64.b64encode(pickle.dumps(result)).decode()
+		except Exception as err:
+			raise Exception(f"product result of type '{type(result).__name__}' cannot be returned by the daemon ({err})")
+	except SystemExit as err:
+		reply["status"] = err.code if type(err.code) is int else 1
+	except Exception as err:
+		reply["status"] = 1
+		reply["error"] = str(err)
+	finally:
+		sys.stdout.flush()
+		sys.stderr.flush()
+		sys.stdin, sys.stdout, sys.stderr = saved_streams
+		for fd, saved_fd in enumerate(saved_fds):
+			os.dup2(saved_fd,fd)
+			os.close(saved_fd)
+		for fd in fds:
+			os.close(fd)
+		os.environ.clear()
+		os.environ.update(saved_environ)
+		os.chdir(saved_cwd)
+	conn.sendall(json.dumps(reply).encode())
+
+def work(server):
+	"""Accept and handle requests until the worker is stopped"""
+	import openfido
+	openfido.daemon_socket = None # workers never forward requests
+	signal.signal(signal.SIGTERM,signal.SIG_DFL)
+	signal.signal(signal.SIGINT,signal.SIG_DFL)
+	while True:
+		conn, addr = server.accept()
+		try:
+			handle(conn)
+		except Exception as err:
+			print(f"ERROR [openfido-daemon]: {err}",file=sys.stderr,flush=True)
+		finally:
+			conn.close()
+
+def spawn(server):
+	"""Fork a worker process"""
+	pid = os.fork()
+	if pid == 0:
+		try:
+			work(server)
+		finally:
+			os._exit(1)
+	return pid
+
+def serve(socketfile,workers=0):
+	"""Run the daemon until it receives SIGTERM or SIGINT"""
+	global stopping
+	import openfido, openfido_util
+	stream = openfido.command_streams
+	for name, entry in openfido.read_registry().items():
+		if "main" in entry.get("entry_points",{}).keys() or "openfido" in entry.get("entry_points",{}).keys():
+			try:
+				get_product(name,stream)
+			except Exception as err:
+				print(f"WARNING [openfido-daemon]: unable to load '{name}' ({err})",file=sys.stderr,flush=True)
+	if os.path.exists(socketfile):
+		os.remove(socketfile)
+	server = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+	server.bind(socketfile)
+	os.chmod(socketfile,0o600)
+	server.listen()
+	with open(f"{socketfile}.pid","w") as fh:
+		print(os.getpid(),file=fh)
+	pool = [spawn(server) for n in range(workers if workers > 0 else os.cpu_count())]
+	def stop(signum,frame):
+		global stopping
+		stopping = True
+		for pid in pool:
+			try:
+				os.kill(pid,signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+	signal.signal(signal.SIGTERM,stop)
+	signal.signal(signal.SIGINT,stop)
+	try:
+		while pool:
+			pid, status = os.wait()
+			if pid in pool:
+				pool.remove(pid)
+				if not stopping:
+					pool.append(spawn(server))
+	finally:
+		server.close()
+		for file in [socketfile,f"{socketfile}.pid"]:
+			if os.path.exists(file):
+				os.remove(file)
+
+def request(socketfile,options):
+	"""Forward a `run` request to the daemon
+
+	Returns:
+		the product result
+
+	Raises:
+		ConnectionError or TimeoutError when the request was not sent, in which
+		case the product was not run by the daemon
+	"""
+	import pickle, base64
+	data = json.dumps({"options":options, "cwd":os.getcwd(), "environ":dict(os.environ)}).encode()
+	sys.stdout.flush()
+	sys.stderr.flush()
+	with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as conn:
+		try:
+			conn.connect(socketfile)
+		except FileNotFoundError as err:
+			raise ConnectionRefusedError(str(err))
+		conn.settimeout(request_timeout)
+		try:
+			ready = conn.recv(1)
+		except socket.timeout:
+			raise TimeoutError(f"no daemon worker accepted the request within {request_timeout} s")
+		if not ready:
+			raise ConnectionResetError("daemon closed the connection")
+		conn.settimeout(None) # the product may run for any time once it is accepted
+		socket.send_fds(conn,[struct.pack("!Q",len(data))+data],[0,1,2])
+		reply = b""
+		while True:
+			chunk = conn.recv(65536)
+			if not chunk:
+				break
+			reply += chunk
+	if not reply:
+		raise Exception("daemon closed the connection without a reply")
+	reply = json.loads(reply)
+	if reply["error"]:
+		raise Exception(reply["error"])
+	if reply["status"]:
+		sys.exit(reply["status"])
+	return pickle.loads(base64.b64decode(reply["result"])) if reply["result"] is not None else None
+
+def get_pid(socketfile):
+	"""Get the process id of the running daemon, or None"""
+	try:
+		with open(f"{socketfile}.pid","r") as fh:
+			pid = int(fh.read())
+		os.kill(pid,0)
+		return pid
+	except:
+		return None
+
+def daemon(options=[], stream=None):
+	"""Syntax: openfido [OPTIONS] daemon [start [-f|--foreground]|stop|status]
+
+	The `daemon` function manages the local daemon that keeps products imported
+	and runs them when `openfido run` is called. The daemon listens on the
+	`daemon_socket` and uses `daemon_workers` worker processes.
+	"""
+	import openfido
+	if not stream:
+		stream = openfido.command_streams
+	if not options:
+		options = ["status"]
+	socketfile = openfido.daemon_socket
+	pid = get_pid(socketfile)
+	if options[0] == "start":
+		if pid:
+			raise Exception(f"daemon is already running (pid {pid})")
+		if len(options) > 1 and options[1] in ["-f","--foreground"]:
+			serve(socketfile,openfido.daemon_workers)
+			return
+		import subprocess
+		with open(f"{socketfile}.log","a") as log:
+			subprocess.Popen([sys.executable,__file__,socketfile,str(openfido.daemon_workers)],
+				stdin=subprocess.DEVNULL,stdout=log,stderr=log,start_new_session=True)
+		stream["verbose"](f"daemon started on '{socketfile}'")
+	elif options[0] == "stop":
+		if not pid:
+			stream["warning"]("daemon is not running")
+			return
+		os.kill(pid,signal.SIGTERM)
+		stream["verbose"](f"daemon stopped (pid {pid})")
+	elif options[0] == "status":
+		if pid:
+			stream["output"](f"daemon is running on '{socketfile}' (pid {pid})")
+		else:
+			stream["output"]("daemon is not running")
+		return pid
+	else:
+		raise Exception(f"daemon command '{options[0]}' is not valid")
+
+if __name__ == "__main__":
+	serve(sys.argv[1],int(sys.argv[2]))
@@ -0,0 +1,224 @@
+"""OpenFIDO HTTP utilities
+
+GitHub responses are cached on disk together with their ETag and Last-Modified
+headers. Entries younger than the TTL are served without contacting the server.
+Older entries are revalidated with a conditional request, so an unchanged resource
+costs a 304 reply, which does not count against the GitHub rate limit. In offline
+mode any cached entry is served regardless of age. Entries are kept separately
+for each `Authorization` header, so a reply fetched with a token is not served
+to requests made without it. When the cache folder cannot be read or written,
+requests are made without the cache.
+
+All requests share a keep-alive connection pool, use a timeout, and are retried
+with exponential backoff on connection errors, rate limiting and server errors.
+Several URLs can be fetched concurrently with `get_many()`, and paginated API
+results are followed through their `Link` headers with `get_pages()`.
+
+Queries that must be posted, such as GraphQL queries, are sent with `post()`.
+Their replies have no validators, so they are only cached for the TTL or for
+offline use.
+"""
+
+import os, json, time, hashlib, contextlib
+
+sessions = {} # shared sessions by pool size and retry count
+
+def get_cachefile(cachedir,url,params={},headers={}):
+	"""Get the cache file name for a URL, its query parameters and its authorization"""
+	authorization = {key.lower():value for key,value in headers.items()}.get("authorization",None)
+	key = json.dumps([url,sorted(params.items()),authorization])
+	return os.path.join(cachedir,hashlib.sha256(key.encode()).hexdigest()+".json")
+
+def read_cache(cachefile,stream=None):
+	"""Read a cache entry, or None if there is no valid entry"""
+	try:
+		with open(cachefile,"r") as fh:
+			return json.load(fh)
+	except FileNotFoundError:
+		return None
+	except (OSError,ValueError) as err:
+		if stream:
+			stream["verbose"](f"unable to read http cache entry '{cachefile}' ({err})")
+		return None
+
+def write_cache(cachefile,entry,stream=None):
+	"""Write a cache entry atomically
+
+	The cache is only an optimization, so an entry that cannot be written,
+	e.g., because the cache folder is not writable, is skipped.
+	"""
+	import tempfile
+	tmpfile = None
+	try:
+		os.makedirs(os.path.dirname(cachefile),exist_ok=True)
+		fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(cachefile),suffix=".tmp")
+		with os.fdopen(fd,"w") as fh:
+			json.dump(entry,fh)
+		os.replace(tmpfile,cachefile)
+	except OSError as err:
+		if tmpfile:
+			with contextlib.suppress(OSError):
+				os.remove(tmpfile)
+		if stream:
+			stream["verbose"](f"unable to write http cache entry '{cachefile}' ({err})")
+
+def make_response(url,entry):
+	"""Rebuild a response object from a cache entry"""
+	import requests
+	response = requests.models.Response()
+	response.url = url
+	response.status_code = entry["status_code"]
+	response.headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+	response.encoding = "utf-8"
+	response._content = entry["content"].encode("utf-8")
+	response.from_cache = True
+	return response
+
+def get_session(poolsize=10,retries=3,backoff=0.5):
+	"""Get the shared session for a connection pool size and retry count"""
+	key = (poolsize,retries,backoff)
+	if key not in sessions:
+		import requests
+		from urllib3.util.retry import Retry
+		retry = Retry(total=retries,backoff_factor=backoff,
+			status_forcelist=[429,500,502,503,504],respect_retry_after_header=True)
+		adapter = requests.adapters.HTTPAdapter(pool_connections=poolsize,pool_maxsize=poolsize,max_retries=retry)
+		session = requests.Session()
+		session.mount("http://",adapter)
+		session.mount("https://",adapter)
+		sessions[key] = session
+	return sessions[key]
+
+def get(url,headers={},params={},cachedir=None,ttl=0,offline=False,timeout=30,retries=3,session=None,stream=None):
+	"""Get a URL using the on-disk cache
+
+	Parameters:
+		url (str)        URL to get
+		headers (dict)   Request headers
+		params (dict)    Query parameters
+		cachedir (str)   Cache folder (default None disables the cache)
+		ttl (int)        Seconds during which a cache entry is used without revalidation
+		offline (bool)   Serve cached entries without contacting the server
+		timeout (float)  Request timeout in seconds (default 30)
+		retries (int)    Number of retries with exponential backoff (default 3)
+		session          Session to use (default is the shared session)
+		stream (dict)    Output streams for cache problems (default None is silent)
+
+	Returns:
+		requests.Response
+	"""
+	if not session:
+		session = get_session(retries=retries)
+	if not cachedir:
+		if offline:
+			raise Exception(f"unable to get '{url}' offline without a cache")
+		return session.get(url,headers=headers,params=params,timeout=timeout)
+	cachefile = get_cachefile(cachedir,url,params,headers)
+	entry = read_cache(cachefile,stream)
+	if entry and ( offline or time.time() - entry["time"] < ttl ):
+		return make_response(url,entry)
+	if offline:
+		raise Exception(f"'{url}' is not in the cache and offline mode is enabled")
+	headers = dict(headers)
+	if entry and entry["etag"]:
+		headers["If-None-Match"] = entry["etag"]
+	if entry and entry["last_modified"]:
+		headers["If-Modified-Since"] = entry["last_modified"]
+	response = session.get(url,headers=headers,params=params,timeout=timeout)
+	if response.status_code == 304 and entry:
+		entry["time"] = time.time()
+		write_cache(cachefile,entry,stream)
+		return make_response(url,entry)
+	if response.status_code == 200 and ( "ETag" in response.headers or "Last-Modified" in response.headers or ttl > 0 ):
+		write_cache(cachefile,{
+			"url" : response.url,
+			"time" : time.time(),
+			"etag" : response.headers.get("ETag",None),
+			"last_modified" : response.headers.get("Last-Modified",None),
+			"status_code" : response.status_code,
+			"headers" : {key:value for key,value in response.headers.items()
+				if key in ("Content-Type","ETag","Last-Modified","Link")},
+			"content" : response.text,
+			},stream)
+	response.from_cache = False
+	return response
+
+def post(url,data,headers={},cachedir=None,ttl=0,offline=False,timeout=30,retries=3,session=None,stream=None):
+	"""Post a JSON query to a URL using the on-disk cache
+
+	Parameters:
+		url (str)        URL to post to
+		data (dict)      JSON query data
+		headers (dict)   Request headers
+		cachedir (str)   Cache folder (default None disables the cache)
+		ttl (int)        Seconds during which a cached reply is used
+		offline (bool)   Serve cached replies without contacting the server
+		timeout (float)  Request timeout in seconds (default 30)
+		retries (int)    Number of retries with exponential backoff (default 3)
+		session          Session to use (default is the shared session)
+		stream (dict)    Output streams for cache problems (default None is silent)
+
+	Returns:
+		requests.Response
+	"""
+	if not session:
+		session = get_session(retries=retries)
+	cachefile = get_cachefile(cachedir,url,data,headers) if cachedir else None
+	entry = read_cache(cachefile,stream) if cachefile else None
+	if entry and ( offline or time.time() - entry["time"] < ttl ):
+		return make_response(url,entry)
+	if offline:
+		raise Exception(f"'{url}' query is not in the cache and offline mode is enabled")
+	response = session.post(url,json=data,headers=headers,timeout=timeout)
+	if response.status_code == 200 and cachefile:
+		write_cache(cachefile,{
+			"url" : response.url,
+			"time" : time.time(),
+			"etag" : None,
+			"last_modified" : None,
+			"status_code" : response.status_code,
+			"headers" : {"Content-Type" : response.headers.get("Content-Type","application/json")},
+			"content" : response.text,
+			},stream)
+	response.from_cache = False
+	return response
+
+def get_many(urls,workers=10,**kwargs):
+	"""Get several URLs concurrently
+
+	Parameters:
+		urls (list)     URLs to get
+		workers (int)   Maximum number of concurrent requests (default 10)
+		**kwargs        Options passed to `get()`
+
+	Returns:
+		list of requests.Response or Exception, in the order of `urls`
+	"""
+	from concurrent.futures import ThreadPoolExecutor
+	if not urls:
+		return []
+	kwargs["session"] = get_session(poolsize=workers,retries=kwargs.pop("retries",3))
+	def _get(url):
+		try:
+			return get(url,**kwargs)
+		except Exception as err:
+			return err
+	with ThreadPoolExecutor(max_workers=min(workers,len(urls))) as pool:
+		return list(pool.map(_get,urls))
+
+def get_pages(url,params={},**kwargs):
+	"""Get all the pages of a paginated API list by following the `Link` headers
+
+	Returns:
+		list of the items in all pages
+	"""
+	result = []
+	while url:
+		response = get(url,params=params,**kwargs)
+		data = response.json()
+		if not type(data) is list:
+			raise Exception(f"API error at {url}: response ({type(data)}) = {data}")
+		result.extend(data)
+		url = response.links.get("next",{}).get("url",None)
+		params = {} # the next link already includes the query
+	return result
@@ -0,0 +1,997 @@
+"""OpenFIDO pipelines
+
+Local pipelines are stored in the SQLite database `.pipelines.db` in the current
+folder. Each change is a transaction, so several `openfido pipeline` commands
+may run at the same time. The database also records the history of pipeline
+runs with their start and end times, exit status, and input and output folders.
+
+Pipelines created with earlier versions in `.pipelines.csv` are moved into the
+database the first time it is opened, after which the CSV file is renamed
+`.pipelines.csv.migrated`.
+
+Local pipelines run in an image derived from the pipeline's docker image for
+the commit of its branch, e.g., `openfido/NAME:COMMIT`. The image contains the
+pipeline's files and the python requirements they list, so a run only pays for
+the container start. The branch is resolved with `git ls-remote` before each
+run and the image is built again only when the commit changes.
+
+Optionally, runs are executed in warm containers that are kept running for each
+pipeline image, so that a run does not pay for creating and starting a container.
+Each run gets a fresh copy of its input folder in the container's staging folder,
+and the container exits by itself after it has been idle for a while.
+
+Pipeline specs and `pipeline start` may limit the CPUs, memory and number of
+processes of the containers of a run. The resource usage of each run is
+sampled from the docker stats while it runs, and its peak RSS, CPU time, block
+I/O and wall time are written with its status to `openfido-run.json` in its
+output folder. Runs whose outputs are restored from the run cache get a new
+record marked as cached.
+"""
+
+import os, json, time, shutil, contextlib
+
+pipeline_filename = ".pipelines.csv" # legacy local pipeline list
+pipeline_database = ".pipelines.db" # local pipeline database
+pipeline_fields = ["name","docker","github","branch","entry","description"] # pipeline spec fields
+limit_fields = ["cpus","cpuset","memory_limit","pids_limit"] # optional container resource limits of a pipeline spec
+pipeline_schema = [ # local pipeline database changes for each schema version
+	[
+		"""CREATE TABLE IF NOT EXISTS pipelines (
+			name TEXT PRIMARY KEY,
+			docker TEXT NOT NULL,
+			github TEXT NOT NULL,
+			branch TEXT NOT NULL,
+			entry TEXT NOT NULL,
+			description TEXT NOT NULL DEFAULT '')""",
+		"""CREATE TABLE IF NOT EXISTS runs (
+			id INTEGER PRIMARY KEY AUTOINCREMENT,
+			pipeline TEXT NOT NULL,
+			inputfolder TEXT,
+			outputfolder TEXT,
+			started REAL NOT NULL,
+			ended REAL,
+			status INTEGER,
+			error TEXT)""",
+		"CREATE INDEX IF NOT EXISTS runs_pipeline ON runs (pipeline,started)",
+	],
+	[
+		"ALTER TABLE runs ADD COLUMN commit_id TEXT",
+	],
+	[
+		"""CREATE TABLE IF NOT EXISTS images (
+			pipeline TEXT PRIMARY KEY,
+			docker TEXT NOT NULL,
+			github TEXT NOT NULL,
+			branch TEXT NOT NULL,
+			commit_id TEXT NOT NULL,
+			image TEXT NOT NULL,
+			checked REAL NOT NULL)""",
+	],
+	[
+		"""CREATE TABLE IF NOT EXISTS workflows (
+			name TEXT PRIMARY KEY,
+			description TEXT NOT NULL DEFAULT '',
+			spec TEXT NOT NULL)""",
+	],
+	[
+		"ALTER TABLE pipelines ADD COLUMN cpus REAL",
+		"ALTER TABLE pipelines ADD COLUMN cpuset TEXT",
+		"ALTER TABLE pipelines ADD COLUMN memory_limit TEXT",
+		"ALTER TABLE pipelines ADD COLUMN pids_limit INTEGER",
+	],
+]
+image_repository = "openfido" # local repository of the pipeline images built for each commit
+image_label = "org.openfido" # prefix of the labels of the pipeline images
+pool_root = f"/tmp/openfido-pool-{os.getuid()}" # staging folders of the warm pipeline containers
+pool_mount = "/tmp/openfido-pool" # staging folder inside a warm pipeline container
+run_memory = 2**30 # memory reserved for each concurrent pipeline run when sizing the scheduler
+run_record = "openfido-run.json" # record of a pipeline run and its resource usage in its output folder
+stats_interval = 0.5 # seconds between samples of the docker stats of a running pipeline
+
+def open_pipelines(dbfile=pipeline_database,csvfile=pipeline_filename):
+	"""Open the local pipeline database, creating or upgrading it and migrating the legacy CSV file if needed"""
+	import sqlite3
+	conn = sqlite3.connect(dbfile,timeout=30,isolation_level=None)
+	conn.row_factory = sqlite3.Row
+	conn.execute("PRAGMA journal_mode=WAL")
+	migrated = False
+	if conn.execute("PRAGMA user_version").fetchone()[0] < len(pipeline_schema):
+		conn.execute("BEGIN IMMEDIATE")
+		try:
+			version = conn.execute("PRAGMA user_version").fetchone()[0]
+			for changes in pipeline_schema[version:]:
+				for change in changes:
+					conn.execute(change)
+			if version == 0:
+				migrated = migrate_pipelines(conn,csvfile)
+			conn.execute(f"PRAGMA user_version={len(pipeline_schema)}")
+			conn.execute("COMMIT")
+		except:
+			conn.execute("ROLLBACK")
+			conn.close()
+			raise
+		if migrated:
+			os.replace(csvfile,f"{csvfile}.migrated")
+	return conn
+
+def migrate_pipelines(conn,csvfile=pipeline_filename):
+	"""Copy the pipelines of the legacy CSV file into the database
+
+	Returns:
+		True if the CSV file was migrated
+	"""
+	import csv
+	if not os.path.exists(csvfile):
+		return False
+	with open(csvfile,"r",newline="") as fh:
+		for row in csv.DictReader(fh):
+			conn.execute("INSERT OR REPLACE INTO pipelines (name,docker,github,branch,entry,description) VALUES (?,?,?,?,?,?)",
+				[row.get(field,None) or "" for field in pipeline_fields])
+	return True
+
+def get_pipeline(conn,name):
+	"""Get a local pipeline spec"""
+	row = conn.execute("SELECT * FROM pipelines WHERE name=?",[name]).fetchone()
+	if not row:
+		raise Exception(f"pipeline '{name}' not found")
+	return dict(row)
+
+def add_pipeline(conn,spec):
+	"""Add a local pipeline spec"""
+	import sqlite3
+	get_limits(spec)
+	try:
+		conn.execute(f"INSERT INTO pipelines ({','.join(pipeline_fields+limit_fields)}) VALUES ({','.join('?'*len(pipeline_fields+limit_fields))})",
+			[spec.get(field,"") for field in pipeline_fields]+[spec.get(field,None) for field in limit_fields])
+	except sqlite3.IntegrityError:
+		raise Exception(f"pipeline '{spec['name']}' already exists")
+
+def delete_pipeline(conn,name):
+	"""Delete a local pipeline spec"""
+	if not conn.execute("DELETE FROM pipelines WHERE name=?",[name]).rowcount:
+		raise Exception(f"pipeline '{name}' not found")
+
+def list_pipelines(conn):
+	"""List the local pipeline specs in name order"""
+	return [dict(row) for row in conn.execute("SELECT * FROM pipelines ORDER BY name")]
+
+def get_limits(spec,overrides={}):
+	"""Get the docker options that limit the resources of the containers of a pipeline run
+
+	The limits of the pipeline spec are replaced by the `overrides` given to
+	`pipeline start`.
+	"""
+	values = {field:overrides.get(field) or spec.get(field) for field in limit_fields}
+	result = {}
+	try:
+		if values["cpus"]:
+			if float(values["cpus"]) <= 0:
+				raise ValueError
+			result["nano_cpus"] = int(float(values["cpus"])*1e9)
+		if values["cpuset"]:
+			result["cpuset_cpus"] = str(values["cpuset"])
+		if values["memory_limit"]:
+			result["mem_limit"] = result["memswap_limit"] = parse_size(values["memory_limit"])
+		if values["pids_limit"]:
+			if int(values["pids_limit"]) <= 0:
+				raise ValueError
+			result["pids_limit"] = int(values["pids_limit"])
+	except ValueError:
+		raise Exception(f"pipeline resource limits are not valid ({', '.join(f'{x}={y}' for x,y in values.items() if y)})")
+	return result
+
+def start_run(conn,name,inputfolder,outputfolder,commit=None):
+	"""Record the start of a pipeline run
+
+	Returns:
+		run id
+	"""
+	return conn.execute("INSERT INTO runs (pipeline,inputfolder,outputfolder,started,commit_id) VALUES (?,?,?,?,?)",
+		[name,os.path.abspath(inputfolder),os.path.abspath(outputfolder),time.time(),commit]).lastrowid
+
+def end_run(conn,run,status,error=None):
+	"""Record the end of a pipeline run"""
+	conn.execute("UPDATE runs SET ended=?, status=?, error=? WHERE id=?",[time.time(),status,error,run])
+
+def get_runs(conn,name=None,limit=None):
+	"""Get the most recent pipeline runs, optionally for one pipeline only"""
+	query = "SELECT * FROM runs"
+	args = []
+	if name:
+		query += " WHERE pipeline=?"
+		args.append(name)
+	query += " ORDER BY started DESC, id DESC"
+	if limit:
+		query += " LIMIT ?"
+		args.append(limit)
+	return [dict(row) for row in conn.execute(query,args)]
+
+def get_remote_commit(github,branch):
+	"""Resolve a pipeline branch, tag or commit to a commit hash"""
+	import re, subprocess
+	if re.fullmatch("[0-9a-f]{40}",branch):
+		return branch
+	result = subprocess.run(["git","ls-remote",github,branch],capture_output=True,text=True)
+	if result.returncode:
+		raise Exception(f"unable to resolve '{branch}' in '{github}' ({result.stderr.strip()})")
+	refs = {}
+	for line in result.stdout.splitlines():
+		commit, ref = line.split("\t",1)
+		refs[ref] = commit
+	for ref in [f"refs/heads/{branch}",f"refs/tags/{branch}^{{}}",f"refs/tags/{branch}"]:
+		if ref in refs.keys():
+			return refs[ref]
+	raise Exception(f"'{branch}' not found in '{github}'")
+
+def get_image_name(name,commit):
+	"""Get the tag of the image built for a pipeline commit"""
+	import re
+	return f"{image_repository}/{re.sub('[^a-z0-9._-]','-',name.lower())}:{commit[:12]}"
+
+def checkout_commit(github,commit,folder):
+	"""Get the files of a commit without its history"""
+	import subprocess
+	def git(*args):
+		return subprocess.run(["git","-C",folder]+list(args),capture_output=True,text=True)
+	os.makedirs(folder,exist_ok=True)
+	git("init","-q")
+	if git("fetch","-q","--depth","1",github,commit).returncode:
+		result = git("fetch","-q",github) # server does not allow fetching a commit directly
+		if result.returncode:
+			raise Exception(f"unable to fetch '{github}' ({result.stderr.strip()})")
+	result = git("-c","advice.detachedHead=false","checkout","-q",commit if git("cat-file","-e",commit).returncode == 0 else "FETCH_HEAD")
+	if result.returncode:
+		raise Exception(f"unable to checkout '{commit}' from '{github}' ({result.stderr.strip()})")
+
+def build_image(client,spec,commit,stream):
+	"""Build the image of a pipeline commit
+
+	The image is derived from the pipeline's docker image. It contains the files
+	of the commit in `/tmp/openfido` and the python requirements they list in
+	`requirements.txt`. Images built for earlier commits of the pipeline are
+	removed once the new image is built.
+	"""
+	import tempfile
+	tag = get_image_name(spec["name"],commit)
+	with tempfile.TemporaryDirectory() as folder:
+		stream["verbose"](f"checking out {spec['github']} {commit}")
+		checkout_commit(spec["github"],commit,folder)
+		with open(f"{folder}/.openfido.Dockerfile","w") as fh:
+			fh.write(f"""FROM {spec['docker']}
+COPY . /tmp/openfido
+WORKDIR /tmp/openfido
+RUN if [ -f requirements.txt ] && command -v python3 >/dev/null; then python3 -m pip install -r requirements.txt; fi
+""")
+		with open(f"{folder}/.dockerignore","w") as fh:
+			fh.write(".git\n.openfido.Dockerfile\n.dockerignore\n")
+		stream["verbose"](f"building {tag} from {spec['docker']}")
+		image, logs = client.images.build(path=folder,dockerfile=".openfido.Dockerfile",tag=tag,rm=True,labels={
+			f"{image_label}.pipeline" : spec["name"],
+			f"{image_label}.base" : spec["docker"],
+			f"{image_label}.github" : spec["github"],
+			f"{image_label}.branch" : spec["branch"],
+			f"{image_label}.commit" : commit,
+			})
+		for log in logs:
+			if "stream" in log.keys() and log["stream"].strip():
+				stream["verbose"](log["stream"].rstrip())
+	for item in client.images.list(filters={"label":f"{image_label}.pipeline={spec['name']}"}):
+		if item.id != image.id:
+			try:
+				client.images.remove(item.id)
+			except Exception as err:
+				stream["verbose"](f"unable to remove old pipeline image {item.tags} ({err})")
+	return image
+
+def get_image(client,spec,rebuild=False,stream=None,conn=None):
+	"""Get the image of the current commit of a pipeline, building it if needed
+
+	When the branch cannot be resolved, e.g., when offline, the most recent image
+	built for the pipeline is used. When the pipeline database is given, the
+	image found is reused without checking the branch or the image for
+	`pipeline_ttl` seconds.
+
+	Returns:
+		image tag and commit hash
+	"""
+	import docker, openfido
+	if conn and not rebuild:
+		row = conn.execute("SELECT * FROM images WHERE pipeline=? AND docker=? AND github=? AND branch=?",
+			[spec["name"],spec["docker"],spec["github"],spec["branch"]]).fetchone()
+		if row and time.time() - row["checked"] < openfido.pipeline_ttl:
+			return row["image"], row["commit_id"]
+	tag, commit = find_image(client,spec,rebuild,stream)
+	if conn:
+		conn.execute("INSERT OR REPLACE INTO images (pipeline,docker,github,branch,commit_id,image,checked) VALUES (?,?,?,?,?,?,?)",
+			[spec["name"],spec["docker"],spec["github"],spec["branch"],commit,tag,time.time()])
+	return tag, commit
+
+def forget_image(conn,name):
+	"""Forget the image found for a pipeline so that it is checked on the next run"""
+	conn.execute("DELETE FROM images WHERE pipeline=?",[name])
+
+def find_image(client,spec,rebuild=False,stream=None):
+	"""Find or build the image of the current commit of a pipeline"""
+	import docker
+	try:
+		commit = get_remote_commit(spec["github"],spec["branch"])
+	except Exception as err:
+		images = [item for item in client.images.list(filters={"label":f"{image_label}.pipeline={spec['name']}"})
+			if item.labels.get(f"{image_label}.branch") == spec["branch"] and item.labels.get(f"{image_label}.base") == spec["docker"]]
+		if rebuild or not images:
+			raise
+		image = max(images,key=lambda item:item.attrs.get("Created",""))
+		commit = image.labels[f"{image_label}.commit"]
+		stream["warning"](f"{err}, using the image of commit {commit}")
+		return get_image_name(spec["name"],commit), commit
+	tag = get_image_name(spec["name"],commit)
+	try:
+		image = client.images.get(tag)
+		if rebuild or image.labels.get(f"{image_label}.base") != spec["docker"]:
+			raise docker.errors.ImageNotFound(f"rebuilding {tag}")
+	except docker.errors.ImageNotFound:
+		build_image(client,spec,commit,stream)
+	return tag, commit
+
+def get_stats(container):
+	"""Get a docker stats sample of a container, or None if the container is gone"""
+	import docker
+	try:
+		try:
+			return container.stats(stream=False,one_shot=True)
+		except TypeError: # docker SDK without one-shot stats
+			return container.stats(stream=False)
+	except (docker.errors.APIError,docker.errors.NotFound):
+		return None
+
+def get_usage(stats):
+	"""Get the RSS, and the cumulative CPU seconds and block I/O, of a docker stats sample"""
+	memory = stats.get("memory_stats") or {}
+	detail = memory.get("stats") or {}
+	rss = detail.get("total_rss",detail.get("rss",detail.get("anon")))
+	if rss is None:
+		rss = memory.get("usage",0) - detail.get("total_inactive_file",detail.get("inactive_file",0))
+	io = (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []
+	return {
+		"rss" : rss,
+		"cpu" : ((stats.get("cpu_stats") or {}).get("cpu_usage") or {}).get("total_usage",0)/1e9,
+		"read" : sum(item["value"] for item in io if item.get("op","").lower() == "read"),
+		"write" : sum(item["value"] for item in io if item.get("op","").lower() == "write"),
+		}
+
+def track_usage(container,call,usage,shared=False):
+	"""Run a call while sampling the resource usage of a container
+
+	The `usage` dict is filled with the peak RSS, the CPU seconds and block I/O
+	bytes of the container, and the wall time of the call, even when the call
+	fails. When the container is `shared` and outlives the call, only the usage
+	between the samples taken before and after the call is counted.
+	"""
+	import threading
+	peak = {"rss":0, "cpu":0.0, "read":0, "write":0}
+	base = {"cpu":0.0, "read":0, "write":0}
+	samples = [0]
+	def update(stats):
+		if stats:
+			for key, value in get_usage(stats).items():
+				peak[key] = max(peak[key],value)
+			samples[0] += 1
+	if shared:
+		stats = get_stats(container)
+		if stats:
+			base.update({key:value for key, value in get_usage(stats).items() if key in base.keys()})
+	stop = threading.Event()
+	def sample():
+		while not stop.is_set():
+			stats = get_stats(container)
+			if not stats:
+				break
+			update(stats)
+			stop.wait(stats_interval)
+	thread = threading.Thread(target=sample,daemon=True)
+	started = time.time()
+	thread.start()
+	try:
+		return call()
+	finally:
+		usage["wall_seconds"] = time.time() - started
+		stop.set()
+		thread.join()
+		if shared:
+			update(get_stats(container))
+		usage.update({
+			"peak_rss" : peak["rss"],
+			"cpu_seconds" : max(0.0,peak["cpu"]-base["cpu"]),
+			"read_bytes" : max(0,peak["read"]-base["read"]),
+			"write_bytes" : max(0,peak["write"]-base["write"]),
+			"samples" : samples[0],
+			})
+
+def runlocal_pipepline(name,image_name,entry,inputfolder,outputfolder,client=None,limits={},usage=None):
+	"""Run a pipeline image in a new container with an input and output folder
+
+	The container is created with the docker resource `limits`, and its
+	resource usage is sampled into the `usage` dict while it runs.
+	"""
+	import docker
+	if not client:
+		client = docker.from_env()
+	if usage is None:
+		usage = {}
+	command = f"sh -c 'cd /tmp/openfido ; export OPENFIDO_INPUT=/tmp/input ; export OPENFIDO_OUTPUT=/tmp/output ; . /tmp/openfido/{entry} 0</dev/null 1>/tmp/output/stdout 2>/tmp/output/stderr' "
+	container = client.containers.run(image_name,
+		command = command,
+		detach = True,
+		volumes = {
+			os.path.abspath(inputfolder) : {"bind" : "/tmp/input", "mode" : "ro" },
+			os.path.abspath(outputfolder) : {"bind" : "/tmp/output", "mode" : "rw" },
+		},
+		**limits)
+	try:
+		code = track_usage(container,container.wait,usage)["StatusCode"]
+		container.reload()
+		usage["oom_killed"] = container.attrs.get("State",{}).get("OOMKilled",False)
+		if code:
+			raise docker.errors.ContainerError(container,code,command,image_name,
+				"out of memory" if usage["oom_killed"] else None)
+	finally:
+		container.remove(force=True)
+
+def start_pool_container(client,image_name,idle,limits={}):
+	"""Start a warm container for a pipeline image with the docker resource `limits`
+
+	The container waits for jobs in its staging folder and exits when it has
+	been idle for `idle` seconds, or when its staging folder is removed.
+
+	Returns:
+		container and its lock file, which is held until the job is done
+	"""
+	import fcntl, uuid
+	name = f"openfido-pool-{uuid.uuid4().hex[:12]}"
+	folder = os.path.join(pool_root,name)
+	os.makedirs(folder)
+	open(f"{folder}/alive","w").close()
+	lock = open(f"{folder}/lock","w")
+	fcntl.flock(lock,fcntl.LOCK_EX)
+	open(f"{folder}/busy","w").close()
+	wait = f"while [ -e {pool_mount}/busy ] || [ $(( $(date +%s) - $(stat -c %Y {pool_mount}/alive) )) -lt {idle} ]; do sleep 5; done"
+	try:
+		container = client.containers.run(image_name,
+			entrypoint = ["sh","-c",wait],
+			name = name,
+			detach = True,
+			auto_remove = True,
+			labels = {f"{image_label}.pool" : image_name, f"{image_label}.limits" : json.dumps(limits,sort_keys=True)},
+			volumes = {folder : {"bind" : pool_mount, "mode" : "rw"}},
+			**limits)
+	except:
+		lock.close()
+		shutil.rmtree(folder,ignore_errors=True)
+		raise
+	return container, lock
+
+def acquire_container(client,image_name,size,idle,limits={}):
+	"""Get an idle warm container for a pipeline image, starting one if the pool is not full
+
+	Warm containers are shared by all the openfido processes of the user. A
+	container is reserved by locking its lock file. Only the containers started
+	with the same resource `limits` are used, and each set of limits has its own
+	pool. The staging folders of the containers that have exited are removed.
+
+	Returns:
+		container and its lock file, or None and None if all `size` containers are busy
+	"""
+	import fcntl
+	os.makedirs(pool_root,exist_ok=True)
+	with open(f"{pool_root}/.lock","a") as pool_lock:
+		fcntl.flock(pool_lock,fcntl.LOCK_EX)
+		running = client.containers.list(filters={"label":f"{image_label}.pool","status":"running"})
+		names = [container.name for container in running]
+		for item in os.listdir(pool_root):
+			if not item.startswith(".") and item not in names and not os.path.exists(f"{pool_root}/{item}/busy"):
+				shutil.rmtree(f"{pool_root}/{item}",ignore_errors=True)
+		running = [container for container in running if container.labels.get(f"{image_label}.pool") == image_name
+			and container.labels.get(f"{image_label}.limits","{}") == json.dumps(limits,sort_keys=True)]
+		return reserve_container(client,image_name,running,size,idle,limits)
+
+def reserve_container(client,image_name,running,size,idle,limits={}):
+	"""Reserve one of the running warm containers, or start one if the pool is not full"""
+	import fcntl
+	for container in running:
+		try:
+			lock = open(f"{pool_root}/{container.name}/lock","a")
+		except FileNotFoundError:
+			continue
+		try:
+			fcntl.flock(lock,fcntl.LOCK_EX|fcntl.LOCK_NB)
+		except BlockingIOError:
+			lock.close()
+			continue
+		open(f"{pool_root}/{container.name}/busy","w").close()
+		container.reload()
+		if container.status == "running":
+			return container, lock
+		os.remove(f"{pool_root}/{container.name}/busy")
+		lock.close()
+	if len(running) < size:
+		return start_pool_container(client,image_name,idle,limits)
+	return None, None
+
+def runpool_pipeline(container,lock,entry,inputfolder,outputfolder,usage=None):
+	"""Run a job in a warm pipeline container
+
+	The input folder is copied into a fresh staging folder for the job, and the
+	files the job writes in its staging output folder are moved to the output
+	folder. The resource usage of the job is sampled into the `usage` dict. The
+	container is released when the job is done.
+	"""
+	import docker
+	if usage is None:
+		usage = {}
+	folder = os.path.join(pool_root,container.name)
+	job = f"{pool_mount}/job"
+	command = f"cd /tmp/openfido ; export OPENFIDO_INPUT={job}/input ; export OPENFIDO_OUTPUT={job}/output ; . /tmp/openfido/{entry} 0</dev/null 1>{job}/output/stdout 2>{job}/output/stderr"
+	try:
+		container.exec_run(["rm","-rf",job])
+		shutil.copytree(inputfolder,f"{folder}/job/input")
+		os.makedirs(f"{folder}/job/output")
+		code, output = track_usage(container,lambda: container.exec_run(["sh","-c",command]),usage,shared=True)
+		os.makedirs(outputfolder,exist_ok=True)
+		for item in os.listdir(f"{folder}/job/output"):
+			target = os.path.join(outputfolder,item)
+			if os.path.isdir(target) and not os.path.islink(target):
+				shutil.rmtree(target)
+			elif os.path.lexists(target):
+				os.remove(target)
+			shutil.move(f"{folder}/job/output/{item}",target)
+		if code:
+			raise docker.errors.ContainerError(container,code,command,container.image,output)
+	finally:
+		os.utime(f"{folder}/alive")
+		os.remove(f"{folder}/busy")
+		lock.close()
+
+def run_image(client,name,image_name,entry,inputfolder,outputfolder,pool=0,limits={},usage=None):
+	"""Run a pipeline image, in a warm container when the pool is enabled and not full"""
+	import openfido
+	if pool > 0:
+		container, lock = acquire_container(client,image_name,pool,openfido.pipeline_idle,limits)
+		if container:
+			return runpool_pipeline(container,lock,entry,inputfolder,outputfolder,usage)
+	return runlocal_pipepline(name,image_name,entry,inputfolder,outputfolder,client,limits,usage)
+
+def write_record(conn,run,image_name,limits,usage,cached=False):
+	"""Write the record of a pipeline run and its resource usage in its output folder"""
+	row = conn.execute("SELECT * FROM runs WHERE id=?",[run]).fetchone()
+	record = {
+		"pipeline" : row["pipeline"],
+		"commit" : row["commit_id"],
+		"image" : image_name,
+		"inputfolder" : row["inputfolder"],
+		"outputfolder" : row["outputfolder"],
+		"started" : row["started"],
+		"elapsed" : row["ended"]-row["started"] if row["ended"] else None,
+		"status" : row["status"],
+		"error" : row["error"],
+		"limits" : limits,
+		"usage" : usage,
+		"cached" : cached,
+		}
+	os.makedirs(row["outputfolder"],exist_ok=True)
+	file = os.path.join(row["outputfolder"],run_record)
+	with open(file,"w") as fh:
+		json.dump(record,fh,indent=1)
+
+def runlocal_recorded(conn,spec,inputfolder,outputfolder,rebuild=False,stream=None,pool=0,image=None,cache=True,force=False,limits={}):
+	"""Run a local pipeline and record the run in the pipeline database
+
+	The image tag and commit to run may be given as `image`, otherwise the
+	current image of the pipeline is used. The resource limits of the spec may
+	be replaced by `limits`, and the run record is written in the output folder. When `run_cache` is set and `cache`
+	is true, the outputs are restored from the run cache if the pipeline commit
+	was already run on the same input files, unless `force` is true.
+
+	Returns:
+		exit status of the run
+	"""
+	import docker
+	client = docker.from_env()
+	image_name, commit = image if image else get_image(client,spec,rebuild,stream,conn)
+	options = get_limits(spec,limits)
+	memo = None
+	cachedir = None
+	if cache:
+		import openfido_runcache as rc
+		cachedir = rc.get_cachedir()
+	if cachedir:
+		with contextlib.closing(rc.open_cache(cachedir)) as cacheconn:
+			memo = rc.get_pipeline_run(cacheconn,spec,commit,inputfolder,outputfolder)
+			if force:
+				rc.count(cacheconn,"misses")
+			elif rc.restore(cacheconn,cachedir,memo,stream):
+				run = start_run(conn,spec["name"],inputfolder,outputfolder,commit)
+				end_run(conn,run,0)
+				write_record(conn,run,image_name,options,{},cached=True)
+				return 0
+	run = start_run(conn,spec["name"],inputfolder,outputfolder,commit)
+	usage = {}
+	try:
+		try:
+			run_image(client,spec["name"],image_name,spec["entry"],inputfolder,outputfolder,pool,options,usage)
+		except docker.errors.NotFound:
+			forget_image(conn,spec["name"]) # the image was removed since it was last checked
+			image_name, commit = get_image(client,spec,rebuild,stream,conn)
+			conn.execute("UPDATE runs SET commit_id=? WHERE id=?",[commit,run])
+			run_image(client,spec["name"],image_name,spec["entry"],inputfolder,outputfolder,pool,options,usage)
+	except BaseException as err:
+		end_run(conn,run,getattr(err,"exit_status",1),str(err) or type(err).__name__)
+		with contextlib.suppress(OSError):
+			write_record(conn,run,image_name,options,usage)
+		raise
+	end_run(conn,run,0)
+	write_record(conn,run,image_name,options,usage)
+	if memo:
+		row = conn.execute("SELECT started, ended FROM runs WHERE id=?",[run]).fetchone()
+		with contextlib.closing(rc.open_cache(cachedir)) as cacheconn:
+			memo = rc.get_pipeline_run(cacheconn,spec,commit,inputfolder,outputfolder) # the image may have been rebuilt for a new commit
+			rc.save(cacheconn,cachedir,memo,row["ended"]-row["started"])
+	return 0
+
+def parse_size(size):
+	"""Convert a memory size such as '512m' or '2g' to bytes"""
+	units = {"k":2**10, "m":2**20, "g":2**30, "t":2**40}
+	try:
+		if str(size)[-1:].lower() in units.keys():
+			return int(float(size[:-1])*units[size[-1].lower()])
+		return int(size)
+	except ValueError:
+		raise Exception(f"'{size}' is not a valid memory size")
+
+def get_available_memory():
+	"""Get the memory available for new processes in bytes, or None if unknown"""
+	try:
+		with open("/proc/meminfo","r") as fh:
+			for line in fh:
+				if line.startswith("MemAvailable:"):
+					return int(line.split()[1])*1024
+	except OSError:
+		pass
+	try:
+		return os.sysconf("SC_AVPHYS_PAGES")*os.sysconf("SC_PAGE_SIZE")
+	except (ValueError,OSError):
+		return None
+
+def get_run_limit(memory=run_memory):
+	"""Get the number of pipeline runs the host can run at the same time
+
+	The limit is the number of CPUs, reduced so that each run has `memory` bytes
+	of the memory currently available.
+	"""
+	limit = os.cpu_count() or 1
+	available = get_available_memory()
+	if memory and available:
+		limit = min(limit,available//memory)
+	return max(1,limit)
+
+def get_input_folders(source):
+	"""Get the input folders of a list of folders or folder patterns
+
+	The source is a comma-separated list of folders or glob patterns, or
+	`@FILE` to read the list from a file with one folder or pattern per line.
+	"""
+	import glob
+	if source.startswith("@"):
+		with open(source[1:],"r") as fh:
+			items = [line.strip() for line in fh if line.strip()]
+	else:
+		items = source.split(",")
+	folders = []
+	for item in items:
+		if glob.has_magic(item):
+			folders.extend(path for path in sorted(glob.glob(item)) if os.path.isdir(path))
+		else:
+			folders.append(item)
+	return folders
+
+def get_runs_jobs(folders,template):
+	"""Get the input and output folders of runs using an output folder template
+
+	The template is formatted with the `path`, `dir` and `name` of the input
+	folder and the run number `n`, e.g., 'results/{name}'.
+	"""
+	jobs = []
+	for n, path in enumerate(folders):
+		path = path.rstrip("/") or "/"
+		output = template.format(path=path,dir=os.path.dirname(path),name=os.path.basename(path),n=n)
+		jobs.append({"input":path, "output":output})
+	outputs = [job["output"] for job in jobs]
+	if len(set(outputs)) < len(outputs):
+		raise Exception(f"output folder template '{template}' gives the same output folder to several runs")
+	return jobs
+
+def schedule_runs(spec,jobs,workers=None,retries=0,rebuild=False,stream=None,pool=0,summary=None,cache=True,force=False,limits={}):
+	"""Run a local pipeline on many input folders concurrently
+
+	The pipeline image is resolved once and used by all runs. Up to `workers`
+	runs are executed at the same time and the others wait in a queue. A run that
+	fails is queued again up to `retries` times without stopping the others. The
+	status of each run is reported as it completes, and the runs are listed in
+	the `summary` CSV file when it is given.
+
+	Returns:
+		dict of the number of runs that succeeded and failed, and their numbers
+	"""
+	import docker
+	from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+	with contextlib.closing(open_pipelines()) as conn:
+		image = get_image(docker.from_env(),spec,rebuild,stream,conn)
+	options = get_limits(spec,limits)
+	if not workers:
+		workers = get_run_limit(options.get("mem_limit",run_memory))
+	for job in jobs:
+		os.makedirs(job["output"],exist_ok=True)
+	def run(job):
+		started = time.time()
+		with contextlib.closing(open_pipelines()) as conn:
+			runlocal_recorded(conn,spec,job["input"],job["output"],stream=stream,pool=pool,image=image,cache=cache,force=force,limits=limits)
+		return time.time() - started
+	results = {n:{"status":None,"attempts":0,"elapsed":None,"error":None} for n in range(len(jobs))}
+	done = []
+	failed = []
+	start = time.time()
+	with ThreadPoolExecutor(max_workers=max(1,min(workers,len(jobs)))) as executor:
+		def submit(n):
+			results[n]["attempts"] += 1
+			stream["verbose"](f"run {n} started ({jobs[n]['input']})")
+			return executor.submit(run,jobs[n])
+		futures = {submit(n):n for n in range(len(jobs))}
+		while futures:
+			completed, pending = wait(futures.keys(),return_when=FIRST_COMPLETED)
+			for future in completed:
+				n = futures.pop(future)
+				try:
+					results[n].update(status=0,elapsed=future.result(),error=None)
+				except Exception as err:
+					results[n].update(status=getattr(err,"exit_status",1),error=str(err) or type(err).__name__)
+				result = results[n]
+				if result["status"] == 0:
+					stream["output"](f"run {n} ok in {result['elapsed']:.1f} s ({jobs[n]['input']} -> {jobs[n]['output']})")
+					done.append(n)
+				elif result["attempts"] <= retries:
+					stream["warning"](f"run {n} failed (attempt {result['attempts']}), retrying: {result['error']}")
+					futures[submit(n)] = n
+				else:
+					stream["error"](f"run {n} failed after {result['attempts']} attempt(s): {result['error']}")
+					failed.append(n)
+	elapsed = time.time() - start
+	if summary:
+		import csv
+		with open(summary,"w",newline="") as fh:
+			writer = csv.writer(fh)
+			writer.writerow(["run","status","attempts","elapsed","input","output","error"])
+			for n, job in enumerate(jobs):
+				result = results[n]
+				writer.writerow([n,result["status"],result["attempts"],
+					f"{result['elapsed']:.3f}" if result["elapsed"] is not None else "",
+					job["input"],job["output"],result["error"] or ""])
+	stream["output"](f"{len(jobs)} runs, {len(done)} ok, {len(failed)} failed in {elapsed:.1f} s")
+	return {"ok":len(done), "errors":len(failed), "done":sorted(done), "failed":sorted(failed)}
+
+def is_busy(name):
+	"""Check whether a warm pipeline container is reserved by a run"""
+	import fcntl
+	try:
+		with open(f"{pool_root}/{name}/lock","a") as lock:
+			fcntl.flock(lock,fcntl.LOCK_EX|fcntl.LOCK_NB)
+	except BlockingIOError:
+		return True
+	except FileNotFoundError:
+		pass
+	return False
+
+def get_pool(client):
+	"""Get the warm pipeline containers and whether they are busy"""
+	result = []
+	for container in client.containers.list(filters={"label":f"{image_label}.pool"}):
+		busy = is_busy(container.name)
+		result.append({"name":container.name, "image":container.labels.get(f"{image_label}.pool"),
+			"status":"busy" if busy else container.status})
+	return result
+
+def stop_pool(client):
+	"""Stop the idle warm pipeline containers"""
+	for item in get_pool(client):
+		if item["status"] != "busy":
+			client.containers.get(item["name"]).stop(timeout=1)
+			shutil.rmtree(f"{pool_root}/{item['name']}",ignore_errors=True)
+
+def pipeline(options=[], stream=None):
+	"""Syntax: openfido [OPTIONS] pipeline COMMAND [OPTIONS]
+
+	The `pipeline` function is used to create and start pipeline operations.
+
+	COMMAND:
+
+		create [-l|--local] [LIMIT_OPTIONS] NAME DOCKER GITHUB BRANCH ENTRY [DESCRIPTION]
+		build [-l|--local] [--rebuild] NAME
+		start [-l|--local] [--rebuild] [--no-pool] [--force|--no-cache] [START_OPTIONS] [LIMIT_OPTIONS] NAME INPUTFOLDER OUTPUTFOLDER
+		delete [-l|--local] NAME
+		list [-l|--local]
+		history [-l|--local] [NAME]
+		pool [-l|--local] [stop]
+
+	Local pipelines run in an image built for the current commit of the
+	pipeline's branch, which contains the pipeline's files and requirements. The
+	image is built when the branch changes, or when `--rebuild` is given.
+
+	When `pipeline_pool` is set, up to that many warm containers are kept for
+	each pipeline image, and runs are executed in an idle warm container with a
+	copy of the input folder. Warm containers exit after `pipeline_idle` seconds
+	without a run. The `pool` command lists the warm containers, or stops the
+	idle ones.
+
+	When `run_cache` is set, a run of a pipeline commit on input files that were
+	already processed restores the outputs of the earlier run instead of running
+	the pipeline. Use `--force` to run the pipeline again, or `--no-cache` to run
+	it without using the run cache.
+
+	The INPUTFOLDER of `start` may be a comma-separated list of folders or glob
+	patterns, or @FILE to read the list from a file. The OUTPUTFOLDER is then a
+	template formatted with the `path`, `dir` and `name` of each input folder
+	and the run number `n`, e.g., 'results/{name}'. The runs are executed
+	concurrently, and failed runs are retried without stopping the others.
+
+	START_OPTIONS:
+
+		-j|--jobs=N        maximum number of concurrent runs (default is the number
+		                   of CPUs, limited by the available memory)
+		--memory=SIZE      memory needed by each run to size the concurrency (default 1g)
+		--retries=N        number of times a failed run is retried (default 0)
+		--summary=CSVFILE  write the status of each run to a CSV file
+
+	LIMIT_OPTIONS:
+
+		--cpus=N             CPU quota of each run, e.g., 1.5
+		--cpuset=CPUS        CPUs on which each run may execute, e.g., 0-3 or 1,3
+		--memory-limit=SIZE  memory limit of each run, e.g., 4g (also sizes the
+		                     concurrency when --memory is not given)
+		--pids-limit=N       maximum number of processes of each run
+
+	The limits given to `create` are stored with the pipeline, and the limits
+	given to `start` replace them for that run. The status, limits and resource
+	usage of each run are written to `openfido-run.json` in its output folder.
+	"""
+	import openfido
+	if not stream:
+		stream = openfido.command_streams
+	if len(options) < 1:
+		raise Exception("missing pipeline command")
+	command = options[0]
+	local = False
+	rebuild = False
+	pool = openfido.pipeline_pool
+	workers = None
+	memory = None
+	limits = {}
+	retries = 0
+	summary = None
+	cache = True
+	force = False
+	args = []
+	for option in options[1:]:
+		if option[0] == '-':
+			if option in ["-l","--local"]:
+				local = True
+			elif option == "--rebuild":
+				rebuild = True
+			elif option == "--no-pool":
+				pool = 0
+			elif option == "--force":
+				force = True
+			elif option == "--no-cache":
+				cache = False
+			elif option.startswith(("-j=","--jobs=")):
+				workers = int(option.split("=",1)[1])
+			elif option.startswith("--memory="):
+				memory = option.split("=",1)[1]
+			elif option.startswith("--retries="):
+				retries = int(option.split("=",1)[1])
+			elif option.startswith("--summary="):
+				summary = option.split("=",1)[1]
+			elif option.split("=",1)[0] in [f"--{field.replace('_','-')}" for field in limit_fields] and "=" in option:
+				field, value = option[2:].split("=",1)
+				limits[field.replace('-','_')] = value
+			else:
+				stream["error"](f"option '{option}' is not valid")
+				return
+		else:
+			args.append(option)
+	if command == "create":
+		if len(args) < 5:
+			raise Exception(f"missing one or more pipeline create arguments (args={args})")
+		if len(args) > 6:
+			raise Exception(f"too many pipeline create arguments (args={args})")
+		if local:
+			with contextlib.closing(open_pipelines()) as conn:
+				add_pipeline(conn,dict(zip(pipeline_fields,args),**limits))
+		else:
+			raise Exception(f"remote pipeline create not implemented yet (args={args})")
+	elif command == "build":
+		if len(args) < 1:
+			raise Exception(f"missing pipeline build argument (args={args})")
+		if len(args) > 1:
+			raise Exception(f"too many pipeline build arguments (args={args})")
+		if local:
+			import docker
+			with contextlib.closing(open_pipelines()) as conn:
+				spec = get_pipeline(conn,args[0])
+				image_name, commit = get_image(docker.from_env(),spec,rebuild,stream,conn)
+			stream["output"](image_name)
+		else:
+			raise Exception(f"remote pipeline build not implemented yet (args={args})")
+	elif command == "start":
+		if len(args) < 3:
+			raise Exception(f"missing one or more pipeline start arguments (args={args})")
+		if len(args) > 3:
+			raise Exception(f"too many pipeline start arguments (args={args})")
+		pipeline = args[0]
+		inputfolder = args[1]
+		outputfolder = args[2]
+		if local:
+			with contextlib.closing(open_pipelines()) as conn:
+				spec = get_pipeline(conn,pipeline)
+			folders = get_input_folders(inputfolder)
+			if not folders:
+				raise Exception(f"no input folders found in '{inputfolder}'")
+			if len(folders) == 1 and not "{" in outputfolder and not summary:
+				with contextlib.closing(open_pipelines()) as conn:
+					runlocal_recorded(conn,spec,folders[0],outputfolder,rebuild,stream,pool,cache=cache,force=force,limits=limits)
+			else:
+				if not workers:
+					workers = get_run_limit(parse_size(memory) if memory else get_limits(spec,limits).get("mem_limit",run_memory))
+				return schedule_runs(spec,get_runs_jobs(folders,outputfolder),workers,retries,rebuild,stream,pool,summary,cache,force,limits)
+		else:
+			raise Exception(f"remote pipeline start not implemented yet (args={args})")
+	elif command == "delete":
+		if len(args) < 1:
+			raise Exception(f"missing pipeline delete argument (args={args})")
+		pipeline = args[0]
+		if local:
+			with contextlib.closing(open_pipelines()) as conn:
+				delete_pipeline(conn,pipeline)
+		else:
+			raise Exception(f"remote pipeline delete not implemented yet (args={args})")
+	elif command == "list":
+		if local:
+			with contextlib.closing(open_pipelines()) as conn:
+				for item in list_pipelines(conn):
+					stream["output"](item["name"])
+		else:
+			raise Exception(f"remote pipeline delete not implemented yet (args={args})")
+	elif command == "history":
+		if local:
+			with contextlib.closing(open_pipelines()) as conn:
+				runs = get_runs(conn,args[0] if args else None)
+			stream["output"](" ".join(f"{field:20s}" for field in ["pipeline","started","elapsed","status","outputfolder"]))
+			for run in runs:
+				started = time.strftime("%Y-%m-%d %H:%M:%S",time.localtime(run["started"]))
+				elapsed = f"{run['ended']-run['started']:.1f}s" if run["ended"] else "running"
+				status = run["status"] if run["status"] is not None else "-"
+				stream["output"](f"{run['pipeline']:20s} {started:20s} {elapsed:20s} {str(status):20s} {run['outputfolder']}")
+		else:
+			raise Exception(f"remote pipeline history not implemented yet (args={args})")
+	elif command == "pool":
+		if local:
+			import docker
+			client = docker.from_env()
+			if args == ["stop"]:
+				stop_pool(client)
+			elif args:
+				raise Exception(f"invalid pipeline pool arguments (args={args})")
+			else:
+				for item in get_pool(client):
+					stream["output"](f"{item['name']:30s} {item['status']:10s} {item['image']}")
+		else:
+			raise Exception(f"remote pipeline pool not implemented yet (args={args})")
+	else:
+		raise Exception(f"invalid pipeline command (command='{command}')")
@@ -0,0 +1,119 @@
+"""OpenFIDO run profiler
+
+`openfido run --profile[=FILE] PRODUCT ...` runs a product in the current
+process under cProfile and tracemalloc, and writes a JSON report to FILE
+(default `openfido-profile.json`) even when the product fails. The report
+contains:
+
+	product   name, commit and options of the run, and its status and error
+	phases    wall and CPU seconds of the `import` of the product, and of the
+	          `read`, `compute` and `write` phases of the run and their `total`
+	hotspots  the functions with the most own time, with their number of calls
+	          and cumulative time
+	memory    the peak traced memory and the sites that allocated the most
+	          memory still in use at the end of the run
+	inputs    file, size in bytes, rows, columns and seconds of each input
+	outputs   file, size in bytes, rows, columns and seconds of each output
+
+The `read` and `write` phases are the time spent in the `openfido_util` read
+and write functions, and `compute` is the rest of the run. Concurrent reads are
+counted once. Hotspots are those of the main thread only. Profiling slows the
+product down, so the phases are only comparable between profiled runs.
+"""
+
+import sys, json, time
+
+report_filename = "openfido-profile.json" # default profile report file
+profile_hotspots = 25 # number of functions listed in the hotspots
+profile_sites = 10 # number of allocation sites listed in the memory report
+
+def get_hotspots(profiler,limit=profile_hotspots):
+	"""Get the functions with the most own time from a cProfile profiler"""
+	import pstats
+	stats = pstats.Stats(profiler).stats
+	result = []
+	for (file, line, function), (primitive, calls, own, cumulative, callers) in sorted(stats.items(),key=lambda item: -item[1][2])[:limit]:
+		result.append({"function":f"{file}:{line}({function})" if line else function,
+			"calls":calls, "own_seconds":own, "cumulative_seconds":cumulative})
+	return result
+
+def get_sites(snapshot,limit=profile_sites):
+	"""Get the sites that allocated the most memory from a tracemalloc snapshot"""
+	result = []
+	for stat in snapshot.statistics("lineno")[:limit]:
+		frame = stat.traceback[0]
+		result.append({"site":f"{frame.filename}:{frame.lineno}", "bytes":stat.size, "blocks":stat.count})
+	return result
+
+def get_phases(phases,total,imported):
+	"""Get the import, read, compute, write and total times of a profiled run"""
+	result = {"import":imported}
+	for phase in ["read","write"]:
+		state = phases.get(phase,{})
+		result[phase] = {"wall_seconds":state.get("wall_seconds",0.0), "cpu_seconds":state.get("cpu_seconds",0.0),
+			"calls":state.get("calls",0)}
+	result["compute"] = {key:max(0.0,total[key]-result["read"][key]-result["write"][key]) for key in ["wall_seconds","cpu_seconds"]}
+	result["total"] = {key:imported[key]+total[key] for key in ["wall_seconds","cpu_seconds"]}
+	return result
+
+def run_profiled(options,report=None,stream=None):
+	"""Run a product in this process and write its profile report
+
+	Returns:
+		the product result
+	"""
+	import cProfile, tracemalloc, openfido
+	if not stream:
+		stream = openfido.command_streams
+	if not report:
+		report = report_filename
+	name = options[0]
+	profile = {"phases":{}, "files":[]}
+	times = {"import":{"wall_seconds":0.0, "cpu_seconds":0.0}, "run":{"wall_seconds":0.0, "cpu_seconds":0.0}}
+	clock = [time.perf_counter(),time.process_time()]
+	def lap(phase):
+		now = [time.perf_counter(),time.process_time()]
+		times[phase] = {"wall_seconds":now[0]-clock[0], "cpu_seconds":now[1]-clock[1]}
+		clock[:] = now
+	status = 0
+	error = None
+	started = time.time()
+	profiler = cProfile.Profile()
+	tracemalloc.start()
+	profiler.enable()
+	phase = "import"
+	try:
+		import openfido_util
+		module = openfido.load_product(name,stream)
+		lap(phase)
+		phase = "run"
+		openfido_util.profile = profile
+		return openfido.run_product(module,options,stream)
+	except BaseException as err:
+		status = err.code if type(err) is SystemExit and type(err.code) is int else 1
+		error = str(err) or type(err).__name__
+		raise
+	finally:
+		lap(phase)
+		profiler.disable()
+		if "openfido_util" in sys.modules.keys():
+			sys.modules["openfido_util"].profile = None
+		peak = tracemalloc.get_traced_memory()[1]
+		snapshot = tracemalloc.take_snapshot()
+		tracemalloc.stop()
+		data = {
+			"product" : name,
+			"commit" : openfido.get_commit(f"{openfido.cache}/{name}"),
+			"options" : options[1:],
+			"started" : started,
+			"status" : status,
+			"error" : error,
+			"phases" : get_phases(profile["phases"],times["run"],times["import"]),
+			"hotspots" : get_hotspots(profiler),
+			"memory" : {"peak_bytes":peak, "sites":get_sites(snapshot)},
+			"inputs" : [item for item in profile["files"] if item["phase"] == "read"],
+			"outputs" : [item for item in profile["files"] if item["phase"] == "write"],
+			}
+		with open(report,"w") as fh:
+			json.dump(data,fh,indent=1)
+		stream["verbose"](f"profile of '{name}' written to '{report}'")
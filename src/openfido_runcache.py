@@ -0,0 +1,369 @@
+"""OpenFIDO run cache
+
+When `run_cache` is set to a folder, `openfido run` and local `pipeline start`
+remember the outputs of each run. A run is identified by a key made of the
+content hash of its input files, its flags and options, and the commit and
+code of the installed product or the commit of the pipeline image. When a run
+with the same key is requested again, its outputs are restored from the cache
+instead of running the product or pipeline again.
+
+Outputs are kept in a content-addressed store in `{run_cache}/objects`, so an
+output produced by many runs is stored only once. Restored outputs are copies
+of the stored objects, so later runs may overwrite them without changing the
+store, and each object's content hash is checked as it is copied. The run keys, the file hashes and the hit and miss counts are kept in the SQLite
+database `{run_cache}/runs.db`.
+
+The result of a product run is stored as JSON, and runs whose result cannot be
+stored as JSON are not cached. The run record of a pipeline run is not stored,
+and a new record is written when its outputs are restored.
+
+Only the named input files are part of the key. Products and pipelines that
+read other files, or that read stdin or write stdout, are not cached. Use
+`--force` to run again and replace the cached outputs, or `--no-cache` to run
+without using the cache.
+"""
+
+import os, json, time, hashlib, shutil, contextlib
+
+cache_database = "runs.db" # run cache database in the cache folder
+cache_objects = "objects" # content-addressed store of outputs in the cache folder
+cache_schema = [ # run cache database changes for each schema version
+	[
+		"""CREATE TABLE IF NOT EXISTS runs (
+			key TEXT PRIMARY KEY,
+			kind TEXT NOT NULL,
+			name TEXT NOT NULL,
+			commit_id TEXT,
+			outputs TEXT NOT NULL,
+			result TEXT, -- JSON
+			elapsed REAL NOT NULL,
+			created REAL NOT NULL,
+			hits INTEGER NOT NULL DEFAULT 0,
+			used REAL)""",
+		"""CREATE TABLE IF NOT EXISTS hashes (
+			path TEXT PRIMARY KEY,
+			size INTEGER NOT NULL,
+			mtime INTEGER NOT NULL,
+			inode INTEGER NOT NULL,
+			hash TEXT NOT NULL)""",
+		"""CREATE TABLE IF NOT EXISTS stats (
+			name TEXT PRIMARY KEY,
+			value REAL NOT NULL DEFAULT 0)""",
+	],
+]
+block_size = 2**20 # read size when hashing files
+
+def get_cachedir():
+	"""Get the run cache folder, or None if the run cache is not enabled"""
+	import openfido
+	return os.path.expanduser(openfido.run_cache) if openfido.run_cache else None
+
+def open_cache(cachedir):
+	"""Open the run cache database, creating or upgrading it if needed"""
+	import sqlite3
+	os.makedirs(os.path.join(cachedir,cache_objects),exist_ok=True)
+	conn = sqlite3.connect(os.path.join(cachedir,cache_database),timeout=30,isolation_level=None)
+	conn.row_factory = sqlite3.Row
+	conn.execute("PRAGMA journal_mode=WAL")
+	if conn.execute("PRAGMA user_version").fetchone()[0] < len(cache_schema):
+		conn.execute("BEGIN IMMEDIATE")
+		try:
+			version = conn.execute("PRAGMA user_version").fetchone()[0]
+			for changes in cache_schema[version:]:
+				for change in changes:
+					conn.execute(change)
+			conn.execute(f"PRAGMA user_version={len(cache_schema)}")
+			conn.execute("COMMIT")
+		except:
+			conn.execute("ROLLBACK")
+			conn.close()
+			raise
+	return conn
+
+def hash_file(conn,path):
+	"""Get the sha256 of a file's content
+
+	Hashes are remembered with the size, modification time and inode of the
+	file, so unchanged files are not read again.
+	"""
+	path = os.path.abspath(path)
+	info = os.stat(path)
+	row = conn.execute("SELECT hash FROM hashes WHERE path=? AND size=? AND mtime=? AND inode=?",
+		[path,info.st_size,info.st_mtime_ns,info.st_ino]).fetchone()
+	if row:
+		return row["hash"]
+	sha = hashlib.sha256()
+	with open(path,"rb") as fh:
+		for block in iter(lambda: fh.read(block_size),b""):
+			sha.update(block)
+	result = sha.hexdigest()
+	conn.execute("INSERT OR REPLACE INTO hashes (path,size,mtime,inode,hash) VALUES (?,?,?,?,?)",
+		[path,info.st_size,info.st_mtime_ns,info.st_ino,result])
+	return result
+
+def hash_folder(conn,folder):
+	"""Get the sha256 of the content of each file in a folder by relative path"""
+	result = {}
+	for root, dirs, files in os.walk(folder):
+		dirs.sort()
+		for file in sorted(files):
+			path = os.path.join(root,file)
+			if os.path.isfile(path):
+				result[os.path.relpath(path,folder)] = hash_file(conn,path)
+	return result
+
+def get_code_hash(path):
+	"""Get the sha256 of the code and manifest of an installed product"""
+	sha = hashlib.sha256()
+	for item in sorted(os.scandir(path),key=lambda item: item.name):
+		if item.is_file() and ( item.name.endswith(".py") or item.name == "openfido.json" ):
+			sha.update(item.name.encode())
+			with open(item.path,"rb") as fh:
+				sha.update(hashlib.sha256(fh.read()).digest())
+	return sha.hexdigest()
+
+def get_key(kind,name,commit,options,inputs,outputs):
+	"""Get the key of a run from its code, options, input hashes and output names"""
+	data = json.dumps([kind,name,commit,options,inputs,outputs],sort_keys=True)
+	return hashlib.sha256(data.encode()).hexdigest()
+
+def get_product_run(conn,options):
+	"""Get the key and outputs of an `openfido run` request
+
+	Returns:
+		dict of the run key, product name, commit and output files, or None if
+		the run cannot be cached
+	"""
+	import openfido
+	name = options[0]
+	path = f"{openfido.cache}/{name}"
+	if not os.path.exists(f"{path}/__init__.py"):
+		return None # not installed yet
+	entry_points = openfido.read_registry().get(name,{}).get("entry_points",{})
+	if "openfido" in entry_points.keys():
+		return None # product parses its own options
+	inputs, outputs, flags = openfido.get_run_options(options)
+	if not inputs or not outputs:
+		return None # stdin or stdout
+	for file in inputs:
+		if not os.path.isfile(file) or os.path.realpath(file).startswith("/dev/"):
+			return None
+	for file in outputs:
+		if os.path.realpath(file).startswith("/dev/"):
+			return None
+	commit = openfido.get_commit(path)
+	key = get_key("product",name,[commit,get_code_hash(path)],flags,
+		[hash_file(conn,file) for file in inputs],[os.path.splitext(file)[1] for file in outputs])
+	return {"key":key, "kind":"product", "name":name, "commit":commit, "outputs":outputs}
+
+def get_pipeline_run(conn,spec,commit,inputfolder,outputfolder):
+	"""Get the key and output folder of a local pipeline run"""
+	key = get_key("pipeline",spec["name"],commit,[spec["docker"],spec["entry"]],hash_folder(conn,inputfolder),None)
+	return {"key":key, "kind":"pipeline", "name":spec["name"], "commit":commit, "outputs":outputfolder}
+
+def get_object(cachedir,sha):
+	"""Get the path of a stored object"""
+	return os.path.join(cachedir,cache_objects,sha[:2],sha)
+
+def put_object(cachedir,sha,path):
+	"""Copy a file into the store unless its content is already stored"""
+	target = get_object(cachedir,sha)
+	if os.path.exists(target):
+		return target
+	os.makedirs(os.path.dirname(target),exist_ok=True)
+	import tempfile
+	fd, temp = tempfile.mkstemp(dir=os.path.dirname(target),suffix=".tmp")
+	os.close(fd)
+	shutil.copyfile(path,temp)
+	os.chmod(temp,0o444)
+	os.replace(temp,target)
+	return target
+
+def restore_object(source,sha,target):
+	"""Copy a stored object to an output file, checking its content hash
+
+	Returns:
+		True if the object was restored, or False if it was damaged and removed
+	"""
+	import tempfile
+	folder = os.path.dirname(target)
+	if folder:
+		os.makedirs(folder,exist_ok=True)
+	fd, temp = tempfile.mkstemp(dir=folder or ".",prefix=f".{os.path.basename(target)}.",suffix=".tmp")
+	try:
+		digest = hashlib.sha256()
+		with open(source,"rb") as fh, os.fdopen(fd,"wb") as out:
+			for block in iter(lambda: fh.read(block_size),b""):
+				digest.update(block)
+				out.write(block)
+		if digest.hexdigest() != sha:
+			os.remove(source)
+			return False
+		os.replace(temp,target)
+		temp = None
+		return True
+	finally:
+		if temp:
+			with contextlib.suppress(OSError):
+				os.remove(temp)
+
+def get_files(run):
+	"""Get the output files of a run by the name under which they are stored"""
+	if run["kind"] == "pipeline":
+		import openfido_pipeline
+		folder = run["outputs"]
+		files = {}
+		for root, dirs, names in os.walk(folder):
+			for name in names:
+				path = os.path.join(root,name)
+				files[os.path.relpath(path,folder)] = path
+		files.pop(openfido_pipeline.run_record,None) # written again for each run
+		return files
+	return {str(n):file for n, file in enumerate(run["outputs"])}
+
+def count(conn,name,value=1):
+	"""Add to a run cache counter"""
+	conn.execute("INSERT INTO stats (name,value) VALUES (?,?) ON CONFLICT(name) DO UPDATE SET value=value+?",[name,value,value])
+
+def restore(conn,cachedir,run,stream=None):
+	"""Restore the outputs of a cached run
+
+	Returns:
+		dict of the cached run, or None if the run is not in the cache
+	"""
+	row = conn.execute("SELECT * FROM runs WHERE key=?",[run["key"]]).fetchone()
+	if not row:
+		count(conn,"misses")
+		return None
+	stored = json.loads(row["outputs"])
+	if any(not os.path.exists(get_object(cachedir,sha)) for sha in stored.values()):
+		conn.execute("DELETE FROM runs WHERE key=?",[run["key"]])
+		count(conn,"misses")
+		return None
+	if run["kind"] == "pipeline":
+		targets = {name:os.path.join(run["outputs"],name) for name in stored.keys()}
+	else:
+		targets = {str(n):file for n, file in enumerate(run["outputs"])}
+	for name, sha in stored.items():
+		if not restore_object(get_object(cachedir,sha),sha,targets[name]):
+			conn.execute("DELETE FROM runs WHERE key=?",[run["key"]])
+			count(conn,"misses")
+			return None
+	conn.execute("UPDATE runs SET hits=hits+1, used=? WHERE key=?",[time.time(),run["key"]])
+	count(conn,"hits")
+	count(conn,"saved",row["elapsed"])
+	if stream:
+		stream["verbose"](f"{run['kind']} '{run['name']}' outputs restored from run cache (saved {row['elapsed']:.1f} s)")
+	return dict(row)
+
+def get_result(result):
+	"""Get the JSON text of a run result, or None if JSON cannot represent it"""
+	try:
+		data = json.dumps(result)
+	except (TypeError,ValueError):
+		return None
+	return data if json.loads(data) == result else None
+
+def save(conn,cachedir,run,elapsed,result=None):
+	"""Store the outputs and the result of a completed run
+
+	Returns:
+		True if the run was stored
+	"""
+	data = get_result(result)
+	if data is None:
+		return False
+	files = get_files(run)
+	if any(not os.path.isfile(path) for path in files.values()):
+		return False
+	outputs = {name:put_object(cachedir,hash_file(conn,path),path) for name, path in files.items()}
+	outputs = {name:os.path.basename(path) for name, path in outputs.items()}
+	now = time.time()
+	conn.execute("INSERT OR REPLACE INTO runs (key,kind,name,commit_id,outputs,result,elapsed,created,used) VALUES (?,?,?,?,?,?,?,?,?)",
+		[run["key"],run["kind"],run["name"],run["commit"],json.dumps(outputs),
+			data,elapsed,now,now])
+	return True
+
+def get_stats(conn,cachedir):
+	"""Get the run cache statistics"""
+	stats = {row["name"]:row["value"] for row in conn.execute("SELECT * FROM stats")}
+	runs = conn.execute("SELECT COUNT(*), SUM(hits) FROM runs").fetchone()
+	objects = 0
+	size = 0
+	for root, dirs, files in os.walk(os.path.join(cachedir,cache_objects)):
+		for file in files:
+			objects += 1
+			size += os.path.getsize(os.path.join(root,file))
+	hits = int(stats.get("hits",0))
+	misses = int(stats.get("misses",0))
+	return {"runs":runs[0], "objects":objects, "size":size, "hits":hits, "misses":misses,
+		"hit_rate":hits/(hits+misses) if hits+misses else None, "saved":stats.get("saved",0.0)}
+
+def run_product(options,force=False,stream=None):
+	"""Run a product using the run cache
+
+	Returns:
+		the product result
+	"""
+	import openfido
+	if not stream:
+		stream = openfido.command_streams
+	cachedir = get_cachedir()
+	with contextlib.closing(open_cache(cachedir)) as conn:
+		run = get_product_run(conn,options)
+		if not run:
+			stream["verbose"](f"product '{options[0]}' run is not cacheable")
+		elif not force:
+			cached = restore(conn,cachedir,run,stream)
+			if cached:
+				return json.loads(cached["result"]) if cached["result"] is not None else None
+		else:
+			count(conn,"misses")
+	started = time.time()
+	result = openfido.run_product_local(options,stream)
+	if run:
+		with contextlib.closing(open_cache(cachedir)) as conn:
+			if not save(conn,cachedir,run,time.time()-started,result):
+				stream["verbose"](f"product '{options[0]}' run is not cacheable")
+	return result
+
+def runcache(options=[], stream=None):
+	"""Syntax: openfido [OPTIONS] runcache [stats|clear]
+
+	The `runcache` function shows the statistics of the run cache in the
+	`run_cache` folder, or removes all the cached runs and outputs.
+	"""
+	import openfido
+	if not stream:
+		stream = openfido.command_streams
+	cachedir = get_cachedir()
+	if not cachedir:
+		raise Exception("run cache is not enabled (see 'openfido config set run_cache FOLDER')")
+	if not options:
+		options = ["stats"]
+	if options[0] == "stats":
+		with contextlib.closing(open_cache(cachedir)) as conn:
+			stats = get_stats(conn,cachedir)
+		hit_rate = f"{stats['hit_rate']*100:.0f}%" if stats["hit_rate"] is not None else "-"
+		stream["output"](f"runs: {stats['runs']}")
+		stream["output"](f"objects: {stats['objects']} ({stats['size']/2**20:.1f} MiB)")
+		stream["output"](f"hits: {stats['hits']}")
+		stream["output"](f"misses: {stats['misses']}")
+		stream["output"](f"hit rate: {hit_rate}")
+		stream["output"](f"time saved: {stats['saved']:.1f} s")
+		return stats
+	elif options[0] == "clear":
+		with contextlib.closing(open_cache(cachedir)) as conn:
+			conn.execute("BEGIN IMMEDIATE")
+			try:
+				for table in ["runs","hashes","stats"]:
+					conn.execute(f"DELETE FROM {table}")
+				shutil.rmtree(os.path.join(cachedir,cache_objects),ignore_errors=True)
+				os.makedirs(os.path.join(cachedir,cache_objects),exist_ok=True)
+				conn.execute("COMMIT")
+			except:
+				conn.execute("ROLLBACK")
+				raise
+		stream["verbose"](f"run cache '{cachedir}' cleared")
+	else:
+		raise Exception(f"runcache command '{options[0]}' is not valid")
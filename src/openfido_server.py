@@ -0,0 +1,412 @@
+"""OpenFIDO server
+
+The local openfido server runs in the docker container `openfido-server-1` of
+the `openfido/cli` image (or the image in `IMAGENAME`). Its services listen on
+the ports in `server_ports`, and the web application on `server_port` is ready
+when it replies with HTTP status 200.
+
+The server is started with the docker SDK. While it starts, the container's
+event stream reports when it dies or changes health, and each exposed port is
+checked with exponential backoff until it accepts connections. The start
+stops as soon as the container dies, or when it is not ready after
+`server_timeout` seconds, and the measured startup time of the server and of
+each port is reported.
+
+The settings of the `openfido-server` script apply: the environment variable
+`IMAGENAME`, and the `HOSTNAME`, `PORTNUM`, `OPTIONS`, `LOGFILE` and
+`IMAGENAME` assignments in `openfido-server.conf` next to the script. The
+server's web application on container port `PORTNUM` is published on port
+3000 of `HOSTNAME`, and the container output is appended to `LOGFILE`.
+
+Database backups and restores are run by the `openfido-server` script.
+"""
+
+import os, sys, time, shlex, subprocess
+
+server_name = "openfido-server-1" # docker container of the local server
+server_image = os.getenv("IMAGENAME","openfido/cli:latest") # docker image of the local server
+server_host = "127.0.0.1" # host address on which the server ports are published
+server_port = 3000 # port of the web application
+server_ports = {3000:3000, 5001:5001, 5002:5002, 5003:5003, 9000:9000} # container ports by published host port
+server_options = [] # extra docker run options
+server_timeout = 300 # seconds to wait for the server to be ready
+server_backoff = (0.05,2.0) # initial and maximum delay in seconds between the checks of a port
+server_log = "/var/log/openfido.log" # log of the server container output
+server_script = "/usr/local/bin/openfido-server" # script that runs database backups and restores
+server_settings = ["HOSTNAME","PORTNUM","OPTIONS","LOGFILE","IMAGENAME"] # variables read from the script configuration
+
+def get_script():
+	"""Get the path of the `openfido-server` script"""
+	return server_script if os.path.exists(server_script) else os.path.join(os.path.dirname(os.path.abspath(__file__)),"openfido-server")
+
+def read_config(file=None):
+	"""Read the variable assignments of the `openfido-server` script configuration
+
+	Returns:
+		dict of the values of the variables in `server_settings`
+	"""
+	if not file:
+		file = get_script() + ".conf"
+	result = {}
+	if not os.path.exists(file):
+		return result
+	with open(file,"r") as fh:
+		for line in fh:
+			try:
+				words = shlex.split(line,comments=True)
+			except ValueError as err:
+				raise Exception(f"{file}: {err} in '{line.strip()}'")
+			for word in words:
+				name, found, value = word.partition("=")
+				if found and name in server_settings:
+					result[name] = value
+	return result
+
+def configure(settings={}):
+	"""Apply the server settings
+
+	Arguments:
+		settings (dict): values of the variables in `server_settings`, which
+		override the script configuration and the `IMAGENAME` environment
+		variable
+	"""
+	global server_image, server_host, server_ports, server_options, server_log
+	values = {"IMAGENAME":os.getenv("IMAGENAME","openfido/cli:latest")}
+	values.update(read_config())
+	values.update({name:value for name, value in settings.items() if value is not None})
+	server_image = values["IMAGENAME"]
+	server_host = values.get("HOSTNAME",server_host)
+	try:
+		port = int(values.get("PORTNUM",server_ports[server_port]))
+	except ValueError:
+		raise Exception(f"PORTNUM '{values['PORTNUM']}' is not a valid port number")
+	server_ports = dict(server_ports)
+	server_ports[server_port] = port
+	server_options = shlex.split(values.get("OPTIONS",""))
+	server_log = values.get("LOGFILE",server_log)
+
+def get_run_options(options):
+	"""Convert docker run options to docker SDK container run arguments
+
+	Only the options `-e/--env`, `-v/--volume`, `-p/--publish`, `--network`,
+	`-m/--memory`, `--cpus`, `--restart`, `--add-host`, `-u/--user`, and
+	`-w/--workdir` are supported.
+	"""
+	names = {"-e":"--env", "-v":"--volume", "-p":"--publish", "-m":"--memory", "-u":"--user", "-w":"--workdir"}
+	result = {}
+	options = list(options)
+	while options:
+		option = options.pop(0)
+		option, found, value = option.partition("=") if option.startswith("--") else (option,"","")
+		option = names.get(option,option)
+		if option not in names.values() and option not in ["--network","--cpus","--restart","--add-host"]:
+			raise Exception(f"server option '{option}' in OPTIONS is not supported")
+		if not found:
+			if not options:
+				raise Exception(f"server option '{option}' in OPTIONS requires an argument")
+			value = options.pop(0)
+		if option == "--env":
+			result.setdefault("environment",[]).append(value)
+		elif option == "--volume":
+			source, target = value.split(":",1) if ":" in value else (value,value)
+			target, mode = target.split(":",1) if ":" in target else (target,"rw")
+			result.setdefault("volumes",{})[source] = {"bind":target, "mode":mode}
+		elif option == "--publish":
+			spec = value.split(":")
+			port = spec[-1] if "/" in spec[-1] else f"{spec[-1]}/tcp"
+			result.setdefault("ports",{})[port] = (spec[0],int(spec[1])) if len(spec) == 3 else int(spec[0]) if len(spec) == 2 else None
+		elif option == "--network":
+			result["network"] = value
+		elif option == "--memory":
+			result["mem_limit"] = value
+		elif option == "--cpus":
+			result["nano_cpus"] = int(float(value)*1e9)
+		elif option == "--restart":
+			name, _, count = value.partition(":")
+			result["restart_policy"] = {"Name":name, "MaximumRetryCount":int(count)} if count else {"Name":name}
+		elif option == "--add-host":
+			host, _, address = value.partition(":")
+			result.setdefault("extra_hosts",{})[host] = address
+		elif option == "--user":
+			result["user"] = value
+		elif option == "--workdir":
+			result["working_dir"] = value
+	return result
+
+def get_client():
+	"""Get the docker client"""
+	import docker
+	return docker.from_env()
+
+def get_container(client):
+	"""Get the server container, or None if there is none"""
+	import docker
+	try:
+		return client.containers.get(server_name)
+	except docker.errors.NotFound:
+		return None
+
+def get_reply(port=server_port,timeout=2):
+	"""Get the HTTP status of the server web application, or None if it does not reply"""
+	import urllib.request, urllib.error
+	try:
+		with urllib.request.urlopen(f"http://{server_host}:{port}/",timeout=timeout) as reply:
+			return reply.status
+	except urllib.error.HTTPError as err:
+		return err.code
+	except (urllib.error.URLError,OSError):
+		return None
+
+def status(client=None):
+	"""Get the server status
+
+	Returns:
+		OK if the server is ready, NOREPLY if it does not reply yet, INVALID if
+		another server replies, STOPPED if there is no server, or the HTTP
+		status of an unexpected reply
+	"""
+	if not client:
+		client = get_client()
+	container = get_container(client)
+	reply = get_reply()
+	if not container or container.status != "running":
+		return "INVALID" if reply else "STOPPED"
+	if not reply:
+		return "NOREPLY"
+	return "OK" if reply == 200 else str(reply)
+
+def is_open(port,timeout=1):
+	"""Check whether a port of the server accepts connections"""
+	import socket
+	try:
+		with socket.create_connection((server_host,port),timeout=timeout):
+			return True
+	except OSError:
+		return False
+
+def watch_events(events,state,done):
+	"""Follow the event stream of the server container while it starts"""
+	try:
+		for event in events:
+			action = event.get("Action") or event.get("status") or ""
+			if action == "die":
+				state["error"] = f"server exited with code {event.get('Actor',{}).get('Attributes',{}).get('exitCode','unknown')}"
+				done.set()
+				return
+			if action.startswith("health_status:"):
+				state["health"] = action.split(":",1)[1].strip()
+				if state["health"] == "unhealthy":
+					state["error"] = "server is unhealthy"
+					done.set()
+					return
+				done.set() # wake up the waits to check the health
+	except Exception:
+		pass # the stream is closed when the start is done
+
+def wait_port(port,started,state,done,timeout):
+	"""Wait with exponential backoff until a port of the server is ready
+
+	Returns:
+		seconds after the start at which the port was ready, or None
+	"""
+	delay, limit = server_backoff
+	while not state.get("error") and time.time() - started < timeout:
+		if is_open(port) and ( port != server_port or get_reply(port) == 200 ):
+			return time.time() - started
+		done.wait(delay)
+		if not state.get("error"):
+			done.clear()
+		delay = min(delay*2,limit)
+	return None
+
+def wait_ready(client,container,started,stream,timeout=server_timeout):
+	"""Wait until every server port is ready, or the server fails or times out
+
+	Returns:
+		dict of the seconds at which each port was ready
+	"""
+	import threading
+	from concurrent.futures import ThreadPoolExecutor
+	state = {"health":None, "error":None}
+	done = threading.Event()
+	events = client.events(decode=True,filters={"container":container.id},since=int(started))
+	watcher = threading.Thread(target=watch_events,args=(events,state,done),daemon=True)
+	watcher.start()
+	try:
+		container.reload()
+		if container.status not in ["created","running"]:
+			state["error"] = f"server is {container.status}"
+		with ThreadPoolExecutor(max_workers=len(server_ports)) as pool:
+			ready = dict(zip(server_ports.keys(),pool.map(lambda port: wait_port(port,started,state,done,timeout),server_ports.keys())))
+		health = container.attrs.get("State",{}).get("Health")
+		while health and state["health"] != "healthy" and not state["error"] and time.time() - started < timeout:
+			done.wait(server_backoff[1])
+			done.clear()
+	finally:
+		events.close()
+	if state["error"]:
+		raise Exception(f"startup failed ({state['error']})")
+	missing = [str(port) for port, seconds in ready.items() if seconds is None]
+	if missing:
+		raise Exception(f"startup failed (port{'s' if len(missing) > 1 else ''} {', '.join(missing)} not ready after {timeout} s)")
+	for port, seconds in ready.items():
+		stream["verbose"](f"port {port} ready in {seconds:.1f} s")
+	return ready
+
+def start(client,stream,image=None):
+	"""Start the server and wait until it is ready
+
+	Returns:
+		seconds taken by the server to be ready
+	"""
+	if not image:
+		image = server_image
+	current = status(client)
+	if current != "STOPPED":
+		raise Exception(f"unable to start, server status is {current}")
+	container = get_container(client)
+	if container:
+		container.remove(force=True)
+	stream["verbose"](f"starting {image} as {server_name}")
+	options = get_run_options(server_options)
+	volumes = {
+		"/tmp" : {"bind" : "/tmp", "mode" : "rw"},
+		"/var/run/docker.sock" : {"bind" : "/var/run/docker.sock", "mode" : "rw"},
+		}
+	volumes.update(options.pop("volumes",{}))
+	ports = {f"{port}/tcp":(server_host,host) for host, port in server_ports.items()}
+	ports.update(options.pop("ports",{}))
+	started = time.time()
+	container = client.containers.run(image,name=server_name,detach=True,volumes=volumes,ports=ports,**options)
+	follow_log(container)
+	try:
+		wait_ready(client,container,started,stream)
+	except BaseException:
+		container.reload()
+		if container.status == "running":
+			container.kill()
+		raise
+	elapsed = time.time() - started
+	stream["output"](f"server started in {elapsed:.1f} s")
+	return elapsed
+
+def get_log():
+	"""Get the server log, or `openfido.log` if the server log is not writable"""
+	try:
+		with open(server_log,"a"):
+			return server_log
+	except OSError:
+		return "openfido.log"
+
+def write_log(container,log):
+	"""Append the output of the server container to a log until the container stops"""
+	with open(log,"ab") as fh:
+		for data in container.logs(stream=True,follow=True):
+			fh.write(data)
+			fh.flush()
+
+def follow_log(container):
+	"""Follow the output of the server container in a background process that outlives the command"""
+	subprocess.Popen([sys.executable,os.path.abspath(__file__),"--follow",container.id,os.path.abspath(get_log())],
+		stdin=subprocess.DEVNULL,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL,start_new_session=True)
+
+def stop(client,stream):
+	"""Stop and remove the server container"""
+	container = get_container(client)
+	if not container:
+		stream["warning"]("no server active")
+		return False
+	if container.status == "running":
+		container.kill()
+	container.remove(force=True)
+	stream["verbose"]("server stopped")
+	return True
+
+def run_script(options):
+	"""Run a command of the `openfido-server` script"""
+	result = subprocess.run([get_script()]+options)
+	if result.returncode:
+		raise Exception(f"server {' '.join(options)} failed (exit code {result.returncode})")
+
+def server(options=[], stream=None):
+	"""Syntax: openfido [OPTIONS] server [-r] [-d DIR] [--imagename IMAGE] [--hostname HOST] [--portnum PORT] [--options OPTIONS] [--logfile FILE] [start|stop|restart|status|update|open|backup|restore]
+
+	The `server` function controls the local openfido server running on docker.
+	The `start` command waits until each server port is ready and reports the
+	startup time. The option `-r` restores the database after the server
+	starts, and `-d DIR` sets the folder of the database backups. The options
+	`--hostname`, `--portnum`, `--options` and `--logfile` override the
+	`HOSTNAME`, `PORTNUM`, `OPTIONS` and `LOGFILE` settings of the
+	`openfido-server.conf` script configuration.
+	"""
+	import openfido
+	if not stream:
+		stream = openfido.command_streams
+	restore = False
+	folder = None
+	settings = {}
+	args = []
+	options = list(options)
+	while options:
+		option = options.pop(0)
+		if option == "-r":
+			restore = True
+		elif option in ["-d","--imagename","--hostname","--portnum","--options","--logfile"]:
+			if not options:
+				raise Exception(f"option {option} requires an argument")
+			if option == "-d":
+				folder = options.pop(0)
+			else:
+				settings[option[2:].upper()] = options.pop(0)
+		elif option[0] == '-' and not args:
+			raise Exception(f"server option '{option}' is not valid")
+		else:
+			args.append(option)
+	if not args:
+		raise Exception("missing server command")
+	command = args[0]
+	configure(settings)
+	image = server_image
+	script_options = ["-d",folder] if folder else []
+	if command in ["start","restart","stop","status","update"]:
+		client = get_client()
+	if command == "start":
+		elapsed = start(client,stream,image)
+		if restore:
+			run_script(script_options+["restore"])
+		return elapsed
+	elif command == "stop":
+		stop(client,stream)
+	elif command == "restart":
+		stop(client,stream)
+		return start(client,stream,image)
+	elif command == "status":
+		result = status(client)
+		messages = {"OK":"Server is up", "STOPPED":"Openfido server is down",
+			"NOREPLY":"Openfido server is starting up", "INVALID":"Openfido server is invalid"}
+		stream["output"](messages.get(result,f"Openfido server reply code {result}"))
+		return result
+	elif command == "update":
+		stream["verbose"](f"updating {image}")
+		client.images.pull(image)
+	elif command == "open":
+		import webbrowser
+		url = f"http://{server_host}:{server_port}/"
+		stream["output"](f"Connecting your browser to {url}")
+		stream["output"]("The default login is admin@example.com, password 1234567890")
+		webbrowser.open(url)
+	elif command in ["backup","restore"]:
+		run_script(script_options+args)
+	else:
+		raise Exception(f"'{command}' is not a valid server command")
+
+if __name__ == "__main__":
+	sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+	if sys.argv[1:2] == ["--follow"]:
+		write_log(get_client().containers.get(sys.argv[2]),sys.argv[3])
+		sys.exit(0)
+	try:
+		server(sys.argv[1:])
+	except Exception as err:
+		print(f"ERROR [openfido-server]: {err}",file=sys.stderr)
+		sys.exit(1)
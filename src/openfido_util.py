@@ -1,7 +1,7 @@
 """OpenFIDO utilities
 """
 
-import os, csv, json, pandas, inspect
+import os, io, csv, json, time, pandas, inspect, hashlib, threading, contextlib
 
 def csv_quote(c):
 	"""Special data type for CSV quoting"""
@@ -16,6 +16,70 @@ def csv_quote(c):
 	else:
 		raise Exception(f"'{c}' is not a valid CSV quoting option")
 
+def get_columns(options):
+	"""Get the read options with the column projection as a list"""
+	if type(options.get("columns",None)) is str:
+		return dict(options,columns=[options["columns"]])
+	return options
+
+def read_arrow(file,options):
+	"""Read an Arrow IPC file, optionally memory-mapped and with column projection"""
+	import pyarrow
+	options = get_columns(options)
+	if type(file) is str:
+		source = pyarrow.memory_map(file,"r") if options.get("memory_map",True) else pyarrow.OSFile(file,"rb")
+	else:
+		source = pyarrow.PythonFile(file,mode="r")
+	with source:
+		table = pyarrow.ipc.open_file(source).read_all()
+		if options.get("columns",None):
+			table = table.select(options["columns"])
+		return table.to_pandas(use_threads=options.get("use_threads",True))
+
+def write_arrow(data,file,options):
+	"""Write an Arrow IPC file"""
+	import pyarrow
+	table = pyarrow.Table.from_pandas(data,preserve_index=options.get("index",False))
+	ipc_options = pyarrow.ipc.IpcWriteOptions(compression=options.get("compression",None))
+	with pyarrow.OSFile(file,"wb") if type(file) is str else contextlib.nullcontext(file) as sink:
+		with pyarrow.ipc.new_file(sink,table.schema,options=ipc_options) as writer:
+			writer.write_table(table)
+
+def write_csv_arrow(data,file,options):
+	"""Write a CSV file with the pyarrow writer
+
+	Only the `sep`, `header`, `index`, `quoting` and `na_rep=""` write options are
+	supported. String values are always quoted.
+	"""
+	import pyarrow, pyarrow.csv
+	for name, value in options.items():
+		if name not in ("sep","header","index","quoting","na_rep") or name == "na_rep" and value:
+			raise Exception(f"write option '{name}={value}' is not supported by the pyarrow csv engine")
+	if options.get("index",True):
+		data = data.reset_index()
+	table = pyarrow.Table.from_pandas(data,preserve_index=False)
+	header = options.get("header",True)
+	if type(header) is str:
+		header = [header]
+	if type(header) is list:
+		table = table.rename_columns(header)
+	quoting = {csv.QUOTE_MINIMAL:"needed", csv.QUOTE_ALL:"all_valid", csv.QUOTE_NONE:"none"}
+	if options.get("quoting",csv.QUOTE_MINIMAL) not in quoting.keys():
+		raise Exception(f"write option 'quoting' is not supported by the pyarrow csv engine")
+	write_options = pyarrow.csv.WriteOptions(include_header=bool(header),
+		delimiter=options.get("sep",","),quoting_style=quoting[options.get("quoting",csv.QUOTE_MINIMAL)])
+	if type(file) is str:
+		pyarrow.csv.write_csv(table,file,write_options)
+	else:
+		file.flush()
+		pyarrow.csv.write_csv(table,file.buffer,write_options)
+
+default_chunksize = 100000 # default number of rows per chunk when streaming inputs
+input_cache = os.getenv("OPENFIDO_INPUT_CACHE",None) # input conversion cache folder (None disables the cache)
+input_cache_size = int(os.getenv("OPENFIDO_INPUT_CACHE_SIZE",2**30)) # maximum size of the input cache in bytes
+profile = None # phase timings and files of the run being profiled (None when the run is not profiled)
+profile_lock = threading.Lock() # serializes the profile updates of concurrent reads
+
 #
 # This defines all the I/O formats supported by OpenFIDO using dataframe
 #
@@ -26,7 +90,7 @@ format_options = {
 		"read" : { # read options data types
 			"sep" : [str],
 			"delimiter" : [str],
-			"header" : [list,str,bool],
+			"header" : [int,list,str,bool],
 			"names" : [list],
 			"index_col" : [None,int,bool,str],
 			"usecols" : [list],
@@ -87,6 +151,21 @@ format_options = {
 		"call" : { # read/write callables
 			"read" : lambda file,options: pandas.read_csv(file,**options),
 			"write" : lambda data,file,options: data.to_csv(file,**options),
+			"chunks" : lambda file,options,chunksize: pandas.read_csv(file,chunksize=chunksize,**options),
+			"append" : lambda data,fh,options,first: data.to_csv(fh,**dict(options,header=options.get("header",True) if first else False)),
+		},
+		"engines" : { # calls replaced by each engine
+			"c" : { # pandas C parser
+			},
+			"python" : { # pandas python parser
+				"read" : lambda file,options: pandas.read_csv(file,**dict(options,engine="python")),
+				"chunks" : lambda file,options,chunksize: pandas.read_csv(file,chunksize=chunksize,**dict(options,engine="python")),
+			},
+			"pyarrow" : { # pyarrow multithreaded reader and writer (chunks are read with the C parser)
+				"read" : lambda file,options: pandas.read_csv(file,**dict(options,engine="pyarrow")),
+				"write" : lambda data,file,options: write_csv_arrow(data,file,options),
+				"append" : lambda data,fh,options,first: write_csv_arrow(data,fh,dict(options,header=options.get("header",True) if first else False)),
+			},
 		},
 		"default" : { # default options for read and write calls
 			"read" : {
@@ -127,6 +206,8 @@ format_options = {
 		"call" : { # read/write calls
 			"read" : lambda file,options: pandas.read_json(file,**options),
 			"write" : lambda data,file,options: data.to_json(file,**options),
+			"chunks" : lambda file,options,chunksize: pandas.read_json(file,chunksize=chunksize,**dict(options,lines=True,orient="records")),
+			"append" : lambda data,fh,options,first: fh.write(data.to_json(**dict(options,lines=True,orient="records",indent=None)).rstrip("\n")+"\n") if len(data) else None,
 		},
 		"default" : { # read/read default options
 			"read" : {
@@ -136,9 +217,322 @@ format_options = {
 				"date_unit" : "s",
 			},
 		},
-	}
+	},
+	"parquet" : { # Parquet file type information (requires pyarrow or fastparquet)
+		"binary" : True, # file type is not text
+		"read" : { # read options data types
+			"engine" : [str],
+			"columns" : [list,str],
+			"use_threads" : [bool],
+			"memory_map" : [bool],
+			"dtype_backend" : [str],
+		},
+		"write" : { # write options data types
+			"engine" : [str],
+			"compression" : [None,str],
+			"index" : [None,bool],
+			"partition_cols" : [list,str],
+			"row_group_size" : [int],
+		},
+		"call" : { # read/write calls
+			"read" : lambda file,options: pandas.read_parquet(file,**get_columns(options)),
+			"write" : lambda data,file,options: data.to_parquet(file,**options),
+		},
+		"engines" : { # calls replaced by each engine
+			"pyarrow" : {
+				"read" : lambda file,options: pandas.read_parquet(file,**dict(get_columns(options),engine="pyarrow")),
+				"write" : lambda data,file,options: data.to_parquet(file,**dict(options,engine="pyarrow")),
+			},
+			"fastparquet" : {
+				"read" : lambda file,options: pandas.read_parquet(file,**dict(get_columns(options),engine="fastparquet")),
+				"write" : lambda data,file,options: data.to_parquet(file,**dict(options,engine="fastparquet")),
+			},
+		},
+		"default" : { # read/write default options
+			"read" : {
+			},
+			"write" : {
+				"index" : False,
+			},
+		},
+	},
+	"feather" : { # Feather file type information (requires pyarrow)
+		"binary" : True, # file type is not text
+		"read" : { # read options data types
+			"columns" : [list,str],
+			"use_threads" : [bool],
+			"dtype_backend" : [str],
+		},
+		"write" : { # write options data types
+			"compression" : [None,str],
+			"compression_level" : [int],
+			"chunksize" : [int],
+			"version" : [int],
+		},
+		"call" : { # read/write calls
+			"read" : lambda file,options: pandas.read_feather(file,**get_columns(options)),
+			"write" : lambda data,file,options: data.reset_index(drop=True).to_feather(file,**options),
+		},
+		"default" : { # read/write default options
+			"read" : {
+			},
+			"write" : {
+			},
+		},
+	},
+	"arrow" : { # Arrow IPC file type information (requires pyarrow)
+		"binary" : True, # file type is not text
+		"read" : { # read options data types
+			"columns" : [list,str],
+			"memory_map" : [bool],
+			"use_threads" : [bool],
+		},
+		"write" : { # write options data types
+			"compression" : [None,str],
+			"index" : [bool],
+		},
+		"call" : { # read/write calls
+			"read" : lambda file,options: read_arrow(file,options),
+			"write" : lambda data,file,options: write_arrow(data,file,options),
+		},
+		"default" : { # read/write default options
+			"read" : {
+			},
+			"write" : {
+			},
+		},
+	},
 }
 
+pandas_version = tuple(int(n) for n in pandas.__version__.split(".")[:2] if n.isdigit()) # installed pandas version
+if pandas_version < (1,4): # the pyarrow CSV reader requires pandas 1.4 (the pyarrow writer does not)
+	del format_options["csv"]["engines"]["pyarrow"]["read"]
+if pandas_version < (2,0): # dtype backends require pandas 2.0
+	for spec in format_options.values():
+		if type(spec) is dict and type(spec.get("read",None)) is dict:
+			spec["read"].pop("dtype_backend",None)
+
+#
+# This defines the compression codecs supported for all I/O formats
+#
+compression_threads = 0 # number of threads used by compression codecs (0 uses all CPUs)
+
+compression_options = {
+	"gz" : { # gzip, multi-threaded with pigz when available
+		"read" : ["pigz","-dc","-p{threads}"],
+		"write" : ["pigz","-c","-p{threads}"],
+		"open" : lambda file,mode: __import__("gzip").open(file,mode),
+	},
+	"bz2" : { # bzip2, multi-threaded with pbzip2 when available
+		"read" : ["pbzip2","-dc","-p{threads}"],
+		"write" : ["pbzip2","-c","-p{threads}"],
+		"open" : lambda file,mode: __import__("bz2").open(file,mode),
+	},
+	"xz" : { # xz, multi-threaded with xz when available
+		"read" : ["xz","-dc","-T{threads}"],
+		"write" : ["xz","-c","-T{threads}"],
+		"open" : lambda file,mode: __import__("lzma").open(file,mode),
+	},
+	"zst" : { # zstandard, multi-threaded with zstd or the zstandard module
+		"read" : ["zstd","-dcq","-T{threads}"],
+		"write" : ["zstd","-cq","-T{threads}"],
+		"open" : lambda file,mode: open_zstandard(file,mode),
+	},
+	"lz4" : { # lz4 frames with lz4 or the lz4 module
+		"read" : ["lz4","-dcq"],
+		"write" : ["lz4","-cq"],
+		"open" : lambda file,mode: __import__("lz4.frame").frame.open(file,mode),
+	},
+}
+
+def open_zstandard(file,mode):
+	"""Open a zstandard file with the zstandard module, compressing with all CPUs"""
+	import zstandard
+	if mode[0] == "r":
+		return zstandard.open(file,"rb")
+	return zstandard.open(file,"wb",cctx=zstandard.ZstdCompressor(threads=compression_threads or -1))
+
+@contextlib.contextmanager
+def open_compressed(file,codec,mode):
+	"""Open a compressed file as a binary stream through a codec
+
+	The codec's command is used when it is installed, so compression and
+	decompression run in a separate process with multiple threads where the
+	codec supports it. Otherwise the codec's python module is used. In both
+	cases the data is streamed, not inflated into memory.
+
+	Parameters:
+		file (str)    Compressed file name
+		codec (str)   Compression extension, e.g., "gz"
+		mode (str)    "r" or "w"
+	"""
+	import shutil, subprocess
+	spec = compression_options[codec]
+	threads = str(compression_threads or os.cpu_count())
+	command = [arg.format(threads=threads) for arg in spec["read" if mode == "r" else "write"]]
+	if not shutil.which(command[0]):
+		try:
+			fh = spec["open"](file,mode+"b")
+		except ImportError as err:
+			raise Exception(f"'{codec}' compression requires the '{command[0]}' command or the '{err.name}' module")
+		with fh:
+			yield fh
+	elif mode == "r":
+		with open(file,"rb") as source:
+			process = subprocess.Popen(command,stdin=source,stdout=subprocess.PIPE)
+		try:
+			yield process.stdout
+			complete = not process.stdout.read(1)
+		finally:
+			process.stdout.close()
+			code = process.wait()
+		if complete and code:
+			raise Exception(f"unable to decompress '{file}' ({command[0]} exit code {code})")
+	else:
+		with open(file,"wb") as target:
+			process = subprocess.Popen(command,stdin=subprocess.PIPE,stdout=target)
+		try:
+			yield process.stdin
+		finally:
+			process.stdin.close()
+			code = process.wait()
+		if code:
+			raise Exception(f"unable to compress '{file}' ({command[0]} exit code {code})")
+
+@contextlib.contextmanager
+def open_format(file,ftype,codec,mode):
+	"""Open a compressed file as a stream suitable for the file format"""
+	with open_compressed(file,codec,mode) as fh:
+		if format_options[ftype].get("binary",False):
+			if mode == "r":
+				import shutil, tempfile
+				with tempfile.TemporaryFile() as data: # binary formats need random access
+					shutil.copyfileobj(fh,data,2**20)
+					data.seek(0)
+					yield data
+			else:
+				yield fh
+		else:
+			stream = io.TextIOWrapper(fh,encoding="utf-8",newline="")
+			try:
+				yield stream
+			finally:
+				if mode == "w":
+					stream.flush()
+				stream.detach()
+
+default_engine = os.getenv("OPENFIDO_ENGINE","") # site default engines, e.g., "pyarrow" or "csv:pyarrow,parquet:fastparquet"
+format_plugins = {} # entry points of installed format and engine plugins by group
+
+def get_plugin(group,name):
+	"""Load a format or engine plugin registered by an installed package
+
+	Formats are registered in the `openfido.formats` entry point group under the
+	file extension, and engines in the `openfido.engines` group under the name
+	`FORMAT:ENGINE`. The entry point refers to the format spec or engine call dict
+	(see `format_options`), or to a function that returns it. Entry points are only
+	listed on the first lookup that misses and only the plugin used is imported.
+
+	Returns:
+		the format spec or engine call dict, or None if there is no such plugin
+	"""
+	if group not in format_plugins.keys():
+		from importlib.metadata import entry_points
+		found = entry_points()
+		found = found.select(group=group) if hasattr(found,"select") else found.get(group,[]) # python 3.9 has no select
+		format_plugins[group] = {item.name:item for item in found}
+	if name not in format_plugins[group].keys():
+		return None
+	spec = format_plugins[group].pop(name).load()
+	return spec() if callable(spec) else spec
+
+def register_format(name,spec):
+	"""Register a file format spec, or another name for a file format"""
+	if type(spec) is dict:
+		for key in ("read","write","call","default"):
+			if key not in spec.keys():
+				raise Exception(f"format '{name}' spec does not define '{key}'")
+	elif not type(spec) is str or type(format_options.get(spec,None)) is not dict:
+		raise Exception(f"format '{name}' spec is not valid")
+	format_options[name] = spec
+
+def register_engine(ftype,name,calls):
+	"""Register an engine that replaces some of the read/write calls of a file format"""
+	if type(format_options.get(ftype,None)) is not dict:
+		raise Exception(f"format '{ftype}' is not registered")
+	format_options[ftype].setdefault("engines",{})[name] = calls
+
+def get_format_type(name):
+	"""Get the file format of a file extension or special file name, or None"""
+	spec = format_options.get(name,None)
+	if spec is None:
+		spec = get_plugin("openfido.formats",name)
+		if spec is None:
+			return None
+		register_format(name,spec)
+	return spec if type(spec) is str else name
+
+def get_format(file):
+	"""Get the file format and compression codec from the file extensions
+
+	Returns:
+		format name (or None if not supported) and compression codec (or None)
+	"""
+	if type(format_options.get(file,None)) is str:
+		return format_options[file], None
+	codec = None
+	base, dot, ext = file.rpartition(".")
+	if dot and ext in compression_options.keys():
+		file, codec = base, ext
+		base, dot, ext = file.rpartition(".")
+	ftype = get_format_type(ext) if dot and "/" not in ext else None
+	if not ftype:
+		return None, None
+	return ftype, codec
+
+def get_engine(ftype,options):
+	"""Get the engine selected for a file format
+
+	Engines are selected with `--engine=NAME` for all the formats that have such
+	an engine, or with `--engine=FORMAT:NAME` for one format. Several engines may
+	be given separated by commas, and an engine given for one format takes
+	precedence. The `OPENFIDO_ENGINE` environment variable sets the site default
+	using the same syntax.
+
+	Returns:
+		engine name, or None if the format's default calls are used
+	"""
+	engines = format_options[ftype].get("engines",{})
+	def select(options):
+		result = None
+		for option in options:
+			if not option.startswith("--engine="):
+				continue
+			for item in option.split("=",1)[1].split(","):
+				fmt, colon, name = item.rpartition(":")
+				if not name or colon and fmt != ftype:
+					continue
+				if name not in engines.keys():
+					calls = get_plugin("openfido.engines",f"{ftype}:{name}")
+					if calls is not None:
+						register_engine(ftype,name,calls)
+					elif colon:
+						raise Exception(f"format '{ftype}' does not have engine '{name}'")
+					elif not any(type(spec) is dict and name in spec.get("engines",{}).keys() for spec in format_options.values()):
+						raise Exception(f"engine '{name}' is not valid")
+					else:
+						continue
+				if colon or not result or not result[1]:
+					result = (name,colon)
+		return result[0] if result else None
+	return select(options) or select([f"--engine={default_engine}"])
+
+def get_calls(ftype,engine=None):
+	"""Get the read/write calls of a file format using an engine"""
+	if not engine:
+		return format_options[ftype]["call"]
+	return dict(format_options[ftype]["call"],**format_options[ftype]["engines"][engine])
+
 def get_help(function):
 	"""Obtain the help text for an OpenFIDO function"""
 	import importlib.util as lib
@@ -194,78 +588,429 @@ def has_extension(file,ext):
 	return file[-1-len(ext):] == "."+ext
 
 def read_input(file,options):
-	"""Read the input file using the file format's read options"""
+	"""Read the input file using the file format's read options
+
+	The parser is selected with `--engine=[FORMAT:]NAME`, see `get_engine()`. Text
+	inputs are read through the input conversion cache when it is enabled, see
+	`read_cached_input()`.
+	"""
+	if not file:
+		raise Exception("missing input")
+	ftype, codec = get_format(file)
+	if not ftype:
+		raise Exception(f"{file} is not in a supported input format")
+	cachedir = get_input_cache(options)
+	readonly = "--input-cache-readonly" in options
+	engine = get_engine(ftype,options)
+	call = get_calls(ftype,engine)["read"]
+	options = get_read_options(ftype,options)
+	def read():
+		if codec:
+			with open_format(file,ftype,codec,"r") as fh:
+				return call(fh,options)
+		return call(file,options)
+	with profile_phase("read",file) as item:
+		if cachedir and not format_options[ftype].get("binary",False) and os.path.isfile(file):
+			data = read_cached_input(file,[ftype,codec,engine,options],read,cachedir,readonly)
+		else:
+			data = read()
+		item.update(get_shape(data))
+	return data
+
+def get_read_workers(options,default=None):
+	"""Get the number of concurrent reads requested with the `--read-workers=N` option"""
+	for option in options:
+		if option.startswith("--read-workers="):
+			try:
+				workers = int(option.split("=",1)[1])
+			except:
+				raise Exception(f"'{option}' is not valid")
+			if workers <= 0:
+				raise Exception(f"'{option}' is not valid")
+			return workers
+	return default
+
+def read_inputs(files,options,overrides={},workers=None):
+	"""Read several input files concurrently
+
+	The files are read on a thread pool, which is effective because the parsers
+	and codecs release the GIL while they work. If any read fails, the error of
+	the first file that failed is raised.
+
+	Parameters:
+		files (list)       Input file names
+		options (list)     Read options used for all files
+		overrides (dict)   Read options added for some files, by file name
+		workers (int)      Maximum number of concurrent reads (default is
+		                   `--read-workers=N` or 4 more than the number of CPUs)
+
+	Returns:
+		list of dataframes, in the order of `files`
+	"""
+	from concurrent.futures import ThreadPoolExecutor
+	if not workers:
+		workers = get_read_workers(options,min(32,os.cpu_count()+4))
+	def read(file):
+		return read_input(file,list(options)+list(overrides.get(file,[])))
+	if len(files) < 2 or workers == 1:
+		return [read(file) for file in files]
+	with ThreadPoolExecutor(max_workers=min(workers,len(files))) as pool:
+		return list(pool.map(read,files))
+
+def get_input_cache(options):
+	"""Get the input cache folder, or None if the input cache is disabled
+
+	The cache folder is `input_cache` (or `OPENFIDO_INPUT_CACHE`) unless the option
+	`--input-cache=FOLDER` is given. The option `--no-input-cache` disables it.
+	"""
+	if "--no-input-cache" in options:
+		return None
+	for option in options:
+		if option.startswith("--input-cache="):
+			return option.split("=",1)[1]
+	return input_cache
+
+def read_cached_input(file,key,read,cachedir,readonly=False):
+	"""Read an input file through the input conversion cache
+
+	The first read parses the file and stores the result as an uncompressed
+	Arrow IPC sidecar named by a hash of the file path, size, modification time
+	and `key` (i.e., the read options). Later reads memory-map the sidecar instead
+	of parsing the file. With `readonly` the columns are not copied out of the
+	mapping, so the dataframe cannot be modified in place. The least recently
+	used sidecars are removed when the cache exceeds `input_cache_size`. The
+	cache is bypassed when pyarrow is not available or the data cannot be stored.
+	"""
+	try:
+		import pyarrow
+	except ImportError:
+		return read()
+	stat = os.stat(file)
+	digest = hashlib.sha256(repr([os.path.abspath(file),stat.st_size,stat.st_mtime_ns,key]).encode()).hexdigest()
+	sidecar = os.path.join(cachedir,f"{digest}.arrow")
+	if os.path.exists(sidecar):
+		try:
+			os.utime(sidecar)
+			table = pyarrow.ipc.open_file(pyarrow.memory_map(sidecar,"r")).read_all()
+			data = table.to_pandas(split_blocks=readonly)
+			data.columns = json.loads(table.schema.metadata[b"openfido_columns"])
+			return data
+		except Exception:
+			pass # an unreadable sidecar is replaced
+	data = read()
+	if all(type(name) in (int,str) for name in data.columns):
+		import tempfile
+		tmpfile = None
+		try:
+			os.makedirs(cachedir,exist_ok=True)
+			table = pyarrow.Table.from_pandas(data,preserve_index=None)
+			table = table.replace_schema_metadata(dict(table.schema.metadata or {},
+				openfido_columns=json.dumps([name if type(name) is str else int(name) for name in data.columns])))
+			fd, tmpfile = tempfile.mkstemp(dir=cachedir,prefix=f"{digest}.",suffix=".tmp")
+			os.close(fd)
+			with pyarrow.OSFile(tmpfile,"wb") as sink:
+				with pyarrow.ipc.new_file(sink,table.schema) as writer:
+					writer.write_table(table)
+			os.replace(tmpfile,sidecar)
+			tmpfile = None
+			evict_input_cache(cachedir)
+		except Exception:
+			pass # data that arrow cannot store is not cached
+		finally:
+			if tmpfile:
+				with contextlib.suppress(OSError):
+					os.remove(tmpfile)
+	return data
+
+def evict_input_cache(cachedir,size=None):
+	"""Remove the least recently used sidecars until the input cache fits in `size` bytes"""
+	if size is None:
+		size = input_cache_size
+	files = []
+	for item in os.scandir(cachedir):
+		if item.is_file() and item.name.endswith(".arrow"):
+			stat = item.stat()
+			files.append((stat.st_mtime,stat.st_size,item.path))
+	total = sum(item[1] for item in files)
+	for mtime, filesize, path in sorted(files):
+		if total <= size:
+			break
+		try:
+			os.remove(path)
+			total -= filesize
+		except FileNotFoundError:
+			pass
+
+def get_chunksize(options,default=None):
+	"""Get the chunk size requested with the `--chunksize=N` option"""
+	for option in options:
+		if option.startswith("--chunksize="):
+			try:
+				chunksize = int(option.split("=",1)[1])
+			except:
+				raise Exception(f"'{option}' is not valid")
+			if chunksize <= 0:
+				raise Exception(f"'{option}' is not valid")
+			return chunksize
+	return default
+
+def read_input_chunks(file,options,chunksize=None):
+	"""Read the input file in chunks using the file format's read options
+
+	CSV files are read `chunksize` rows at a time. JSON files must have one record
+	per line. Only one chunk is in memory at a time.
+
+	Parameters:
+		file (str)        Input file name
+		options (list)    Read options
+		chunksize (int)   Number of rows per chunk (default is `--chunksize=N` or 100000)
+
+	Returns:
+		iterator of dataframes
+	"""
 	if not file:
 		raise Exception("missing input")
-	for ftype in format_options.keys():
-		if file == ftype or has_extension(file,ftype):
-			if file == ftype: ftype = format_options[file]
-			options = get_read_options(ftype,options)
-			return format_options[ftype]["call"]["read"](file,options)
-	raise Exception(f"{file} is not in a supported input format")
+	if not chunksize:
+		chunksize = get_chunksize(options,default_chunksize)
+	ftype, codec = get_format(file)
+	if not ftype:
+		raise Exception(f"{file} is not in a supported input format")
+	calls = get_calls(ftype,get_engine(ftype,options))
+	if not "chunks" in calls.keys():
+		raise Exception(f"{file} format does not support reading in chunks")
+	options = get_read_options(ftype,options)
+	if codec:
+		def read_chunks():
+			with open_format(file,ftype,codec,"r") as fh:
+				yield from calls["chunks"](fh,options,chunksize)
+		chunks = read_chunks()
+	else:
+		chunks = calls["chunks"](file,options,chunksize)
+	return profile_chunks(chunks,file) if profile is not None else chunks
+
+def write_output_chunks(chunks,file,options):
+	"""Write chunks to the output file as they are produced
+
+	The output file is opened once and each chunk is appended to it, so the output
+	may be `/dev/stdout`. CSV headers are only written for the first chunk. JSON
+	output is written one record per line.
+
+	Returns:
+		number of rows written
+	"""
+	if not file:
+		raise Exception("missing output")
+	ftype, codec = get_format(file)
+	if not ftype:
+		raise Exception(f"{file} is not in a supported input format")
+	calls = get_calls(ftype,get_engine(ftype,options))
+	if not "append" in calls.keys():
+		raise Exception(f"{file} format does not support writing in chunks")
+	options = get_write_options(ftype,options)
+	rows = 0
+	first = True
+	item = {"phase":"write", "file":file, "seconds":0.0}
+	with open_format(file,ftype,codec,"w") if codec else open(file,"w") as fh:
+		for chunk in chunks:
+			with profile_phase("write") as step:
+				calls["append"](chunk,fh,options,first)
+			first = False
+			item["seconds"] += step.get("seconds",0.0)
+			item.update(get_shape(chunk))
+			rows += len(chunk)
+	item["rows"] = rows
+	add_profile_file(item)
+	return rows
 
 def write_output(data,file,options):
 	"""Write the output file using the file format's write options"""
 	if not file:
 		raise Exception("missing output")
-	for ftype in format_options.keys():
-		if file == ftype or has_extension(file,ftype):
-			if file == ftype: ftype = format_options[file]
-			options = get_write_options(ftype,options)
-			format_options[ftype]["call"]["write"](data,file,options)
-			return None
-	raise Exception(f"{file} is not in a supported input format")
+	ftype, codec = get_format(file)
+	if not ftype:
+		raise Exception(f"{file} is not in a supported input format")
+	call = get_calls(ftype,get_engine(ftype,options))["write"]
+	options = get_write_options(ftype,options)
+	with profile_phase("write",file) as item:
+		if codec:
+			with open_format(file,ftype,codec,"w") as fh:
+				call(data,fh,options)
+		else:
+			call(data,file,options)
+		item.update(get_shape(data))
+	return None
+
+def get_shape(data):
+	"""Get the number of rows and columns of a dataframe or series"""
+	shape = getattr(data,"shape",None)
+	if not shape:
+		return {}
+	return {"rows":shape[0], "columns":shape[1] if len(shape) > 1 else 1}
+
+@contextlib.contextmanager
+def profile_phase(phase,file=None):
+	"""Count the wall and CPU time of a phase of the run being profiled
+
+	The time of overlapping calls of the same phase, e.g., concurrent reads, is
+	only counted once. When a `file` is given, its size and the time spent on it
+	are added to the profiled files with the rows and columns the caller adds
+	to the yielded dict.
+	"""
+	if profile is None:
+		yield {}
+		return
+	item = {"phase":phase, "file":file}
+	with profile_lock:
+		state = profile["phases"].setdefault(phase,{"wall_seconds":0.0, "cpu_seconds":0.0, "calls":0, "active":0})
+		if not state["active"]:
+			state["started"] = (time.perf_counter(),time.process_time())
+		state["active"] += 1
+		state["calls"] += 1
+	started = time.perf_counter()
+	try:
+		yield item
+	finally:
+		item["seconds"] = time.perf_counter() - started
+		with profile_lock:
+			state["active"] -= 1
+			if not state["active"]:
+				wall, cpu = state.pop("started")
+				state["wall_seconds"] += time.perf_counter() - wall
+				state["cpu_seconds"] += time.process_time() - cpu
+		if file is not None:
+			add_profile_file(item)
+
+def add_profile_file(item):
+	"""Add an input or output file and its size to the run being profiled"""
+	if profile is None:
+		return
+	if type(item["file"]) is str and os.path.isfile(item["file"]):
+		item["bytes"] = os.path.getsize(item["file"])
+	with profile_lock:
+		profile["files"].append(item)
+
+def profile_chunks(chunks,file):
+	"""Count the time spent reading each chunk of an input of the run being profiled"""
+	item = {"phase":"read", "file":file, "seconds":0.0}
+	rows = 0
+	chunks = iter(chunks)
+	while True:
+		with profile_phase("read") as step:
+			chunk = next(chunks,None)
+		item["seconds"] += step["seconds"]
+		if chunk is None:
+			break
+		item.update(get_shape(chunk))
+		rows += len(chunk)
+		yield chunk
+	item["rows"] = rows
+	add_profile_file(item)
 
-def hold(df,order=0,axis=0,inplace=True):
+def hold(df,order=0,axis=0,inplace=True,limit=None):
 	"""Perform hold on dataframe
 
 	Parameters:
 		df (dataframe)   Data on which to perform hold
 		order (int)      Order of hold (default 0)
 		axis (int)       Axis over which to hold (default 0=rows, 1=columns)
+		inplace (bool)   Modify the dataframe instead of a copy (default True)
+		limit (int)      Maximum number of consecutive values filled in a gap (default None)
 
 	A hold fills is missing values based on previous values.  A zero-order hold
 	simply copies the previous value. A first-order hold extrapolates from the
-	slope of the previous two values.
+	slope of the previous two values. A hold of order N extrapolates the
+	polynomial through the previous N+1 values.
 
 	The axis determines which was the series are applied.  Axis 0 means the series
 	are taken in row-wise, meaning the each column is an independent series.  Axis 1
 	means the series are taken column-wise, meaning that each row is an independent
 	series.
 
+	When a limit is given, values past the first `limit` values of a gap remain null.
+
 	Note that hold cannot be applied in cases where needed initial values are null.
 	"""
 
 	# make a copy if not inplace
 	if not inplace:
 		df = df.copy(deep=True)
+	if type(order) is not int or order < 0:
+		raise Exception(f"order={order} is not valid")
+
+	# only the series containing nulls are held
+	if axis == 0:
+		series = df.columns[df.isnull().any(axis=0)]
+		if len(series) == 0:
+			return df
+		values = df[series].to_numpy(dtype=float,copy=True)
+		hold_array(values,order,limit,series)
+		df[series] = values
+	elif axis == 1:
+		series = df.index[df.isnull().any(axis=1)]
+		if len(series) == 0:
+			return df
+		values = df.loc[series].to_numpy(dtype=float,copy=True)
+		hold_array(values.T,order,limit,series)
+		df.loc[series] = values
+	else:
+		raise Exception(f"axis={axis} is not valid")
+	return df
 
-	# use transpose to handle column-wise series
-	if axis==1: 
-		return hold(df.transpose(),order=order,axis=0).transpose()
+def hold_array(values,order=0,limit=None,names=None):
+	"""Perform hold in place on the columns of a 2D float array
 
-	# iterate over series containing nulls
-	for col in df.columns[df.isnull().any()]:
-		d = df[col]
+	Each gap is filled with the polynomial of degree `order` through the `order`+1
+	values that precede it, which is the same as repeating the hold one value at a
+	time. A gap that follows fewer than `order`+1 values since the previous gap is
+	filled after the previous gap, so the whole array is held in a few passes.
+	"""
+	import numpy as np
+	nulls = np.isnan(values)
+	rows = np.arange(values.shape[0]).reshape(-1,1)
 
-		# refuse to apply hold if initial value(s) are null
-		if np.isnan(d.iloc[0:order].any()):
-			raise Exception(f"unable to hold on series '{col}' with initial NaN value")
+	# refuse to apply hold if initial value(s) are null
+	initial = nulls[:order+1].any(axis=0)
+	if initial.any():
+		name = names[initial.argmax()] if names is not None else initial.argmax()
+		raise Exception(f"unable to hold on series '{name}' with initial NaN value")
 
-		# find index of null values
-		index = d.index[d.apply(np.isnan)]
+	# find the last non-null value before each null and the offset from it
+	last = np.maximum.accumulate(np.where(nulls,0,rows),axis=0)
+	row, col = np.nonzero(nulls)
+	anchor = last[row,col]
+	offset = row - anchor
+	if limit is not None:
+		keep = offset <= limit
+		row, col, anchor, offset = row[keep], col[keep], anchor[keep], offset[keep]
+
+	# zero-order hold copies the previous non-null value
+	if order == 0:
+		values[row,col] = values[anchor,col]
+		return values
+
+	# extrapolate using the Lagrange weights of the previous values at the offset
+	weights = []
+	for j in range(order+1):
+		weight = np.ones(len(offset))
+		for m in range(order+1):
+			if m != j:
+				weight *= (offset+m)/(m-j)
+		weights.append(weight)
+	pending = np.ones(len(row),dtype=bool)
+	while pending.any():
+		ready = pending.copy()
+		for j in range(1,order+1):
+			ready &= ~np.isnan(values[anchor-j,col])
+		if not ready.any():
+			break # remaining gaps follow values that were not filled because of the limit
+		index = np.nonzero(ready)[0]
+		result = np.zeros(len(index))
+		for j, weight in enumerate(weights):
+			result += weight[index] * values[anchor[index]-j,col[index]]
+		values[row[index],col[index]] = result
+		pending[index] = False
+	return values
 
-		# iterate over null values copying previous values
-		if order == 0:
-			for i in index:
-				d.iloc[index] = d.iloc[i-1]
-		elif order == 1:
-			for i in index:
-				d.iloc[index] = 2.0*d.iloc[i-1] - d.iloc[i-2]
-		else:
-			raise Exception("order={order} is not valid")
-	return df
-	
 def get_option(name,value,types):
 	"""CSV and JSON option handler
 
@@ -279,7 +1024,7 @@ def get_option(name,value,types):
 			return value
 		if jot in (int,float):
 			try:
-				return value
+				return jot(value)
 			except:
 				pass
 		if jot is bool:
@@ -289,7 +1034,7 @@ def get_option(name,value,types):
 				return False
 			else:
 				raise Exception(f"'{name}={value}' is not valid")
-		if jot is None and value.lower in ("none","null","nul"):
+		if jot is None and value.lower() in ("none","null","nul"):
 			return None
 		if jot is list and value.find(',') >= 0:
 			try:
@@ -315,7 +1060,7 @@ def get_option(name,value,types):
 
 def get_read_options(ftype,options):
 	"""Get the file type's read options"""
-	result = format_options[ftype]["default"]["read"]
+	result = dict(format_options[ftype]["default"]["read"])
 	for option in options:
 		tag = f"--{ftype}-read-"
 		if option.find(tag) == 0:
@@ -331,7 +1076,7 @@ def get_read_options(ftype,options):
 
 def get_write_options(ftype,options):
 	"""Get the file type's write options"""
-	result = format_options[ftype]["default"]["write"]
+	result = dict(format_options[ftype]["default"]["write"])
 	for option in options:
 		tag = f"--{ftype}-write-"
 		if option.find(tag) == 0:
@@ -0,0 +1,319 @@
+"""OpenFIDO workflows
+
+A workflow chains local pipelines and installed products into a graph of steps.
+Workflows are created from a JSON spec file and stored in the local pipeline
+database. For example:
+
+	{
+		"name" : "study",
+		"description" : "Weather and load study",
+		"steps" : {
+			"weather" : {"pipeline" : "noaa-weather"},
+			"loads" : {"product" : "loadshape", "inputs" : ["input:meters.csv"],
+				"outputs" : ["loads.csv"], "options" : ["--interval=15min"]},
+			"study" : {"pipeline" : "gridlabd-study", "inputs" : ["weather","loads:loads.csv"]}
+		}
+	}
+
+Each step reads the files named in its `inputs`, which are `input` for the
+workflow's input folder or the name of an earlier step for all the files of
+that step, optionally followed by `:FILE` for one file only. Steps without
+`inputs` read the workflow's input folder. A step may also list steps it must
+run `after` without reading their files. Pipeline steps read an input folder and
+product steps read the input files and write the `outputs` files.
+
+Each step writes its files in the folder of the same name in the workflow's
+output folder, where later steps read them. The logs and run record of a
+pipeline step are not passed to later steps. When a pipeline step reads all
+the files of a single folder, that folder is used directly. Otherwise its input
+folder is made of hard links to the files it reads, so intermediate data is
+never copied.
+Steps run as soon as the steps they depend on are done, so independent
+branches run in parallel. The timing of each step is reported and written to
+`workflow.json` in the output folder.
+"""
+
+import os, sys, json, time, contextlib
+
+report_filename = "workflow.json" # workflow run report in the output folder
+staging_inputs = ".inputs" # folder of the linked input folders in the output folder
+step_logs = ["stdout","stderr"] # pipeline output files that are not passed to later steps
+
+def check_workflow(spec):
+	"""Check a workflow spec and get the order in which its steps may run
+
+	Returns:
+		list of step names in topological order
+	"""
+	if type(spec) is not dict or type(spec.get("name",None)) is not str or not spec["name"]:
+		raise Exception("workflow spec does not have a name")
+	steps = spec.get("steps",None)
+	if type(steps) is not dict or not steps:
+		raise Exception(f"workflow '{spec['name']}' does not have any steps")
+	for name, step in steps.items():
+		if name == "input" or ":" in name or "/" in name or name.startswith("."):
+			raise Exception(f"workflow step name '{name}' is not valid")
+		if ( "pipeline" in step.keys() ) == ( "product" in step.keys() ):
+			raise Exception(f"workflow step '{name}' must have either a pipeline or a product")
+		if "product" in step.keys() and not step.get("outputs",None):
+			raise Exception(f"workflow step '{name}' product does not have outputs")
+		for source in get_dependencies(step):
+			if source not in steps.keys():
+				raise Exception(f"workflow step '{name}' refers to unknown step '{source}'")
+	order = []
+	waiting = {name:set(get_dependencies(step)) for name, step in steps.items()}
+	while waiting:
+		ready = sorted(name for name, after in waiting.items() if not after)
+		if not ready:
+			raise Exception(f"workflow '{spec['name']}' steps {sorted(waiting.keys())} depend on each other")
+		for name in ready:
+			del waiting[name]
+			order.append(name)
+		for after in waiting.values():
+			after.difference_update(ready)
+	return order
+
+def get_dependencies(step):
+	"""Get the names of the steps a workflow step depends on"""
+	result = [source.split(":",1)[0] for source in step.get("inputs",[])] + list(step.get("after",[]))
+	return sorted(set(result)-{"input"})
+
+def get_workflow(conn,name):
+	"""Get a local workflow spec"""
+	row = conn.execute("SELECT spec FROM workflows WHERE name=?",[name]).fetchone()
+	if not row:
+		raise Exception(f"workflow '{name}' not found")
+	return json.loads(row["spec"])
+
+def add_workflow(conn,spec,replace=False):
+	"""Add a local workflow spec"""
+	import sqlite3
+	check_workflow(spec)
+	try:
+		conn.execute(f"INSERT {'OR REPLACE ' if replace else ''}INTO workflows (name,description,spec) VALUES (?,?,?)",
+			[spec["name"],spec.get("description",""),json.dumps(spec)])
+	except sqlite3.IntegrityError:
+		raise Exception(f"workflow '{spec['name']}' already exists")
+
+def delete_workflow(conn,name):
+	"""Delete a local workflow spec"""
+	if not conn.execute("DELETE FROM workflows WHERE name=?",[name]).rowcount:
+		raise Exception(f"workflow '{name}' not found")
+
+def get_files(source,inputfolder,outputfolder):
+	"""Get the files of a step input source
+
+	Returns:
+		folder of the source and the list of file paths
+	"""
+	import openfido_pipeline as op
+	name, colon, file = source.partition(":")
+	folder = inputfolder if name == "input" else os.path.join(outputfolder,name)
+	if colon:
+		path = os.path.join(folder,file)
+		if not os.path.exists(path):
+			raise Exception(f"workflow input '{source}' not found")
+		return folder, [path]
+	files = sorted(os.path.join(folder,item) for item in os.listdir(folder)
+		if not ( name != "input" and item in step_logs+[op.run_record] ) and not item.startswith("."))
+	return folder, files
+
+def link_files(files,folder):
+	"""Make a folder of hard links to files, copying only the files that cannot be linked"""
+	import shutil
+	if os.path.exists(folder):
+		shutil.rmtree(folder)
+	os.makedirs(folder)
+	for path in files:
+		target = os.path.join(folder,os.path.basename(path))
+		if os.path.lexists(target):
+			raise Exception(f"workflow input file '{os.path.basename(path)}' is given more than once")
+		if os.path.isdir(path):
+			shutil.copytree(path,target,copy_function=link_file)
+		else:
+			link_file(path,target)
+
+def link_file(source,target):
+	"""Hard link a file, or copy it to another file system"""
+	import shutil
+	try:
+		os.link(source,target)
+	except OSError:
+		shutil.copy2(source,target)
+
+def run_step(name,step,inputfolder,outputfolder,stream,pool=0,cache=True,force=False):
+	"""Run a workflow step"""
+	sources = step.get("inputs",["input"])
+	folder = os.path.join(outputfolder,name)
+	os.makedirs(folder,exist_ok=True)
+	if "pipeline" in step.keys():
+		import openfido_pipeline as op
+		files = [get_files(source,inputfolder,outputfolder) for source in sources]
+		if len(files) == 1 and sorted(os.listdir(files[0][0])) == sorted(os.path.basename(path) for path in files[0][1]):
+			stepinput = files[0][0]
+		else:
+			stepinput = os.path.join(outputfolder,staging_inputs,name)
+			link_files([path for source, paths in files for path in paths],stepinput)
+		with contextlib.closing(op.open_pipelines()) as conn:
+			op.runlocal_recorded(conn,op.get_pipeline(conn,step["pipeline"]),stepinput,folder,stream=stream,pool=pool,cache=cache,force=force)
+	else:
+		import subprocess, openfido
+		files = [path for source in sources for path in get_files(source,inputfolder,outputfolder)[1]]
+		outputs = [os.path.join(folder,file) for file in step["outputs"]]
+		command = [sys.executable,os.path.join(os.path.dirname(openfido.__file__),"openfido"),"run"] \
+			+ ([] if cache else ["--no-cache"]) + (["--force"] if force else []) + [step["product"]] \
+			+ list(step.get("options",[])) + [",".join(files),",".join(outputs)]
+		environ = dict(os.environ,OPENFIDO_INPUT=os.path.abspath(inputfolder),OPENFIDO_OUTPUT=os.path.abspath(folder))
+		with open(os.path.join(folder,"stdout"),"w") as stdout, open(os.path.join(folder,"stderr"),"w") as stderr:
+			result = subprocess.run(command,stdin=subprocess.DEVNULL,stdout=stdout,stderr=stderr,env=environ)
+		if result.returncode:
+			with open(os.path.join(folder,"stderr"),"r") as fh:
+				error = fh.read().strip().split("\n")[-1]
+			err = Exception(f"product '{step['product']}' failed ({error or f'exit code {result.returncode}'})")
+			err.exit_status = result.returncode
+			raise err
+
+def run_workflow(spec,inputfolder,outputfolder,workers=None,stream=None,pool=0,cache=True,force=False):
+	"""Run a workflow with its independent steps in parallel
+
+	A step starts as soon as the steps it depends on are done. When a step
+	fails, the steps that depend on it are skipped and the others continue.
+
+	Returns:
+		dict of the status, start time, elapsed time and error of each step
+	"""
+	import openfido_pipeline as op
+	from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+	order = check_workflow(spec)
+	steps = spec["steps"]
+	if not os.path.isdir(inputfolder):
+		raise Exception(f"input folder '{inputfolder}' not found")
+	os.makedirs(outputfolder,exist_ok=True)
+	if not workers:
+		workers = op.get_run_limit()
+	report = {name:{"status":None, "started":None, "elapsed":None, "error":None} for name in order}
+	waiting = {name:set(get_dependencies(steps[name])) for name in order}
+	def run(name):
+		report[name]["started"] = time.time()
+		run_step(name,steps[name],inputfolder,outputfolder,stream,pool,cache,force)
+		return time.time() - report[name]["started"]
+	start = time.time()
+	with ThreadPoolExecutor(max_workers=max(1,min(workers,len(order)))) as executor:
+		futures = {}
+		while waiting or futures:
+			for name in [name for name in order if name in waiting.keys() and not waiting[name]]:
+				del waiting[name]
+				stream["verbose"](f"step '{name}' started")
+				futures[executor.submit(run,name)] = name
+			if not futures:
+				break
+			completed, pending = wait(futures.keys(),return_when=FIRST_COMPLETED)
+			for future in completed:
+				name = futures.pop(future)
+				try:
+					report[name].update(status=0,elapsed=future.result())
+					stream["output"](f"step '{name}' ok in {report[name]['elapsed']:.1f} s")
+					for after in waiting.values():
+						after.discard(name)
+				except Exception as err:
+					report[name].update(status=getattr(err,"exit_status",1),
+						elapsed=time.time()-report[name]["started"],error=str(err) or type(err).__name__)
+					stream["error"](f"step '{name}' failed: {report[name]['error']}")
+					skipped = {name}
+					for other in order:
+						if other in waiting.keys() and waiting[other] & skipped:
+							del waiting[other]
+							skipped.add(other)
+							report[other]["error"] = f"skipped because step '{name}' failed"
+	elapsed = time.time() - start
+	with open(os.path.join(outputfolder,report_filename),"w") as fh:
+		json.dump({"workflow":spec["name"], "inputfolder":os.path.abspath(inputfolder),
+			"started":start, "elapsed":elapsed, "steps":report},fh,indent=1)
+	failed = [name for name in order if report[name]["status"] != 0]
+	stream["output"](f"{len(order)} steps, {len(order)-len(failed)} ok, {len(failed)} failed or skipped in {elapsed:.1f} s")
+	return report
+
+def workflow(options=[], stream=None):
+	"""Syntax: openfido [OPTIONS] workflow COMMAND [OPTIONS]
+
+	The `workflow` function is used to create and start workflows of pipelines
+	and products.
+
+	COMMAND:
+
+		create [-l|--local] [--replace] SPECFILE
+		start  [-l|--local] [-j|--jobs=N] [--no-pool] [--force|--no-cache] NAME INPUTFOLDER OUTPUTFOLDER
+		delete [-l|--local] NAME
+		list   [-l|--local]
+
+	See the documentation of the `openfido_workflow` module for the spec file
+	format. At most --jobs steps run at the same time (default is the number of
+	CPUs, limited by the available memory). Steps use the run cache as
+	`pipeline start` and `run` do, unless `--force` or `--no-cache` is given.
+	"""
+	import openfido, openfido_pipeline as op
+	if not stream:
+		stream = openfido.command_streams
+	if len(options) < 1:
+		raise Exception("missing workflow command")
+	command = options[0]
+	local = False
+	replace = False
+	workers = None
+	pool = openfido.pipeline_pool
+	cache = True
+	force = False
+	args = []
+	for option in options[1:]:
+		if option[0] == '-':
+			if option in ["-l","--local"]:
+				local = True
+			elif option == "--replace":
+				replace = True
+			elif option.startswith(("-j=","--jobs=")):
+				workers = int(option.split("=",1)[1])
+			elif option == "--no-pool":
+				pool = 0
+			elif option == "--force":
+				force = True
+			elif option == "--no-cache":
+				cache = False
+			else:
+				stream["error"](f"option '{option}' is not valid")
+				return
+		else:
+			args.append(option)
+	if not local:
+		raise Exception(f"remote workflow {command} not implemented yet (args={args})")
+	if command == "create":
+		if len(args) != 1:
+			raise Exception(f"workflow create requires one spec file (args={args})")
+		with open(args[0],"r") as fh:
+			spec = json.load(fh)
+		with contextlib.closing(op.open_pipelines()) as conn:
+			add_workflow(conn,spec,replace)
+	elif command == "start":
+		if len(args) < 3:
+			raise Exception(f"missing one or more workflow start arguments (args={args})")
+		if len(args) > 3:
+			raise Exception(f"too many workflow start arguments (args={args})")
+		with contextlib.closing(op.open_pipelines()) as conn:
+			spec = get_workflow(conn,args[0])
+			for step in spec["steps"].values():
+				if "pipeline" in step.keys():
+					op.get_pipeline(conn,step["pipeline"])
+		report = run_workflow(spec,args[1],args[2],workers,stream,pool,cache,force)
+		if any(step["status"] != 0 for step in report.values()):
+			raise Exception(f"workflow '{args[0]}' failed")
+		return report
+	elif command == "delete":
+		if len(args) != 1:
+			raise Exception(f"workflow delete requires one name (args={args})")
+		with contextlib.closing(op.open_pipelines()) as conn:
+			delete_workflow(conn,args[0])
+	elif command == "list":
+		with contextlib.closing(op.open_pipelines()) as conn:
+			for row in conn.execute("SELECT name, description FROM workflows ORDER BY name"):
+				stream["output"](f"{row['name']:20s} {row['description']}")
+	else:
+		raise Exception(f"invalid workflow command (command='{command}')")
@@ -17,6 +17,12 @@ OUTPUTS
 	TODO
 """
 
+# process is called on the input data, or on each chunk of input when streaming
+def process(data):
+
+	# TODO
+	return data
+
 # main is required for openfido to be able to call this product
 def main(inputs,outputs,options):
 
@@ -29,11 +35,24 @@ def main(inputs,outputs,options):
 	# stage the results
 	result = {}
 
-	# process the input files
-	for file in inputs:
+	# stream each input to its output in chunks when --chunksize=N is given
+	if of.get_chunksize(options):
+
+		# process the input and output files in pairs with bounded peak memory
+		for input_file, output_file in zip(inputs,outputs):
+
+			# read, process, and write one chunk at a time
+			chunks = of.read_input_chunks(input_file,options)
+			result[output_file] = of.write_output_chunks(map(process,chunks),output_file,options)
+
+		# return the number of rows written to each output
+		return result
+
+	# read the input files concurrently (use --read-workers=N to limit concurrency)
+	for data in of.read_inputs(inputs,options):
 
-		# read the input
-		TODO = of.read_input(file,options)
+		# process the input
+		TODO = process(data)
 
 	# process the output files
 	for file in outputs:
@@ -0,0 +1,84 @@
+"""Tests of the openfido batch command failure handling"""
+
+import os, sys, csv, json, tempfile, unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+import openfido
+
+streams = {"output":lambda msg: None, "warning":lambda msg: None, "error":lambda msg: None, "verbose":lambda msg: None}
+
+product = '''
+import sys
+def main(inputs,outputs,options):
+	with open(inputs[0],"r") as fh:
+		data = fh.read().strip()
+	if data == "fail":
+		raise Exception("bad input")
+	if data == "exit":
+		sys.exit(3)
+	with open(outputs[0],"w") as fh:
+		fh.write(data.upper())
+	return {}
+'''
+
+class TestBatch(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.cwd = os.getcwd()
+		os.chdir(self.tmpdir.name)
+		self.saved = {name:getattr(openfido,name) for name in ["cache","run_cache"]}
+		openfido.cache = os.path.join(self.tmpdir.name,"products")
+		openfido.run_cache = ""
+		os.makedirs(os.path.join(openfido.cache,"upper"))
+		with open(os.path.join(openfido.cache,"upper","__init__.py"),"w") as fh:
+			fh.write(product)
+		with open(os.path.join(openfido.cache,"upper","openfido.json"),"w") as fh:
+			fh.write("{}")
+		os.makedirs("in")
+		for name, data in {"a":"one", "b":"fail", "c":"two", "d":"exit"}.items():
+			with open(os.path.join("in",f"{name}.txt"),"w") as fh:
+				fh.write(data)
+		self.errors = []
+		self.streams = dict(streams,error=self.errors.append)
+
+	def tearDown(self):
+		for name, value in self.saved.items():
+			setattr(openfido,name,value)
+		os.chdir(self.cwd)
+		self.tmpdir.cleanup()
+
+	def test_failures(self):
+		result = openfido.batch(["-j=2","--summary=summary.csv","upper","in/*.txt","out/{stem}.txt"],self.streams)
+		self.assertEqual((result["done"],result["failed"]),([0,2],[1,3]))
+		with open(os.path.join("out","c.txt"),"r") as fh:
+			self.assertEqual(fh.read(),"TWO")
+		self.assertFalse(os.path.exists(os.path.join("out","b.txt")))
+		self.assertEqual(sorted(self.errors),["job 1 failed: bad input","job 3 failed: exit 3"])
+		with open("summary.csv","r",newline="") as fh:
+			rows = list(csv.DictReader(fh))
+		self.assertEqual([row["status"] for row in rows],["0","1","0","3"])
+		self.assertEqual(rows[1]["error"],"bad input")
+		self.assertEqual(rows[2]["outputs"],"out/c.txt")
+
+	def test_manifest(self):
+		with open("jobs.jsonl","w") as fh:
+			fh.write(json.dumps({"inputs":["in/a.txt"], "outputs":"a.txt"})+"\n\n")
+			fh.write(json.dumps({"inputs":"in/c.txt", "outputs":["c.txt"]})+"\n")
+		result = openfido.batch(["upper","jobs.jsonl"],self.streams)
+		self.assertEqual((result["ok"],result["errors"]),(2,0))
+
+	def test_required_outputs(self):
+		with open("jobs.csv","w") as fh:
+			fh.write("inputs,outputs\nin/a.txt,a.txt\nin/c.txt,\nin/a.txt,/dev/stdout\n")
+		with self.assertRaisesRegex(Exception,"jobs 1, 2 must have output files"):
+			openfido.batch(["upper","jobs.csv"],self.streams)
+		with self.assertRaisesRegex(Exception,"output template is required"):
+			openfido.batch(["upper","in/*.txt"],self.streams)
+		with self.assertRaisesRegex(Exception,"no batch jobs found"):
+			openfido.batch(["upper","none/*.txt","{stem}.csv"],self.streams)
+		with self.assertRaisesRegex(Exception,"requires a value"):
+			openfido.batch(["-j","upper","in/*.txt","{stem}.csv"],self.streams)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,28 @@
+"""Tests of the openfido_bench hold result check"""
+
+import os, sys, unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+import openfido_bench as ob
+import openfido_util as ou
+
+class TestBench(unittest.TestCase):
+
+	def test_hold(self):
+		data = ob.get_timeseries(1000,nulls=0.05,head=3)
+		for order in [0,1,2]:
+			for axis in [0,1]:
+				df = data if axis == 0 else data.transpose()
+				ob.check_hold(df,ou.hold(df,order=order,axis=axis,inplace=False),order,axis)
+
+	def test_mismatch(self):
+		data = ob.get_timeseries(1000,nulls=0.05)
+		with self.assertRaises(Exception):
+			ob.check_hold(data,ob.hold_reference(data,order=0,inplace=False),0,0)
+
+	def test_bench_hold(self):
+		result = ob.bench_hold([1000],output=lambda msg: None)
+		self.assertEqual(len(result),4)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,142 @@
+"""Tests of the openfido_http cache against a local HTTP server"""
+
+import os, sys, json, tempfile, threading, unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+import openfido_http
+
+class Handler(BaseHTTPRequestHandler):
+	"""Local github stand-in with validators and paginated lists"""
+	etag = '"v1"'
+	content = {"name":"test"}
+	pages = 3
+	requests = []
+
+	def log_message(self,*args):
+		pass
+
+	def reply(self,code,data=None,headers={}):
+		body = json.dumps(data).encode() if data is not None else b""
+		self.send_response(code)
+		self.send_header("Content-Type","application/json")
+		self.send_header("Content-Length",str(len(body)))
+		for key, value in headers.items():
+			self.send_header(key,value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		Handler.requests.append((url.path,dict(self.headers)))
+		if url.path == "/data":
+			if self.headers.get("If-None-Match",None) == Handler.etag:
+				self.reply(304,headers={"ETag":Handler.etag})
+			else:
+				self.reply(200,dict(Handler.content,authorization=self.headers.get("Authorization",None)),{"ETag":Handler.etag})
+		elif url.path == "/list":
+			page = int(parse_qs(url.query).get("page",["1"])[0])
+			headers = {"ETag":f'"page{page}"'}
+			if page < Handler.pages:
+				headers["Link"] = f'<http://{self.headers["Host"]}/list?page={page+1}>; rel="next"'
+			self.reply(200,[page*10+n for n in range(2)],headers)
+		else:
+			self.reply(404,{"message":"Not Found"})
+
+class TestHttp(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.server = ThreadingHTTPServer(("127.0.0.1",0),Handler)
+		cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+		cls.thread = threading.Thread(target=cls.server.serve_forever,daemon=True)
+		cls.thread.start()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.cachedir = os.path.join(self.tmpdir.name,".http")
+		Handler.requests.clear()
+		Handler.etag = '"v1"'
+
+	def tearDown(self):
+		self.tmpdir.cleanup()
+
+	def test_etag_revalidation(self):
+		first = openfido_http.get(f"{self.url}/data",cachedir=self.cachedir)
+		self.assertEqual(first.status_code,200)
+		self.assertFalse(first.from_cache)
+		second = openfido_http.get(f"{self.url}/data",cachedir=self.cachedir)
+		self.assertEqual(second.status_code,200)
+		self.assertTrue(second.from_cache)
+		self.assertEqual(second.json(),first.json())
+		self.assertEqual(Handler.requests[1][1].get("If-None-Match",None),'"v1"')
+
+	def test_etag_changed(self):
+		openfido_http.get(f"{self.url}/data",cachedir=self.cachedir)
+		Handler.etag = '"v2"'
+		response = openfido_http.get(f"{self.url}/data",cachedir=self.cachedir)
+		self.assertFalse(response.from_cache)
+		self.assertEqual(response.headers["ETag"],'"v2"')
+
+	def test_ttl(self):
+		openfido_http.get(f"{self.url}/data",cachedir=self.cachedir,ttl=3600)
+		response = openfido_http.get(f"{self.url}/data",cachedir=self.cachedir,ttl=3600)
+		self.assertTrue(response.from_cache)
+		self.assertEqual(len(Handler.requests),1)
+
+	def test_offline(self):
+		openfido_http.get(f"{self.url}/data",cachedir=self.cachedir)
+		response = openfido_http.get(f"{self.url}/data",cachedir=self.cachedir,offline=True)
+		self.assertTrue(response.from_cache)
+		self.assertEqual(response.json()["name"],"test")
+		self.assertEqual(len(Handler.requests),1)
+		with self.assertRaises(Exception):
+			openfido_http.get(f"{self.url}/other",cachedir=self.cachedir,offline=True)
+		with self.assertRaises(Exception):
+			openfido_http.get(f"{self.url}/data",offline=True)
+
+	def test_authorization(self):
+		token = {"Authorization":"token secret"}
+		openfido_http.get(f"{self.url}/data",headers=token,cachedir=self.cachedir,ttl=3600)
+		response = openfido_http.get(f"{self.url}/data",cachedir=self.cachedir,ttl=3600)
+		self.assertFalse(response.from_cache)
+		self.assertIsNone(response.json()["authorization"])
+		response = openfido_http.get(f"{self.url}/data",headers=token,cachedir=self.cachedir,ttl=3600)
+		self.assertTrue(response.from_cache)
+		self.assertEqual(response.json()["authorization"],"token secret")
+
+	def test_pages(self):
+		result = openfido_http.get_pages(f"{self.url}/list",cachedir=self.cachedir)
+		self.assertEqual(result,[10,11,20,21,30,31])
+		self.assertEqual([path for path, headers in Handler.requests],["/list"]*3)
+		result = openfido_http.get_pages(f"{self.url}/list",cachedir=self.cachedir,offline=True)
+		self.assertEqual(result,[10,11,20,21,30,31])
+		self.assertEqual(len(Handler.requests),3)
+
+	def test_unwritable_cache(self):
+		blocker = os.path.join(self.tmpdir.name,"file")
+		with open(blocker,"w"):
+			pass
+		messages = []
+		stream = {"verbose":messages.append}
+		response = openfido_http.get(f"{self.url}/data",cachedir=os.path.join(blocker,".http"),stream=stream)
+		self.assertEqual(response.status_code,200)
+		self.assertTrue(any("unable to write" in message for message in messages))
+		result = openfido_http.get_pages(f"{self.url}/list",cachedir=os.path.join(blocker,".http"))
+		self.assertEqual(len(result),6)
+
+	def test_get_many(self):
+		responses = openfido_http.get_many([f"{self.url}/data"]*8+[f"{self.url}/missing"],workers=8,cachedir=self.cachedir)
+		self.assertEqual([response.status_code for response in responses],[200]*8+[404])
+		self.assertEqual([item for item in os.listdir(self.cachedir) if not item.endswith(".json")],[])
+		response = openfido_http.get(f"{self.url}/data",cachedir=self.cachedir,offline=True)
+		self.assertEqual(response.json()["name"],"test")
+
+if __name__ == "__main__":
+	unittest.main()
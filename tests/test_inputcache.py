@@ -0,0 +1,107 @@
+"""Tests of the openfido_util input conversion cache"""
+
+import os, sys, glob, time, tempfile, warnings, unittest
+import pandas
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+import openfido_util as ou
+
+class TestInputCache(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.cachedir = self.path("cache")
+		self.file = self.path("data.csv")
+		self.write("x,y\n1,a\n2,b\n")
+		self.reads = 0
+
+	def tearDown(self):
+		self.tmpdir.cleanup()
+
+	def path(self,name):
+		return os.path.join(self.tmpdir.name,name)
+
+	def write(self,text,file=None):
+		with open(file or self.file,"w") as fh:
+			fh.write(text)
+
+	def read(self,key=["csv"],readonly=False,file=None):
+		file = file or self.file
+		def read():
+			self.reads += 1
+			return pandas.read_csv(file)
+		return ou.read_cached_input(file,key,read,self.cachedir,readonly)
+
+	def sidecars(self):
+		return glob.glob(os.path.join(self.cachedir,"*.arrow"))
+
+	def test_hit(self):
+		first = self.read()
+		second = self.read()
+		self.assertEqual(self.reads,1)
+		self.assertTrue(second.equals(first))
+		self.assertEqual(len(self.sidecars()),1)
+		self.assertEqual(glob.glob(os.path.join(self.cachedir,"*.tmp")),[])
+
+	def test_invalidation(self):
+		self.read()
+		self.read(key=["csv","--csv-read-header=None"])
+		self.assertEqual(self.reads,2)
+		self.write("x,y\n1,a\n2,b\n3,c\n")
+		self.assertEqual(len(self.read()),3)
+		stat = os.stat(self.file)
+		os.utime(self.file,ns=(stat.st_atime_ns,stat.st_mtime_ns+10**9))
+		self.read()
+		self.assertEqual(self.reads,4)
+
+	def test_writable(self):
+		self.read()
+		data = self.read()
+		data.loc[0,"x"] = 10
+		self.assertEqual(data.loc[0,"x"],10)
+		self.assertEqual(self.read().loc[0,"x"],1)
+		self.assertEqual(self.reads,1)
+
+	def test_columns(self):
+		def read():
+			self.reads += 1
+			return pandas.DataFrame([[1,2]],columns=[0,"1"])
+		for n in range(2):
+			with warnings.catch_warnings():
+				warnings.simplefilter("ignore") # arrow warns that mixed column names are stored as strings
+				data = ou.read_cached_input(self.file,["csv"],read,self.cachedir)
+			self.assertEqual(list(data.columns),[0,"1"])
+		self.assertEqual(self.reads,1)
+
+	def test_damaged_sidecar(self):
+		self.read()
+		for sidecar in self.sidecars():
+			self.write("damaged",sidecar)
+		self.assertTrue(self.read().equals(pandas.read_csv(self.file)))
+		self.assertEqual(self.reads,2)
+		self.read()
+		self.assertEqual(self.reads,2)
+
+	def test_eviction(self):
+		for name in ["a.csv","b.csv","c.csv"]:
+			self.write("x\n1\n",self.path(name))
+			self.read(file=self.path(name))
+		sidecars = sorted(self.sidecars(),key=os.path.getmtime)
+		self.assertEqual(len(sidecars),3)
+		now = time.time()
+		for n, sidecar in enumerate(sidecars):
+			os.utime(sidecar,(now-10+n,now-10+n))
+		os.utime(sidecars[0],(now,now))
+		ou.evict_input_cache(self.cachedir,os.path.getsize(sidecars[0])*2)
+		self.assertEqual(sorted(self.sidecars()),sorted([sidecars[0],sidecars[2]]))
+
+	def test_read_input(self):
+		options = [f"--input-cache={self.cachedir}"]
+		first = ou.read_input(self.file,options)
+		self.assertEqual(len(self.sidecars()),1)
+		self.assertTrue(ou.read_input(self.file,options).equals(first))
+		ou.read_input(self.file,options+["--no-input-cache"])
+		self.assertEqual(len(self.sidecars()),1)
+
+if __name__ == "__main__":
+	unittest.main()
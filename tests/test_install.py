@@ -0,0 +1,85 @@
+"""Tests of the openfido install requirement merge and conflict handling"""
+
+import os, sys, tempfile, unittest
+from unittest import mock
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+import openfido
+
+streams = {"output":lambda msg: None, "warning":lambda msg: None, "error":lambda msg: None, "verbose":lambda msg: None}
+
+class TestInstall(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.saved = openfido.cache
+		openfido.cache = self.tmpdir.name
+		self.errors = []
+		self.streams = dict(streams,error=self.errors.append)
+
+	def tearDown(self):
+		openfido.cache = self.saved
+		self.tmpdir.cleanup()
+
+	def add_product(self,name,requirements):
+		target = os.path.join(self.tmpdir.name,name)
+		os.makedirs(target)
+		with open(os.path.join(target,"__init__.py"),"w") as fh:
+			fh.write("def main(inputs,outputs,options):\n\treturn {}\n")
+		with open(os.path.join(target,"openfido.json"),"w") as fh:
+			fh.write("{}")
+		if requirements is not None:
+			with open(os.path.join(target,"requirements.txt"),"w") as fh:
+				fh.write(requirements)
+		return target
+
+	def test_merge(self):
+		targets = {
+			"first" : self.add_product("first","# first\npandas==2.0.0 # data\nrequests>=2\n"),
+			"second" : self.add_product("second","pandas==2.0.0\nrequests>=2\n-r extra.txt\n"),
+			"third" : self.add_product("third",None),
+			}
+		requirements, conflicts = openfido.merge_requirements(targets)
+		self.assertEqual(conflicts,{})
+		self.assertEqual(requirements,["pandas==2.0.0","requests>=2",
+			f"-r {os.path.join(targets['second'],'extra.txt')}"])
+
+	def test_conflict(self):
+		targets = {
+			"first" : self.add_product("first","pandas==2.0.0\n"),
+			"second" : self.add_product("second","numpy==1.26\npandas == 1.5.3\n"),
+			"third" : self.add_product("third","numpy==2.0\n"),
+			}
+		requirements, conflicts = openfido.merge_requirements(targets)
+		self.assertEqual(list(conflicts),["second"])
+		self.assertIn("pandas==1.5.3 conflicts with pandas==2.0.0 required by 'first'",conflicts["second"][0])
+		self.assertEqual(requirements,["pandas==2.0.0","numpy==2.0"])
+
+	def install(self,names,system):
+		catalog = {name:{"manifest":{"application":"openfido", "valid":True, "version":"1.0", "tooltype":"pipeline"}, "error":None} for name in names}
+		with mock.patch.object(openfido,"get_catalog",return_value=catalog), \
+				mock.patch.object(openfido.os,"system",side_effect=system) as call:
+			result = openfido.install(names,self.streams)
+		return result, [args.args[0] for args in call.call_args_list]
+
+	def test_install_conflict(self):
+		self.add_product("first","pandas==2.0.0\n")
+		self.add_product("second","pandas==1.5.3\n")
+		result, commands = self.install(["first","second"],lambda command: 0)
+		self.assertEqual((result["done"],result["failed"]),(["first"],["second"]))
+		self.assertEqual(len(commands),1)
+		self.assertTrue(commands[0].startswith("python3 -m pip install -r "))
+		self.assertTrue(any("pandas==1.5.3" in error for error in self.errors))
+
+	def test_install_unresolved(self):
+		self.add_product("first","pandas>=2\n")
+		second = self.add_product("second","pandas<2\n")
+		def system(command):
+			return 1 if "pip install" in command and not command.endswith("/first/requirements.txt") else 0
+		result, commands = self.install(["first","second"],system)
+		self.assertEqual((result["done"],result["failed"]),(["first"],["second"]))
+		self.assertEqual(len(commands),3)
+		self.assertEqual(self.errors,[f"unable to install '{second}/requirements.txt'"])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,103 @@
+"""Tests of the openfido_pipeline database and the legacy CSV migration"""
+
+import os, sys, sqlite3, tempfile, threading, contextlib, unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+import openfido_pipeline as op
+
+legacy = '''name,docker,github,branch,entry,description
+first,python:3,https://github.com/test/first,main,openfido.sh,First pipeline
+second,python:3,https://github.com/test/second,develop,run.sh,
+'''
+
+class TestPipeline(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.cwd = os.getcwd()
+		os.chdir(self.tmpdir.name)
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		self.tmpdir.cleanup()
+
+	def write_legacy(self,text=legacy):
+		with open(op.pipeline_filename,"w") as fh:
+			fh.write(text)
+
+	def get_version(self):
+		with contextlib.closing(sqlite3.connect(op.pipeline_database)) as conn:
+			return conn.execute("PRAGMA user_version").fetchone()[0]
+
+	def test_migrate(self):
+		self.write_legacy()
+		with contextlib.closing(op.open_pipelines()) as conn:
+			pipelines = op.list_pipelines(conn)
+		self.assertEqual([item["name"] for item in pipelines],["first","second"])
+		self.assertEqual(pipelines[0]["description"],"First pipeline")
+		self.assertEqual((pipelines[1]["branch"],pipelines[1]["entry"],pipelines[1]["description"]),("develop","run.sh",""))
+		self.assertFalse(os.path.exists(op.pipeline_filename))
+		self.assertTrue(os.path.exists(f"{op.pipeline_filename}.migrated"))
+		self.assertEqual(self.get_version(),len(op.pipeline_schema))
+
+	def test_migrate_once(self):
+		self.write_legacy()
+		with contextlib.closing(op.open_pipelines()) as conn:
+			op.delete_pipeline(conn,"first")
+		self.write_legacy()
+		with contextlib.closing(op.open_pipelines()) as conn:
+			self.assertEqual([item["name"] for item in op.list_pipelines(conn)],["second"])
+		self.assertTrue(os.path.exists(op.pipeline_filename))
+
+	def test_no_legacy(self):
+		with contextlib.closing(op.open_pipelines()) as conn:
+			self.assertEqual(op.list_pipelines(conn),[])
+		self.assertFalse(os.path.exists(f"{op.pipeline_filename}.migrated"))
+
+	def test_failed_migration(self):
+		os.makedirs(op.pipeline_filename)
+		with self.assertRaises(Exception):
+			op.open_pipelines()
+		self.assertEqual(self.get_version(),0)
+		self.assertTrue(os.path.isdir(op.pipeline_filename))
+		os.rmdir(op.pipeline_filename)
+		self.write_legacy()
+		with contextlib.closing(op.open_pipelines()) as conn:
+			self.assertEqual(len(op.list_pipelines(conn)),2)
+
+	def test_concurrent_open(self):
+		self.write_legacy()
+		errors = []
+		def open_pipelines():
+			try:
+				with contextlib.closing(op.open_pipelines()) as conn:
+					op.list_pipelines(conn)
+			except Exception as err:
+				errors.append(err)
+		threads = [threading.Thread(target=open_pipelines) for n in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(errors,[])
+		with contextlib.closing(op.open_pipelines()) as conn:
+			self.assertEqual(len(op.list_pipelines(conn)),2)
+		self.assertTrue(os.path.exists(f"{op.pipeline_filename}.migrated"))
+
+	def test_upgrade(self):
+		with contextlib.closing(sqlite3.connect(op.pipeline_database,isolation_level=None)) as conn:
+			for change in op.pipeline_schema[0]:
+				conn.execute(change)
+			conn.execute("INSERT INTO pipelines (name,docker,github,branch,entry) VALUES ('old','python:3','https://github.com/test/old','main','openfido.sh')")
+			conn.execute("PRAGMA user_version=1")
+		self.write_legacy()
+		with contextlib.closing(op.open_pipelines()) as conn:
+			pipelines = op.list_pipelines(conn)
+			self.assertEqual([item["name"] for item in pipelines],["old"])
+			self.assertIsNone(pipelines[0]["cpus"])
+			self.assertEqual(op.get_runs(conn),[])
+		self.assertEqual(self.get_version(),len(op.pipeline_schema))
+		self.assertTrue(os.path.exists(op.pipeline_filename))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,103 @@
+"""Tests of the openfido_runcache product run cache"""
+
+import os, sys, glob, tempfile, unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+import openfido
+import openfido_runcache as rc
+
+streams = {"output":lambda msg: None, "warning":lambda msg: None, "error":lambda msg: None, "verbose":lambda msg: None}
+
+product = '''
+def main(inputs,outputs,options):
+	with open(inputs[0],"r") as fh:
+		rows = [[int(value)*2 for value in line.split(",")] for line in fh.read().split()]
+	with open(outputs[0],"w") as fh:
+		fh.write("\\n".join(",".join(str(value) for value in row) for row in rows))
+	return {"rows":len(rows)}
+'''
+
+class TestRunCache(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.cwd = os.getcwd()
+		os.chdir(self.tmpdir.name)
+		self.saved = {name:getattr(openfido,name) for name in ["cache","run_cache","daemon_socket"]}
+		openfido.cache = os.path.join(self.tmpdir.name,"products")
+		openfido.run_cache = os.path.join(self.tmpdir.name,"runcache")
+		openfido.daemon_socket = None
+		os.makedirs(os.path.join(openfido.cache,"double"))
+		with open(os.path.join(openfido.cache,"double","__init__.py"),"w") as fh:
+			fh.write(product)
+		with open(os.path.join(openfido.cache,"double","openfido.json"),"w") as fh:
+			fh.write("{}")
+		for name, data in {"in.csv":"1,2\n3,4\n", "in2.csv":"5,5\n"}.items():
+			with open(name,"w") as fh:
+				fh.write(data)
+
+	def tearDown(self):
+		for name, value in self.saved.items():
+			setattr(openfido,name,value)
+		os.chdir(self.cwd)
+		self.tmpdir.cleanup()
+
+	def read(self,file):
+		with open(file,"r") as fh:
+			return fh.read()
+
+	def get_stats(self):
+		conn = rc.open_cache(openfido.run_cache)
+		try:
+			return rc.get_stats(conn,openfido.run_cache)
+		finally:
+			conn.close()
+
+	def test_hit(self):
+		self.assertEqual(openfido.run(["double","in.csv","out.csv"],streams),{"rows":2})
+		self.assertEqual(openfido.run(["double","in.csv","out2.csv"],streams),{"rows":2})
+		self.assertEqual(self.read("out2.csv"),"2,4\n6,8")
+		stats = self.get_stats()
+		self.assertEqual((stats["hits"],stats["misses"]),(1,1))
+
+	def test_no_cache_after_hit(self):
+		openfido.run(["double","in.csv","out.csv"],streams)
+		openfido.run(["double","in.csv","out.csv"],streams)
+		openfido.run(["--no-cache","double","in2.csv","out.csv"],streams)
+		self.assertEqual(self.read("out.csv"),"10,10")
+		self.assertEqual(openfido.run(["double","in.csv","out3.csv"],streams),{"rows":2})
+		self.assertEqual(self.read("out3.csv"),"2,4\n6,8")
+		self.assertEqual(self.get_stats()["hits"],2)
+
+	def test_outputs_writable(self):
+		openfido.run(["double","in.csv","out.csv"],streams)
+		openfido.run(["double","in.csv","out2.csv"],streams)
+		with open("out2.csv","a") as fh:
+			fh.write("\n0,0")
+		openfido.run(["double","in.csv","out3.csv"],streams)
+		self.assertEqual(self.read("out3.csv"),"2,4\n6,8")
+
+	def test_damaged_object(self):
+		openfido.run(["double","in.csv","out.csv"],streams)
+		for path in glob.glob(os.path.join(openfido.run_cache,rc.cache_objects,"*","*")):
+			os.chmod(path,0o644)
+			with open(path,"w") as fh:
+				fh.write("0,0")
+		openfido.run(["double","in.csv","out2.csv"],streams)
+		self.assertEqual(self.read("out2.csv"),"2,4\n6,8")
+		stats = self.get_stats()
+		self.assertEqual((stats["hits"],stats["misses"]),(0,2))
+
+	def test_force(self):
+		openfido.run(["double","in.csv","out.csv"],streams)
+		openfido.run(["--force","double","in.csv","out.csv"],streams)
+		self.assertEqual(self.get_stats()["misses"],2)
+		self.assertEqual(self.read("out.csv"),"2,4\n6,8")
+
+	def test_result(self):
+		self.assertIsNotNone(rc.get_result({"a":[1,None]}))
+		self.assertIsNone(rc.get_result({"a":(1,2)}))
+		self.assertIsNone(rc.get_result(object()))
+
+if __name__ == "__main__":
+	unittest.main()
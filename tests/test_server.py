@@ -0,0 +1,84 @@
+"""Tests of the openfido_server settings with a stand-in docker client"""
+
+import os, sys, tempfile, unittest
+from unittest import mock
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+import openfido_server as srv
+
+streams = {"output":lambda msg: None, "warning":lambda msg: None, "error":lambda msg: None, "verbose":lambda msg: None}
+
+class TestServer(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.saved = {name:getattr(srv,name) for name in ["server_script","server_image","server_host","server_ports","server_options","server_log"]}
+		srv.server_script = os.path.join(self.tmpdir.name,"openfido-server")
+		with open(srv.server_script,"w") as fh:
+			fh.write("#!/bin/bash\n")
+
+	def tearDown(self):
+		for name, value in self.saved.items():
+			setattr(srv,name,value)
+		self.tmpdir.cleanup()
+
+	def write_config(self,text):
+		with open(srv.server_script+".conf","w") as fh:
+			fh.write(text)
+
+	def start(self):
+		client = mock.Mock()
+		with mock.patch.object(srv,"status",return_value="STOPPED"), \
+				mock.patch.object(srv,"get_container",return_value=None), \
+				mock.patch.object(srv,"wait_ready"), \
+				mock.patch.object(srv,"follow_log"):
+			srv.start(client,streams)
+		return client.containers.run.call_args
+
+	def test_defaults(self):
+		srv.configure()
+		args = self.start()
+		self.assertEqual(args.args,("openfido/cli:latest",))
+		self.assertEqual(args.kwargs["ports"]["3000/tcp"],("127.0.0.1",3000))
+		self.assertEqual(len(args.kwargs["ports"]),5)
+		self.assertEqual(srv.server_log,"/var/log/openfido.log")
+
+	def test_config(self):
+		self.write_config('# local settings\nHOSTNAME="0.0.0.0"\nPORTNUM=8080\nOPTIONS="-e DEBUG=1 --memory=2g -v /data:/data:ro"\nLOGFILE=server.log\n')
+		srv.configure({"IMAGENAME":"openfido/cli:test"})
+		args = self.start()
+		self.assertEqual(args.args,("openfido/cli:test",))
+		self.assertEqual(args.kwargs["ports"]["8080/tcp"],("0.0.0.0",3000))
+		self.assertNotIn("3000/tcp",args.kwargs["ports"])
+		self.assertEqual(args.kwargs["environment"],["DEBUG=1"])
+		self.assertEqual(args.kwargs["mem_limit"],"2g")
+		self.assertEqual(args.kwargs["volumes"]["/data"],{"bind":"/data", "mode":"ro"})
+		self.assertIn("/tmp",args.kwargs["volumes"])
+		self.assertEqual(srv.server_log,"server.log")
+
+	def test_override(self):
+		self.write_config("PORTNUM=8080\n")
+		srv.configure({"PORTNUM":"9090", "HOSTNAME":"10.0.0.1"})
+		self.assertEqual(srv.server_ports[3000],9090)
+		self.assertEqual(srv.server_host,"10.0.0.1")
+
+	def test_invalid_options(self):
+		with self.assertRaises(Exception):
+			srv.get_run_options(["--privileged"])
+		with self.assertRaises(Exception):
+			srv.get_run_options(["-e"])
+		self.write_config("PORTNUM=web\n")
+		with self.assertRaises(Exception):
+			srv.configure()
+
+	def test_log(self):
+		container = mock.Mock()
+		container.logs.return_value = iter([b"one\n",b"two\n"])
+		log = os.path.join(self.tmpdir.name,"server.log")
+		srv.write_log(container,log)
+		container.logs.assert_called_with(stream=True,follow=True)
+		with open(log,"r") as fh:
+			self.assertEqual(fh.read(),"one\ntwo\n")
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,73 @@
+"""Tests of the cold-start budget of the lightweight openfido commands
+
+Each command runs in a new python process that times the run of the
+`openfido` script's main function and checks that no heavy module is imported.
+The budget is set by the environment variable `STARTUP_BUDGET`.
+"""
+
+import os, sys, json, tempfile, subprocess, unittest
+
+srcdir = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src")
+budget = float(os.getenv("STARTUP_BUDGET","0.25")) # seconds allowed for a command run
+heavy_modules = ["pandas","requests","docker"] # modules the lightweight commands must not import
+
+child = '''
+import sys, io, time, json, runpy
+sys.path.insert(1,{srcdir!r})
+started = time.perf_counter()
+sys.stdout = io.StringIO()
+try:
+	runpy.run_path({script!r})["main"]("openfido",*{args!r})
+except SystemExit:
+	pass
+output, sys.stdout = sys.stdout.getvalue(), sys.__stdout__
+print(json.dumps({{"elapsed":time.perf_counter()-started, "output":output, "modules":sorted(set({heavy!r}).intersection(sys.modules))}}))
+'''
+
+class TestStartup(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		cache = os.path.join(self.tmpdir.name,"products")
+		os.makedirs(os.path.join(cache,"example"))
+		with open(os.path.join(cache,"example","__init__.py"),"w") as fh:
+			fh.write("def main(inputs,outputs,options):\n\treturn {}\n")
+		with open(os.path.join(cache,"example","openfido.json"),"w") as fh:
+			fh.write("{}")
+		with open(os.path.join(srcdir,"..","dev","openfido_config.py"),"r") as fh:
+			settings = fh.read()
+		with open(os.path.join(self.tmpdir.name,"openfido_config.py"),"w") as fh:
+			fh.write(f"{settings}\ncache = {cache!r}\n")
+
+	def tearDown(self):
+		self.tmpdir.cleanup()
+
+	def run_command(self,*args):
+		code = child.format(srcdir=os.path.abspath(srcdir),script=os.path.join(os.path.abspath(srcdir),"openfido"),args=args,heavy=heavy_modules)
+		result = subprocess.run([sys.executable,"-c",code],cwd=self.tmpdir.name,capture_output=True,text=True)
+		self.assertEqual(result.returncode,0,result.stderr)
+		return json.loads(result.stdout.strip().split("\n")[-1])
+
+	def check_command(self,*args):
+		self.run_command(*args) # warm up the disk cache and the product registry
+		result = self.run_command(*args)
+		name = " ".join(args)
+		self.assertTrue(result["output"],f"{name} has no output")
+		self.assertEqual(result["modules"],[],f"{name} imports {result['modules']}")
+		self.assertLess(result["elapsed"],budget,f"{name} run {result['elapsed']:.3f} s exceeds {budget} s budget")
+		return result
+
+	def test_version(self):
+		self.check_command("version")
+
+	def test_config(self):
+		self.check_command("config")
+
+	def test_help(self):
+		self.check_command("help")
+
+	def test_show(self):
+		self.assertEqual(self.check_command("show")["output"].split(),["example"])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,45 @@
+"""Tests of the openfido_util input and output functions"""
+
+import os, sys, tempfile, unittest
+import pandas
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+import openfido_util as ou
+
+class TestUtil(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.data = pandas.DataFrame({"x":range(5), "y":[n/2 for n in range(5)]})
+
+	def tearDown(self):
+		self.tmpdir.cleanup()
+
+	def path(self,name):
+		return os.path.join(self.tmpdir.name,name)
+
+	def test_compressed_binary(self):
+		for name in ["data.parquet.gz","data.feather.gz","data.arrow.gz"]:
+			ou.write_output(self.data,self.path(name),[])
+			result = ou.read_input(self.path(name),[])
+			self.assertTrue(result.equals(self.data),name)
+
+	def test_chunks_header(self):
+		file = self.path("chunks.csv")
+		chunks = [self.data.iloc[0:0],self.data.iloc[0:2],self.data.iloc[2:]]
+		rows = ou.write_output_chunks(iter(chunks),file,["--csv-write-header=True"])
+		self.assertEqual(rows,5)
+		with open(file,"r") as fh:
+			lines = fh.read().split()
+		self.assertEqual(lines[0],"x,y")
+		self.assertEqual(len(lines),6)
+
+	def test_chunks_compressed(self):
+		file = self.path("chunks.csv.gz")
+		ou.write_output_chunks(iter([self.data.iloc[0:2],self.data.iloc[2:]]),file,["--csv-write-header=True"])
+		chunks = list(ou.read_input_chunks(file,["--csv-read-header=0"],chunksize=2))
+		self.assertEqual([len(chunk) for chunk in chunks],[2,2,1])
+		self.assertTrue(pandas.concat(chunks,ignore_index=True).equals(self.data))
+
+if __name__ == "__main__":
+	unittest.main()
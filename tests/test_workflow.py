@@ -0,0 +1,92 @@
+"""Tests of the openfido_workflow executor with stand-in pipeline runs"""
+
+import os, sys, json, tempfile, threading, contextlib, unittest
+from unittest import mock
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+import openfido_pipeline as op
+import openfido_workflow as ow
+
+streams = {"output":lambda msg: None, "warning":lambda msg: None, "error":lambda msg: None, "verbose":lambda msg: None}
+
+class TestWorkflow(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.cwd = os.getcwd()
+		os.chdir(self.tmpdir.name)
+		self.inputs = {}
+		self.lock = threading.Lock()
+		os.makedirs("input")
+		with open(os.path.join("input","data.csv"),"w") as fh:
+			fh.write("x\n1\n")
+		with contextlib.closing(op.open_pipelines()) as conn:
+			for name in ["first","second","merge","last"]:
+				op.add_pipeline(conn,{"name":name, "docker":"python:3", "github":f"https://github.com/test/{name}",
+					"branch":"main", "entry":"openfido.sh"})
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		self.tmpdir.cleanup()
+
+	def runlocal_recorded(self,conn,spec,inputfolder,outputfolder,**kwargs):
+		"""Stand-in for a pipeline run that writes its logs, an output and its run record"""
+		with self.lock:
+			self.inputs[os.path.basename(outputfolder)] = sorted(os.listdir(inputfolder))
+		for name in ow.step_logs:
+			with open(os.path.join(outputfolder,name),"w") as fh:
+				fh.write("")
+		with open(os.path.join(outputfolder,f"{spec['name']}.csv"),"w") as fh:
+			fh.write("x\n1\n")
+		with open(os.path.join(outputfolder,op.run_record),"w") as fh:
+			json.dump({"pipeline":spec["name"], "status":0},fh)
+		return 0
+
+	def run_workflow(self,steps):
+		spec = {"name":"test", "steps":steps}
+		with mock.patch.object(op,"runlocal_recorded",self.runlocal_recorded):
+			return ow.run_workflow(spec,"input","output",workers=2,stream=streams)
+
+	def test_fan_in(self):
+		report = self.run_workflow({
+			"first" : {"pipeline":"first"},
+			"second" : {"pipeline":"second"},
+			"merge" : {"pipeline":"merge", "inputs":["first","second"]},
+			"last" : {"pipeline":"last", "inputs":["merge"]},
+			})
+		self.assertEqual({name:step["status"] for name, step in report.items()},
+			{"first":0, "second":0, "merge":0, "last":0})
+		self.assertEqual(self.inputs["first"],["data.csv"])
+		self.assertEqual(self.inputs["merge"],["first.csv","second.csv"])
+		self.assertEqual(self.inputs["last"],["merge.csv"])
+
+	def test_single_file(self):
+		report = self.run_workflow({
+			"first" : {"pipeline":"first"},
+			"last" : {"pipeline":"last", "inputs":["first:first.csv","input"]},
+			})
+		self.assertEqual(report["last"]["status"],0)
+		self.assertEqual(self.inputs["last"],["data.csv","first.csv"])
+
+	def test_duplicate_input(self):
+		report = self.run_workflow({
+			"first" : {"pipeline":"first"},
+			"last" : {"pipeline":"last", "inputs":["first","first:first.csv"]},
+			})
+		self.assertEqual(report["first"]["status"],0)
+		self.assertEqual(report["last"]["status"],1)
+		self.assertIn("more than once",report["last"]["error"])
+
+	def test_skipped(self):
+		with self.assertRaises(Exception):
+			ow.check_workflow({"name":"test", "steps":{"a":{"pipeline":"a", "inputs":["b"]}, "b":{"pipeline":"b", "after":["a"]}}})
+		report = self.run_workflow({
+			"first" : {"pipeline":"missing"},
+			"last" : {"pipeline":"last", "inputs":["first"]},
+			})
+		self.assertEqual(report["first"]["status"],1)
+		self.assertIsNone(report["last"]["status"])
+		self.assertNotIn("last",self.inputs)
+
+if __name__ == "__main__":
+	unittest.main()